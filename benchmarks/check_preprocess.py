@@ -0,0 +1,129 @@
+######################################################################################################
+# Checks the per-image pre-processing used by the GUI against the original set-wide calls, on the
+# synthetic images of pipeline_benchmarks.py:
+#   - color correcting each image on its own, color_correction([ref, img], 0)[1], gives the same
+#     result as color_correction(imgs, ref_idx) over the whole set
+#   - the pre-processing cache never shares files between distinct image names (e.g. 'a b' & 'a_b')
+#
+# Run from the repository root:
+#     python benchmarks/check_preprocess.py
+# Exits with a non-zero status if a check fails. The color correction check needs ifmap.
+######################################################################################################
+
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.pipeline_benchmarks import make_synthetic_image
+from gui import preprocess
+
+# color casts applied to the synthetic images, so the reference matters
+SYNTHETIC_CASTS = [(1.0, 1.0, 1.0), (1.2, 0.9, 0.8), (0.8, 1.1, 1.3), (0.9, 0.7, 1.0)]
+
+
+def make_image_set(size, n_regions):
+    imgs = []
+
+    for i, cast in enumerate(SYNTHETIC_CASTS):
+        rgb_img, _ = make_synthetic_image(size, n_regions, seed=i)
+        rgb_img = np.clip(rgb_img * np.array(cast), 0, 255).astype(np.uint8)
+        imgs.append(rgb_img)
+
+    return imgs
+
+
+def check_cache_names(cache_dir):
+    cache = preprocess.PreprocessCache(cache_dir)
+    img_names = ['a b.tif', 'a_b.tif', 'a.b.tif', 'a']
+
+    for img_name in img_names:
+        preprocess.save_array(cache.luminance_path(img_name), np.zeros(1))
+        preprocess.save_array(cache.thumbnail_path(img_name), np.zeros(1))
+
+        for ref_img_name in img_names:
+            preprocess.save_array(
+                cache.corrected_path(img_name, ref_img_name),
+                np.zeros(1)
+            )
+
+    assert len(os.listdir(cache_dir)) == len(img_names) * (len(img_names) + 2)
+
+    # invalidating one image only removes its own files & the images
+    # corrected against it
+    cache.invalidate('a b.tif')
+
+    for img_name in img_names:
+        assert cache.has_luminance(img_name) == (img_name != 'a b.tif')
+
+        for ref_img_name in img_names:
+            assert cache.has_corrected(img_name, ref_img_name) == (
+                'a b.tif' not in (img_name, ref_img_name)
+            )
+
+    print("cache names: ok")
+
+
+def check_color_correction(work_dir, size, n_regions):
+    from ifmap import utils as ifmap_utils
+
+    lum_paths = []
+
+    for i, rgb_img in enumerate(make_image_set(size, n_regions)):
+        rgb_path = os.path.join(work_dir, '%d.rgb.npy' % i)
+        preprocess.save_array(rgb_path, rgb_img)
+
+        lum_path = os.path.join(work_dir, '%d.lum.npy' % i)
+        preprocess.luminance_correct(
+            rgb_path,
+            lum_path,
+            os.path.join(work_dir, '%d.thumb.npy' % i)
+        )
+        lum_paths.append(lum_path)
+
+    lum_imgs = [np.load(path) for path in lum_paths]
+    ref_img_idx = ifmap_utils.find_color_correction_reference(lum_imgs)
+
+    # the original set-wide call
+    set_corr_imgs = ifmap_utils.color_correction(lum_imgs, ref_img_idx)
+
+    for i, lum_path in enumerate(lum_paths):
+        corr_path = os.path.join(work_dir, '%d.corr.npy' % i)
+        preprocess.color_correct(lum_paths[ref_img_idx], lum_path, corr_path)
+        corr_img = np.load(corr_path)
+
+        max_diff = np.abs(
+            corr_img.astype(np.float64) - np.asarray(set_corr_imgs[i], np.float64)
+        ).max()
+        print("image %d: max abs difference %g" % (i, max_diff))
+
+        assert corr_img.shape == np.shape(set_corr_imgs[i])
+        assert max_diff == 0
+
+    print("color correction (%dpx): ok" % size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check per-image pre-processing')
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--regions', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        check_cache_names(cache_dir)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            check_color_correction(work_dir, args.size, args.regions)
+    except ImportError as e:
+        # the comparison is meaningless without the real ifmap functions
+        print("color correction: skipped (%s)" % e)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
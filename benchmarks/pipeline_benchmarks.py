@@ -0,0 +1,453 @@
+######################################################################################################
+# Times the evaluation, region splitting & segmentation code on synthetic lung-like images: a dark
+# blue (DAPI) background with green, red & white blob structures, saved as .tif files alongside a
+# matching regions.json, so no real image set is needed.
+#
+# Run from the repository root:
+#     python benchmarks/pipeline_benchmarks.py --output results.json
+# and to catch regressions against an earlier run:
+#     python benchmarks/pipeline_benchmarks.py --baseline results.json
+# Benchmarks whose dependencies aren't installed (e.g. ifmap for segmentation) are skipped.
+######################################################################################################
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import numpy as np
+from PIL import Image
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+DEFAULT_SIZES = [512, 1024, 2048]
+DEFAULT_REGION_COUNTS = [25, 100, 400]
+
+# the structure labels of the synthetic regions & the (HSV) color of each
+SYNTHETIC_STRUCTURES = {
+    'distal acinar tubule bud': (60, 200, 200),
+    'pulmonary artery': (0, 200, 190),
+    'bronchiole': (0, 0, 220)
+}
+
+# probes of the synthetic images, for the seg config
+SYNTHETIC_PROBES = ['Anti-Sox9', 'Anti-Acta2', 'Anti-Sftpc']
+SYNTHETIC_PROBE_COLORS = ['green', 'red', 'white']
+
+# a run is a regression if its median is this many times the baseline's
+DEFAULT_TOLERANCE = 1.25
+
+
+def make_synthetic_image(size, n_regions, seed=0):
+    # Returns an RGB image & its regions, a list of (label, (n, 2) points).
+    # Structures are ellipses of lung-like sizes & colors, some overlapping.
+    rng = np.random.RandomState(seed)
+
+    hsv_img = np.zeros((size, size, 3), dtype=np.uint8)
+    hsv_img[:, :, 0] = 120
+    hsv_img[:, :, 1] = rng.randint(100, 180, (size, size))
+    hsv_img[:, :, 2] = rng.randint(20, 60, (size, size))
+
+    labels = sorted(SYNTHETIC_STRUCTURES)
+    regions = []
+
+    # region sizes scale with the image so region count sets the density
+    max_axis = max(8, int(size / np.sqrt(n_regions) / 2))
+
+    for i in range(n_regions):
+        label = labels[i % len(labels)]
+        center = (int(rng.randint(0, size)), int(rng.randint(0, size)))
+        axes = (
+            int(rng.randint(max_axis // 3, max_axis + 1)),
+            int(rng.randint(max_axis // 3, max_axis + 1))
+        )
+        angle = int(rng.randint(0, 180))
+
+        points = cv2.ellipse2Poly(center, axes, angle, 0, 360, 10)
+        points = np.clip(points, 0, size - 1)
+
+        cv2.fillPoly(hsv_img, [points], SYNTHETIC_STRUCTURES[label])
+        regions.append((label, points))
+
+    # blur the edges like a fluorescence image
+    hsv_img = cv2.GaussianBlur(hsv_img, (5, 5), 0)
+
+    return cv2.cvtColor(hsv_img, cv2.COLOR_HSV2RGB), regions
+
+
+def write_image_set(image_set_dir, size, n_regions, n_images=2):
+    # writes the images & a regions.json in the layout read by
+    # get_training_data_for_image_set
+    regions_json = {}
+
+    for i in range(n_images):
+        img_name = 'synthetic_%d_%d_%03d.tif' % (size, n_regions, i)
+        rgb_img, regions = make_synthetic_image(size, n_regions, seed=i)
+
+        Image.fromarray(rgb_img).save(os.path.join(image_set_dir, img_name))
+
+        img_regions = {}
+        for label, points in regions:
+            img_regions.setdefault(label, []).append(points.tolist())
+        regions_json[img_name] = img_regions
+
+    with open(os.path.join(image_set_dir, 'regions.json'), 'w') as f:
+        json.dump(regions_json, f)
+
+
+def make_test_regions(true_regions, seed=0):
+    # Predictions to evaluate against the true regions: a shifted copy of
+    # most true regions with a mostly correct label, plus false positives.
+    # Each has the 'prob' key used by generate_iou_pred_matrices & the
+    # 'label' dict used by generate_dataframe_aggregation_tp_fn_fp.
+    rng = np.random.RandomState(seed)
+    labels = sorted(SYNTHETIC_STRUCTURES)
+    height, width = true_regions['hsv_img'].shape[:2]
+    test_regions = []
+
+    def make_prob(label):
+        prob = {l: float(rng.uniform(0.0, 0.2)) for l in labels}
+        prob[label] = float(rng.uniform(0.5, 1.0))
+        return prob
+
+    for region in true_regions['regions']:
+        if rng.uniform() < 0.1:
+            continue
+
+        shift = rng.randint(-4, 5, 2)
+        points = np.clip(region['points'] + shift, 0, [width - 1, height - 1])
+
+        label = region['label'] if rng.uniform() < 0.8 else labels[rng.randint(len(labels))]
+        prob = make_prob(label)
+        test_regions.append({'points': points, 'prob': prob, 'label': {'prob': prob}})
+
+    for _ in range(len(true_regions['regions']) // 5):
+        center = (int(rng.randint(0, width)), int(rng.randint(0, height)))
+        points = cv2.ellipse2Poly(center, (10, 10), 0, 0, 360, 20)
+        prob = make_prob(labels[rng.randint(len(labels))])
+        test_regions.append({'points': points, 'prob': prob, 'label': {'prob': prob}})
+
+    return test_regions
+
+
+def time_calls(func, repeat):
+    durations = []
+    result = None
+
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - t_start)
+
+    return {
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'runs': durations
+    }, result
+
+
+def bench_evaluation(image_set_dir, repeat):
+    # matplotlib must not open windows for display_class_prediction_overlaps
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from eval import evaluation
+
+    results = {}
+
+    timing, training_data = time_calls(
+        lambda: evaluation.get_training_data_for_image_set(image_set_dir),
+        repeat
+    )
+    results['get_training_data_for_image_set'] = timing
+
+    img_name = sorted(training_data)[0]
+    true_regions = training_data[img_name]
+    test_regions = make_test_regions(true_regions)
+
+    timing, (iou_mat, pred_mat) = time_calls(
+        lambda: evaluation.generate_iou_pred_matrices(true_regions, test_regions),
+        repeat
+    )
+    results['generate_iou_pred_matrices'] = timing
+
+    timing, (tp, fn, fp) = time_calls(
+        lambda: evaluation.generate_tp_fn_fp(iou_mat, pred_mat),
+        repeat
+    )
+    results['generate_tp_fn_fp'] = timing
+
+    timing, (_, segments) = time_calls(
+        lambda: evaluation.generate_dataframe_aggregation_tp_fn_fp(
+            true_regions,
+            test_regions,
+            iou_mat,
+            pred_mat,
+            tp,
+            fn,
+            fp
+        ),
+        repeat
+    )
+    results['generate_dataframe_aggregation_tp_fn_fp'] = timing
+
+    rgb_img = cv2.cvtColor(true_regions['hsv_img'], cv2.COLOR_HSV2RGB)
+
+    def display_overlaps():
+        evaluation.display_class_prediction_overlaps(
+            rgb_img,
+            segments,
+            true_regions,
+            test_regions,
+            figsize=(4, 4)
+        )
+        plt.close('all')
+
+    timing, _ = time_calls(display_overlaps, repeat)
+    results['display_class_prediction_overlaps'] = timing
+
+    return results
+
+
+def bench_split(image_set_dir, repeat):
+    from gui import split
+
+    # the largest synthetic region, as split in the GUI from the RGB memmap
+    img_name = sorted(f for f in os.listdir(image_set_dir) if f.endswith('.tif'))[0]
+    rgb_img = np.asarray(Image.open(os.path.join(image_set_dir, img_name)).convert('RGB'))
+    rgb_path = os.path.join(image_set_dir, 'split.npy')
+    np.save(rgb_path, rgb_img)
+
+    f = open(os.path.join(image_set_dir, 'regions.json'), 'r')
+    regions = json.load(f)[img_name]
+    f.close()
+
+    contours = [
+        np.array(points, dtype=np.int32).reshape(-1, 1, 2)
+        for label_regions in regions.values() for points in label_regions
+    ]
+    contour = max(contours, key=cv2.contourArea)
+    contour_path = os.path.join(image_set_dir, 'split_contour.npy')
+    np.save(contour_path, contour)
+
+    results = {}
+
+    # A spectral split in a fresh interpreter, like a newly started GUI
+    # worker, so it includes importing everything the split needs. The
+    # interpreter's own startup with numpy & cv2 is timed for reference.
+    def run_python(code):
+        subprocess.run(
+            [sys.executable, '-c', code, REPO_DIR, rgb_path, contour_path],
+            check=True
+        )
+
+    timing, _ = time_calls(lambda: run_python('import numpy, cv2'), repeat)
+    results['python_startup'] = timing
+
+    timing, _ = time_calls(
+        lambda: run_python(
+            'import sys; sys.path.insert(0, sys.argv[1]); import numpy as np; '
+            'from gui import split; '
+            'split.split_region(sys.argv[2], np.load(sys.argv[3]), n_clusters=3, seed=0)'
+        ),
+        repeat
+    )
+    results['split_region_spectral_cold'] = timing
+
+    for method in split.SPLIT_METHODS:
+        timing, _ = time_calls(
+            lambda: split.split_region(rgb_path, contour, n_clusters=3, method=method, seed=0),
+            repeat
+        )
+        results['split_region_%s' % method] = timing
+
+    # split previews re-cluster a cached embedding
+    region_embedding = split.compute_embedding(rgb_path, contour)
+    timing, _ = time_calls(
+        lambda: split.split_embedding(region_embedding, 3, seed=0),
+        repeat
+    )
+    results['split_embedding'] = timing
+
+    return results
+
+
+def load_build_seg_config():
+    # Application.build_seg_config, the GUI module loads its resources
+    # relative to the gui directory when imported
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.join(REPO_DIR, 'gui'))
+    os.chdir(os.path.join(REPO_DIR, 'gui'))
+
+    try:
+        import lungmap_pipeline
+    finally:
+        os.chdir(cwd)
+
+    return lungmap_pipeline.Application.build_seg_config, lungmap_pipeline.PROBE_STRUCTURE_MAP
+
+
+def bench_segmentation(image_set_dir, repeat):
+    from gui import segmentation
+
+    build_seg_config, probe_structure_map = load_build_seg_config()
+
+    img_name = sorted(f for f in os.listdir(image_set_dir) if f.endswith('.tif'))[0]
+    rgb_img = np.asarray(Image.open(os.path.join(image_set_dir, img_name)).convert('RGB'))
+    rgb_path = os.path.join(image_set_dir, 'segment.npy')
+    np.save(rgb_path, rgb_img)
+
+    # build_seg_config only needs the image's probe metadata
+    app = types.SimpleNamespace(
+        current_img=img_name,
+        images={
+            img_name: {
+                'probes': SYNTHETIC_PROBES,
+                'probe_colors': SYNTHETIC_PROBE_COLORS,
+                'probe_structure_map': {
+                    p: probe_structure_map.get(p, {'has_part': [], 'surrounded_by': []})
+                    for p in SYNTHETIC_PROBES
+                }
+            }
+        }
+    )
+    cell_size = np.pi * (16 ** 2)
+    seg_config = build_seg_config(app, cell_size)
+
+    def segment():
+        # a new cache directory every run, so results aren't just loaded
+        with tempfile.TemporaryDirectory() as cache_dir:
+            return segmentation.segment_image(rgb_path, seg_config, cell_size, cache_dir=cache_dir)
+
+    timing, _ = time_calls(segment, repeat)
+
+    return {'segment_image': timing}
+
+
+BENCHMARKS = [
+    ('evaluation', bench_evaluation),
+    ('split', bench_split),
+    ('segmentation', bench_segmentation)
+]
+
+
+def git_revision():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=REPO_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return result.stdout.decode().strip()
+
+
+def compare(results, baseline, tolerance):
+    # prints the change in median time of every case run in both, returns
+    # the cases slower than tolerance times the baseline
+    regressions = []
+
+    for name, cases in sorted(results['results'].items()):
+        for case, timing in sorted(cases.items()):
+            try:
+                baseline_median = baseline['results'][name][case]['median']
+            except KeyError:
+                continue
+
+            ratio = timing['median'] / baseline_median if baseline_median > 0 else float('inf')
+            flag = ''
+            if ratio > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((name, case, ratio))
+
+            print("%-42s %-12s %8.3fx%s" % (name, case, ratio, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic images')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--regions', type=int, nargs='+', default=DEFAULT_REGION_COUNTS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--only',
+        nargs='+',
+        choices=[name for name, _ in BENCHMARKS],
+        help='benchmarks to run, all by default'
+    )
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = {
+        'rev': git_revision(),
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'params': {
+            'sizes': args.sizes,
+            'regions': args.regions,
+            'repeat': args.repeat
+        },
+        'results': {},
+        'skipped': {}
+    }
+    timings = {}
+
+    for name, bench in BENCHMARKS:
+        if args.only is not None and name not in args.only:
+            continue
+
+        try:
+            for size in args.sizes:
+                for n_regions in args.regions:
+                    case = '%dpx_%dregions' % (size, n_regions)
+
+                    with tempfile.TemporaryDirectory() as image_set_dir:
+                        write_image_set(image_set_dir, size, n_regions)
+                        case_results = bench(image_set_dir, args.repeat)
+
+                    for bench_name, timing in case_results.items():
+                        timings.setdefault(bench_name, {})[case] = timing
+                        print("%-42s %-18s median %.4f s" % (bench_name, case, timing['median']))
+        except ImportError as e:
+            # e.g. ifmap or ttkthemes aren't installed
+            results['skipped'][name] = str(e)
+            print("%-42s skipped (%s)" % (name, e))
+
+    results['results'] = timings
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        f = open(args.baseline, 'r')
+        baseline = json.load(f)
+        f.close()
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        if len(regressions) > 0:
+            print("%d regressions" % len(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+######################################################################################################
+# Measures GUI cold-start time: a fresh interpreter importing gui/lungmap_pipeline.py, building the
+# Application & processing its first round of events (i.e. the window is up and responsive).
+#
+# Run from the repository root, a display is required:
+#     python benchmarks/startup_time.py
+# To compare against another revision (e.g. before the lazy startup changes):
+#     python benchmarks/startup_time.py --rev <git revision>
+######################################################################################################
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+STARTUP_SNIPPET = """
+import json
+import time
+t_start = time.perf_counter()
+import ttkthemes as themed_tk
+import lungmap_pipeline
+t_import = time.perf_counter()
+root = themed_tk.ThemedTk()
+root.set_theme('arc')
+app = lungmap_pipeline.Application(root)
+root.update()
+t_window = time.perf_counter()
+print(json.dumps({'import': t_import - t_start, 'window': t_window - t_start}))
+root.destroy()
+"""
+
+
+def export_revision(rev, dest_dir):
+    archive_path = os.path.join(dest_dir, 'rev.tar')
+
+    with open(archive_path, 'wb') as f:
+        subprocess.run(['git', 'archive', rev], stdout=f, check=True)
+
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(dest_dir)
+
+    return dest_dir
+
+
+def time_startup(repo_dir):
+    # the GUI loads its resources relative to the gui directory, and imports
+    # sibling packages (gui, common) from the repository root
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [repo_dir, os.path.join(repo_dir, 'gui'), env.get('PYTHONPATH', '')]
+    )
+
+    t_start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_SNIPPET],
+        cwd=os.path.join(repo_dir, 'gui'),
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True
+    )
+    t_total = time.perf_counter() - t_start
+
+    timings = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    timings['process'] = t_total
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure GUI cold-start time')
+    parser.add_argument('--rev', help='git revision to benchmark instead of the working tree')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='JSON file to write results to')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.rev is not None:
+            repo_dir = export_revision(args.rev, tmp_dir)
+        else:
+            repo_dir = os.getcwd()
+
+        runs = [time_startup(repo_dir) for _ in range(args.runs)]
+
+    results = {
+        'rev': args.rev or 'working tree',
+        'runs': runs
+    }
+
+    for key in ['import', 'window', 'process']:
+        values = [r[key] for r in runs]
+        results[key] = {
+            'min': min(values),
+            'median': statistics.median(values)
+        }
+        print(
+            "%-8s min %.3f s, median %.3f s" % (
+                key, results[key]['min'], results[key]['median']
+            )
+        )
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
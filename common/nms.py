@@ -0,0 +1,80 @@
+import numpy as np
+from common.spatial import GridIndex, contour_bboxes
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+# candidates overlapping a kept candidate by more than this are suppressed
+DEFAULT_IOU_THRESHOLD = 0.5
+
+
+def contour_mask(contour, bbox):
+    # filled mask of a contour, local to its bounding box
+    x1, y1, x2, y2 = bbox
+    mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+    local_contour = np.asarray(contour).reshape(-1, 1, 2).astype(np.int32) - [x1, y1]
+    cv2.drawContours(mask, [local_contour], -1, 1, -1)
+
+    return mask.astype(np.bool_)
+
+
+def mask_intersection(mask_a, bbox_a, mask_b, bbox_b):
+    # number of pixels in both masks, only the overlap of the boxes is compared
+    x1 = max(bbox_a[0], bbox_b[0])
+    y1 = max(bbox_a[1], bbox_b[1])
+    x2 = min(bbox_a[2], bbox_b[2])
+    y2 = min(bbox_a[3], bbox_b[3])
+
+    if x1 >= x2 or y1 >= y2:
+        return 0
+
+    crop_a = mask_a[y1 - bbox_a[1]:y2 - bbox_a[1], x1 - bbox_a[0]:x2 - bbox_a[0]]
+    crop_b = mask_b[y1 - bbox_b[1]:y2 - bbox_b[1], x1 - bbox_b[0]:x2 - bbox_b[0]]
+
+    return int(np.count_nonzero(crop_a & crop_b))
+
+
+def suppress_duplicates(contours, iou_threshold=DEFAULT_IOU_THRESHOLD):
+    """
+    Mask based non-maximum suppression: candidates are visited largest first
+    and dropped if their filled mask overlaps an already kept candidate with
+    an intersection over union above iou_threshold. Near duplicates, e.g.
+    from overlapping segmentation stages, are reduced to their largest copy.
+
+    Only candidates with overlapping bounding boxes (found with a grid index)
+    are compared, using masks local to each candidate's box.
+
+    Returns the kept contours, in their original order.
+    """
+    if len(contours) == 0:
+        return []
+
+    bboxes = contour_bboxes(contours)
+    masks = [contour_mask(c, b) for c, b in zip(contours, bboxes)]
+    areas = np.array([np.count_nonzero(m) for m in masks])
+
+    # size the grid cells to the typical candidate
+    box_sides = np.maximum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+    index = GridIndex(cell_size=max(16, int(np.median(box_sides))))
+
+    kept = []
+
+    for i in np.argsort(-areas, kind='stable'):
+        duplicate = False
+
+        for j in index.query_bbox(bboxes[i]):
+            inter = mask_intersection(masks[i], bboxes[i], masks[j], bboxes[j])
+            union = areas[i] + areas[j] - inter
+
+            if union > 0 and inter / float(union) > iou_threshold:
+                duplicate = True
+                break
+
+        if not duplicate:
+            index.insert(i, bboxes[i])
+            kept.append(i)
+
+    return [contours[i] for i in sorted(kept)]
@@ -0,0 +1,243 @@
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join('tmp', 'seg_cache')
+
+# least recently used results are removed once the cache is larger than this
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+# bump when the stored results change meaning, e.g. a new contour format
+CACHE_FORMAT_VERSION = 1
+
+# generate_structure_candidates arguments that don't affect the result
+IGNORED_ARGS = {'plot', 'progress_callback'}
+
+
+def normalize_seg_config(value):
+    # Converts a seg_config (or any argument value) to a canonical,
+    # JSON serializable form: sets are sorted & tuples become lists so
+    # equivalent configs always produce the same key
+    if isinstance(value, dict):
+        return {str(k): normalize_seg_config(v) for k, v in value.items()}
+    elif isinstance(value, (set, frozenset)):
+        return sorted(normalize_seg_config(v) for v in value)
+    elif isinstance(value, (list, tuple)):
+        return [normalize_seg_config(v) for v in value]
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=20)
+
+    with open(path, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, 1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def ifmap_version():
+    # The installed ifmap's version & a digest of its source, so results
+    # are recomputed after upgrading it (even from git without a version
+    # bump). Found without importing ifmap, which is slow.
+    try:
+        version = importlib.metadata.version('ifmap')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+
+    spec = importlib.util.find_spec('ifmap')
+    if spec is None or not spec.submodule_search_locations:
+        return [version, None]
+
+    digest = hashlib.blake2b(digest_size=20)
+
+    for package_dir in spec.submodule_search_locations:
+        for dir_path, dir_names, file_names in os.walk(package_dir):
+            dir_names.sort()
+
+            for file_name in sorted(file_names):
+                if file_name.endswith('.py'):
+                    file_path = os.path.join(dir_path, file_name)
+                    digest.update(os.path.relpath(file_path, package_dir).encode())
+                    digest.update(file_digest(file_path).encode())
+
+    return [version, digest.hexdigest()]
+
+
+def make_cache_key(hsv_img, seg_config, predict_model_path=None, **kwargs):
+    # predict_model objects have no stable identity, the file the model was
+    # loaded from identifies it instead
+    digest = hashlib.blake2b(digest_size=20)
+
+    hsv_img = np.ascontiguousarray(hsv_img)
+    digest.update(str((hsv_img.shape, hsv_img.dtype.str)).encode())
+    digest.update(hsv_img.data)
+
+    params = {
+        'cache_format': CACHE_FORMAT_VERSION,
+        'ifmap': ifmap_version(),
+        'seg_config': normalize_seg_config(seg_config)
+    }
+
+    for arg, value in kwargs.items():
+        if arg in IGNORED_ARGS or arg == 'predict_model':
+            continue
+
+        params[arg] = normalize_seg_config(value)
+
+    if predict_model_path is not None:
+        params['predict_model'] = file_digest(predict_model_path)
+
+    digest.update(json.dumps(params, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def pack_contours(contours):
+    # stores a list of contours as a flat vertex array plus the offset of
+    # each contour's first vertex
+    lengths = [len(c) for c in contours]
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+
+    if len(contours) > 0:
+        vertices = np.concatenate(
+            [np.asarray(c).reshape(-1, 2) for c in contours]
+        ).astype(np.int32)
+    else:
+        vertices = np.empty((0, 2), dtype=np.int32)
+
+    return vertices, offsets
+
+
+def unpack_contours(vertices, offsets):
+    # restores the OpenCV contour shape (n, 1, 2)
+    return [
+        vertices[offsets[i]:offsets[i + 1]].reshape(-1, 1, 2)
+        for i in range(len(offsets) - 1)
+    ]
+
+
+class SegmentationCache(object):
+    """
+    Results stored as one .npz file per key. Reading a result marks it as
+    recently used (its modification time), least recently used results are
+    removed once the files total more than max_bytes.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, '%s.npz' % key)
+
+    def get(self, key):
+        try:
+            with np.load(self.path(key)) as npz:
+                contours = unpack_contours(npz['vertices'], npz['offsets'])
+            os.utime(self.path(key))
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+
+        return contours
+
+    def prune(self):
+        entries = []
+
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.npz'):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, file_name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            # other processes (e.g. GUI workers) may be pruning too
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except (FileNotFoundError, PermissionError):
+                continue
+
+            total_bytes -= size
+
+    def put(self, key, contours):
+        vertices, offsets = pack_contours(contours)
+
+        # write to a temp file first so concurrent readers (e.g. several GUI
+        # workers) never see a partial file
+        tmp_path = self.path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, vertices=vertices, offsets=offsets)
+        os.replace(tmp_path, self.path(key))
+
+        self.prune()
+
+
+def generate_structure_candidates(
+        hsv_img,
+        seg_config,
+        cache_dir=DEFAULT_CACHE_DIR,
+        predict_model_path=None,
+        **kwargs
+):
+    """
+    Drop-in replacement for ifmap's pipeline.generate_structure_candidates
+    which re-uses previous results for the same image, arguments & ifmap
+    version.
+
+    A predict_model is only cached along with predict_model_path, the file
+    it was loaded from, otherwise the pipeline always runs. With plot=True
+    the pipeline also always runs (to show its plots), its result is still
+    cached for later calls.
+    """
+    # ifmap is slow to import & not needed for cache hits, or by users of
+    # the contour packing functions (e.g. the GUI's region tables)
+    from ifmap import pipeline
+
+    if kwargs.get('predict_model') is not None and predict_model_path is None:
+        return pipeline.generate_structure_candidates(hsv_img, seg_config, **kwargs)
+
+    cache = SegmentationCache(cache_dir)
+    key = make_cache_key(
+        hsv_img,
+        seg_config,
+        predict_model_path=predict_model_path,
+        **kwargs
+    )
+
+    candidates = None
+    if not kwargs.get('plot'):
+        candidates = cache.get(key)
+
+    if candidates is None:
+        candidates = pipeline.generate_structure_candidates(
+            hsv_img,
+            seg_config,
+            **kwargs
+        )
+        cache.put(key, candidates)
+    elif kwargs.get('progress_callback') is not None:
+        kwargs['progress_callback'](1.0)
+
+    return candidates
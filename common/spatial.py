@@ -0,0 +1,82 @@
+from collections import defaultdict
+import numpy as np
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+DEFAULT_GRID_CELL_SIZE = 128
+
+
+def contour_bboxes(contours):
+    # (x1, y1, x2, y2) bounding box of each contour, x2 & y2 are exclusive
+    bboxes = np.zeros((len(contours), 4), dtype=np.int64)
+
+    for i, c in enumerate(contours):
+        x, y, w, h = cv2.boundingRect(np.asarray(c).reshape(-1, 1, 2).astype(np.int32))
+        bboxes[i] = [x, y, x + w, y + h]
+
+    return bboxes
+
+
+class GridIndex(object):
+    """
+    Uniform grid over bounding boxes: each item is registered in every grid
+    cell its box touches, so looking up the items near a point or box only
+    visits a few cells no matter how many items there are.
+    """
+    def __init__(self, cell_size=DEFAULT_GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = defaultdict(list)
+        self._bboxes = {}
+
+    def __len__(self):
+        return len(self._bboxes)
+
+    def _cell_range(self, bbox):
+        x1, y1, x2, y2 = bbox
+        cs = self.cell_size
+
+        return (
+            range(int(x1) // cs, (int(x2) - 1) // cs + 1),
+            range(int(y1) // cs, (int(y2) - 1) // cs + 1)
+        )
+
+    def insert(self, item, bbox):
+        self._bboxes[item] = tuple(int(v) for v in bbox)
+        cols, rows = self._cell_range(bbox)
+
+        for col in cols:
+            for row in rows:
+                self._cells[(col, row)].append(item)
+
+    def remove(self, item):
+        bbox = self._bboxes.pop(item)
+        cols, rows = self._cell_range(bbox)
+
+        for col in cols:
+            for row in rows:
+                self._cells[(col, row)].remove(item)
+
+    def query_bbox(self, bbox):
+        # items whose box overlaps the given (x1, y1, x2, y2) box
+        x1, y1, x2, y2 = bbox
+        cols, rows = self._cell_range(bbox)
+        found = set()
+
+        for col in cols:
+            for row in rows:
+                for item in self._cells.get((col, row), ()):
+                    if item in found:
+                        continue
+
+                    ix1, iy1, ix2, iy2 = self._bboxes[item]
+                    if ix1 < x2 and x1 < ix2 and iy1 < y2 and y1 < iy2:
+                        found.add(item)
+
+        return found
+
+    def query_point(self, x, y):
+        return self.query_bbox((x, y, x + 1, y + 1))
@@ -0,0 +1,194 @@
+import argparse
+import atexit
+import functools
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, traces just won't have memory usage
+    resource = None
+
+# Lightweight tracing in the Chrome trace event format, view the traces at
+# chrome://tracing or https://ui.perfetto.dev
+#
+# Tracing is enabled by setting the LUNGMAP_TRACE environment variable to a
+# directory. Each process (e.g. every GUI worker) writes its own
+# trace.<pid>.json there, which can be combined with:
+#
+#     python -m common.tracing <trace dir> <output file>
+#
+# When disabled, trace() returns a shared no-op context manager & traced()
+# returns the function itself, so instrumented code runs as before.
+TRACE_ENV_VAR = 'LUNGMAP_TRACE'
+
+TRACE_DIR = os.environ.get(TRACE_ENV_VAR) or None
+if TRACE_DIR is not None:
+    TRACE_DIR = os.path.abspath(TRACE_DIR)
+ENABLED = TRACE_DIR is not None
+
+_events = []
+_events_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    # peak resident memory of the process so far
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return max_rss / float(1 << 20)
+
+    return max_rss / 1024.0
+
+
+def _record(event):
+    global _events, _events_pid
+
+    with _lock:
+        # a forked worker starts with a copy of its parent's events, which
+        # the parent writes itself
+        if os.getpid() != _events_pid:
+            _events = []
+            _events_pid = os.getpid()
+
+        _events.append(event)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """
+    Records one complete ('X') event with the duration of the with block,
+    along with the process's peak memory at the end & its growth during
+    the block.
+    """
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_peak_rss = peak_rss_mb()
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.perf_counter()
+        args = dict(self.args)
+
+        end_peak_rss = peak_rss_mb()
+        if end_peak_rss is not None:
+            args['peak_rss_mb'] = round(end_peak_rss, 1)
+            args['peak_rss_growth_mb'] = round(end_peak_rss - self.start_peak_rss, 1)
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+
+        _record(
+            {
+                'name': self.name,
+                'cat': self.category,
+                'ph': 'X',
+                'ts': self.start * 1e6,
+                'dur': (end - self.start) * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': args
+            }
+        )
+
+        return False
+
+
+def trace(name, category='lungmap', **args):
+    # context manager timing its block, args are shown with the event
+    if not ENABLED:
+        return _NULL_SPAN
+
+    return Span(name, category, args)
+
+
+def traced(name=None, category='lungmap'):
+    # decorator timing every call of the function
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        span_name = name or '%s.%s' % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, category, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush():
+    # Writes this process's events, processes that don't exit normally
+    # (e.g. multiprocessing workers) must call this themselves
+    if not ENABLED:
+        return
+
+    with _lock:
+        if os.getpid() != _events_pid or len(_events) == 0:
+            return
+
+        events = list(_events)
+
+    os.makedirs(TRACE_DIR, exist_ok=True)
+
+    trace_path = os.path.join(TRACE_DIR, 'trace.%d.json' % os.getpid())
+    tmp_path = trace_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump({'traceEvents': events}, f)
+    os.replace(tmp_path, trace_path)
+
+
+if ENABLED:
+    atexit.register(flush)
+
+
+def merge_traces(trace_dir, output_path):
+    events = []
+
+    for trace_path in sorted(glob.glob(os.path.join(trace_dir, 'trace.*.json'))):
+        f = open(trace_path, 'r')
+        events.extend(json.load(f)['traceEvents'])
+        f.close()
+
+    with open(output_path, 'w') as f:
+        json.dump({'traceEvents': events}, f)
+
+    return len(events)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the per-process trace files of a run')
+    parser.add_argument('trace_dir')
+    parser.add_argument('output_path')
+    cmd_args = parser.parse_args()
+
+    print("Merged %d events" % merge_traces(cmd_args.trace_dir, cmd_args.output_path))
@@ -6,6 +6,7 @@ from operator import itemgetter
 import os
 from matplotlib import patches
 import matplotlib.pyplot as plt
+from common import tracing
 
 # this is just to un-confuse pycharm
 try:
@@ -14,6 +15,7 @@ except ImportError:
     import cv2
 
 
+@tracing.traced()
 def get_training_data_for_image_set(image_set_dir):
     # Each image set directory will have a 'regions.json' file. This regions file
     # has keys of the image file names in the image set, and the value for each image
@@ -110,6 +112,7 @@ def make_binary_mask(contour, img_dims):
     return mask
 
 
+@tracing.traced()
 def find_overlapping_regions(true_regions, test_regions):
     true_boxes = []
     true_classes = []
@@ -213,6 +216,7 @@ def calc_precision(tps, fps):
     return precision
 
 
+@tracing.traced()
 def generate_iou_pred_matrices(true_regions, test_regions):
     true_boxes = []
     test_boxes = []
@@ -260,6 +264,7 @@ def generate_iou_pred_matrices(true_regions, test_regions):
     return iou_mat, pred_mat
 
 
+@tracing.traced()
 def generate_tp_fn_fp(iou_mat, pred_mat, iou_thresh=0.5, pred_thresh=0.25):
     tp = {}
     for i in reversed(list(np.argsort(pred_mat, axis=None))):
@@ -273,6 +278,7 @@ def generate_tp_fn_fp(iou_mat, pred_mat, iou_thresh=0.5, pred_thresh=0.25):
     return tp, fn, fp
 
 
+@tracing.traced()
 def generate_dataframe_aggregation_tp_fn_fp(
         true_regions,
         test_regions,
@@ -339,6 +345,7 @@ def apply_mask(image, mask, color, alpha=0.5):
     return image
 
 
+@tracing.traced()
 def display_class_prediction_overlaps(
         image,
         segments,
@@ -413,6 +420,7 @@ def display_class_prediction_overlaps(
             plt.show()
 
 
+@tracing.traced()
 def plot_test_results(trained_pipeline, report):
     hsv_img = trained_pipeline.training_data[trained_pipeline.test_img_name]['hsv_img'].copy()
     ground_truth = trained_pipeline.training_data[trained_pipeline.test_img_name]['regions']
@@ -1,6 +1,6 @@
 import os
 import numpy as np
-from ifmap import pipeline
+from common import nms, seg_cache, tracing
 from glob import glob
 from PIL import Image
 import cv2_extras as cv2x
@@ -59,16 +59,21 @@ image_paths = glob(os.path.join(image_set_path, '*.tif'))
 
 tmp_image = Image.open(image_paths[2])
 tmp_image = np.asarray(tmp_image)
-tmp_image = cv2.cvtColor(tmp_image, cv2.COLOR_RGB2HSV)
+with tracing.trace('hsv_conversion'):
+    tmp_image = cv2.cvtColor(tmp_image, cv2.COLOR_RGB2HSV)
 
 # and pipeline test steps
-candidate_contours = pipeline.generate_structure_candidates(
-    tmp_image,
-    seg_config,
-    filter_min_size=3 * cell_size,
-    plot=True
-)
-cv2x.plot_contours(tmp_image, candidate_contours)
+with tracing.trace('generate_structure_candidates'):
+    candidate_contours = seg_cache.generate_structure_candidates(
+        tmp_image,
+        seg_config,
+        filter_min_size=3 * cell_size,
+        plot=True
+    )
+with tracing.trace('suppress_duplicates'):
+    candidate_contours = nms.suppress_duplicates(candidate_contours)
+with tracing.trace('plot_contours'):
+    cv2x.plot_contours(tmp_image, candidate_contours)
 # test_data_processed = pipeline.process_test_data(test_img_hsv, candidate_contours)
 
 # plot functions
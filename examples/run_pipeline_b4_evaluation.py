@@ -1,6 +1,7 @@
 import os
 import numpy as np
 from ifmap import utils, pipeline
+from common import nms, tracing
 import pickle
 
 cell_radius = 16
@@ -56,21 +57,25 @@ try:
     categories = pck['categories']
     test_img_hsv = pck['test_img_hsv']
     # get training data
-    training_data = utils.get_training_data_for_image_set(image_set_path)
+    with tracing.trace('get_training_data_for_image_set'):
+        training_data = utils.get_training_data_for_image_set(image_set_path)
     # remove an image from training data to use for predict testing
     test_img_name = '2015-04-029_20X_C57Bl6_E16.5_LMM.14.24.4.46_SOX9_SFTPC_ACTA2_001.tif'
     test_data = training_data.pop(test_img_name)
 except FileNotFoundError:
     # get training data
-    training_data = utils.get_training_data_for_image_set(image_set_path)
+    with tracing.trace('get_training_data_for_image_set'):
+        training_data = utils.get_training_data_for_image_set(image_set_path)
     # remove an image from training data to use for predict testing
     test_img_name = '2015-04-029_20X_C57Bl6_E16.5_LMM.14.24.4.46_SOX9_SFTPC_ACTA2_001.tif'
     test_data = training_data.pop(test_img_name)
     test_img_hsv = test_data['hsv_img']
 
     # train model
-    training_data_processed = pipeline.process_training_data(training_data)
-    xgb_model, categories = pipeline.fit(training_data_processed)
+    with tracing.trace('process_training_data'):
+        training_data_processed = pipeline.process_training_data(training_data)
+    with tracing.trace('fit'):
+        xgb_model, categories = pipeline.fit(training_data_processed)
 
     # pickle the xgb model and categories here
     pck = {
@@ -83,17 +88,23 @@ except FileNotFoundError:
     f.close()
 
 # and pipeline test steps
-candidate_contours = pipeline.generate_structure_candidates(
-    test_img_hsv,
-    seg_config,
-    filter_min_size=2 * cell_size,
-    plot=True
-)
-test_data_processed = pipeline.process_test_data(test_img_hsv, candidate_contours)
-pred_results = pipeline.predict(test_data_processed, xgb_model, categories)
+with tracing.trace('generate_structure_candidates'):
+    candidate_contours = pipeline.generate_structure_candidates(
+        test_img_hsv,
+        seg_config,
+        filter_min_size=2 * cell_size,
+        plot=True
+    )
+with tracing.trace('suppress_duplicates'):
+    candidate_contours = nms.suppress_duplicates(candidate_contours)
+with tracing.trace('process_test_data'):
+    test_data_processed = pipeline.process_test_data(test_img_hsv, candidate_contours)
+with tracing.trace('predict'):
+    pred_results = pipeline.predict(test_data_processed, xgb_model, categories)
 
 # plot functions
-pipeline.plot_test_results(test_img_hsv, candidate_contours, pred_results, output_path)
+with tracing.trace('plot_test_results'):
+    pipeline.plot_test_results(test_img_hsv, candidate_contours, pred_results, output_path)
 
 # optional cell segmentation
 # utils.process_structures_into_cells(
@@ -1,7 +1,8 @@
 import numpy as np
 from PIL import Image
 import os
-from ifmap import utils, pipeline
+from ifmap import utils
+from common import seg_cache, tracing
 import json
 
 # weird import style to un-confuse PyCharm
@@ -15,8 +16,9 @@ test_img_name = '2015-04-029_20X_C57Bl6_E16.5_LMM.14.24.4.46_SOX9_SFTPC_ACTA2_00
 test_img_path = os.path.join(image_dir, test_img_name)
 
 tmp_img = Image.open(test_img_path)
-# noinspection PyUnresolvedReferences
-test_img_hsv = cv2.cvtColor(np.asarray(tmp_img), cv2.COLOR_RGB2HSV)
+with tracing.trace('hsv_conversion'):
+    # noinspection PyUnresolvedReferences
+    test_img_hsv = cv2.cvtColor(np.asarray(tmp_img), cv2.COLOR_RGB2HSV)
 test_img_hsv = test_img_hsv[0:1000, 0:1000]
 test_save_dir = os.path.join(
     'trad_seg_testing2',
@@ -38,23 +40,25 @@ seg_config = [
     }
 ]
 
-all_color_contours = pipeline.generate_structure_candidates(
-    test_img_hsv,
-    seg_config,
-    filter_min_size=2 * cell_size,
-    process_residual=False,
-    plot=True
-)
+with tracing.trace('generate_structure_candidates'):
+    all_color_contours = seg_cache.generate_structure_candidates(
+        test_img_hsv,
+        seg_config,
+        filter_min_size=2 * cell_size,
+        process_residual=False,
+        plot=True
+    )
 print("%d color cell candidates found" % len(all_color_contours))
 
-structures_with_cells = utils.process_structures_into_cells(
-    test_img_hsv,
-    test_save_dir,
-    all_color_contours,
-    ['green', 'cyan', 'blue'],
-    cell_size,
-    plot=False
-)
+with tracing.trace('process_structures_into_cells'):
+    structures_with_cells = utils.process_structures_into_cells(
+        test_img_hsv,
+        test_save_dir,
+        all_color_contours,
+        ['green', 'cyan', 'blue'],
+        cell_size,
+        plot=False
+    )
 
 json_sc = {
     test_img_name: {'regions': structures_with_cells}
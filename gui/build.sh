@@ -1,5 +1,5 @@
 pyinstaller.exe \
     --additional-hooks-dir="hooks" \
     --add-data "../../../AppData/Local/Programs/Python/Python37/xgboost/*;xgboost/" \
-    --add-data "resources/probe_structure_map.json;." \
+    --add-data "resources/*;resources/" \
     -F lungmap_pipeline.py
@@ -1,7 +1,12 @@
 import json
+import os
 import lungmap_utils
 import gui.utils as gui_utils
 
+PROBE_STRUCTURE_MAP_FILE = 'resources/probe_structure_map.json'
+# records which ontology & probes the map was computed from
+PROBE_STRUCTURE_META_FILE = 'resources/probe_structure_map.meta.json'
+
 
 class SetEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -11,11 +16,68 @@ class SetEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-ontology = gui_utils.onto
+def load_previous_map(ontology_digest):
+    # Returns the previously computed map & the probes it was computed for,
+    # or empty ones if the ontology changed since (or there is no metadata)
+    try:
+        f = open(PROBE_STRUCTURE_META_FILE, 'r')
+        meta = json.load(f)
+        f.close()
+
+        f = open(PROBE_STRUCTURE_MAP_FILE, 'r')
+        probe_structure_map = json.load(f)
+        f.close()
+    except (FileNotFoundError, ValueError):
+        return {}, set()
+
+    if meta.get('owl_sha256') != ontology_digest:
+        return {}, set()
+
+    return probe_structure_map, set(meta['probes'])
+
+
+def write_json_atomic(obj, file_path, **kwargs):
+    tmp_file = file_path + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(obj, f, **kwargs)
+    f.close()
+    os.replace(tmp_file, file_path)
+
+
+# load the ontology while the probe list is fetched from LungMAP
+gui_utils.preload_ontology()
 probes = lungmap_utils.client.get_probes()
+ontology = gui_utils.get_ontology()
+ontology_digest = gui_utils.get_file_digest(gui_utils.LOCAL_ONTOLOGY_FILE)
+
+prev_map, prev_probes = load_previous_map(ontology_digest)
+
+# only probes new since the last run need computing, probes that are no
+# longer returned by LungMAP are dropped
+new_probes = [p for p in probes if p not in prev_probes]
+
+probe_set = set(probes)
+probe_structure_map = {p: s for p, s in prev_map.items() if p in probe_set}
+probe_structure_map.update(
+    gui_utils.get_probe_structure_map(ontology, new_probes)
+)
 
-probe_structure_map = gui_utils.get_probe_structure_map(ontology, probes)
+print(
+    "%d probes, %d computed, %d re-used" % (
+        len(probes), len(new_probes), len(probes) - len(new_probes)
+    )
+)
 
-f = open('resources/probe_structure_map.json', 'w')
-json.dump(probe_structure_map, f, cls=SetEncoder, indent=2)
-f.close()
+# the map is written before the metadata, so an interrupted run never
+# records probes as computed that aren't in the map
+write_json_atomic(
+    dict(sorted(probe_structure_map.items())),
+    PROBE_STRUCTURE_MAP_FILE,
+    cls=SetEncoder,
+    indent=2
+)
+write_json_atomic(
+    {'owl_sha256': ontology_digest, 'probes': sorted(probe_set)},
+    PROBE_STRUCTURE_META_FILE,
+    indent=2
+)
@@ -0,0 +1,260 @@
+import hashlib
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3  # 2 GiB
+
+# Canonical arrays are the only copies we keep of an image, everything else
+# is derived from them on demand. The corrected RGB image comes from
+# pre-processing and can't be re-derived, so it is canonical as well.
+CANONICAL_KINDS = ('rgb', 'corr_rgb')
+DERIVED_KINDS = {
+    'hsv': ('rgb', cv2.COLOR_RGB2HSV),
+    'corr_hsv': ('corr_rgb', cv2.COLOR_RGB2HSV)
+}
+
+
+def hashed_file_name(name):
+    # distinct names never map to the same file (as e.g. 'a b' & 'a_b' would
+    # by replacing unsafe characters), and the result never contains a '.'
+    return hashlib.blake2b(name.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ImageStore(object):
+    """
+    Holds the images loaded in the GUI within a memory budget.
+
+    Only one canonical RGB array (plus the pre-processed RGB array, once
+    available) is kept per image, other color spaces are derived lazily and
+    cached. Resident arrays are tracked in a single LRU: when the budget is
+    exceeded, derived arrays are dropped and canonical arrays are spilled to
+    memory-mapped files in spill_dir.
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        self.memory_budget = memory_budget
+
+        if spill_dir is None:
+            spill_dir = tempfile.mkdtemp(prefix='lungmap_images_')
+            weakref.finalize(self, shutil.rmtree, spill_dir, True)
+        self.spill_dir = os.path.abspath(spill_dir)
+
+        self._metadata = OrderedDict()
+        self._canonical = {}
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        self._versions = {}
+        self._version_counter = itertools.count(1)
+        self._stale_paths = set()
+        self._lock = threading.RLock()
+
+    def __contains__(self, img_name):
+        return img_name in self._metadata
+
+    def __iter__(self):
+        return iter(self._metadata)
+
+    def __len__(self):
+        return len(self._metadata)
+
+    def __getitem__(self, img_name):
+        return self._metadata[img_name]
+
+    def keys(self):
+        return self._metadata.keys()
+
+    @property
+    def resident_bytes(self):
+        return self._resident_bytes
+
+    def add(self, img_name, rgb_img, **metadata):
+        with self._lock:
+            if img_name in self._metadata:
+                self.remove(img_name)
+
+            self._metadata[img_name] = metadata
+            self._set_canonical(img_name, 'rgb', rgb_img)
+
+    def remove(self, img_name):
+        with self._lock:
+            for key in list(self._resident.keys()):
+                if key[0] == img_name:
+                    self._forget(key)
+
+            for kind in CANONICAL_KINDS:
+                self._release_canonical((img_name, kind))
+
+            self._metadata.pop(img_name, None)
+
+    def version(self, img_name, kind='rgb'):
+        # changes whenever the canonical array is replaced (e.g. the image is
+        # re-added), so results derived from it can be keyed without writing
+        # it to a file
+        return self._versions.get((img_name, kind))
+
+    def has_corrected(self, img_name):
+        return (img_name, 'corr_rgb') in self._canonical
+
+    def set_corrected(self, img_name, corr_rgb_img):
+        # corr_rgb_img may be a memmap of a file owned by the caller, in which
+        # case it is used in place & never counts against the budget
+        with self._lock:
+            self._forget((img_name, 'corr_hsv'))
+            self._set_canonical(img_name, 'corr_rgb', corr_rgb_img)
+
+    def remove_corrected(self, img_name):
+        # e.g. the file the corrected image is mapped from is about to be
+        # removed, or the reference it was corrected against changed
+        with self._lock:
+            self._forget((img_name, 'corr_hsv'))
+            self._forget((img_name, 'corr_rgb'))
+            self._release_canonical((img_name, 'corr_rgb'))
+
+    def get_rgb(self, img_name, corrected=False):
+        return self.get(img_name, 'corr_rgb' if corrected else 'rgb')
+
+    def get_hsv(self, img_name, corrected=False):
+        return self.get(img_name, 'corr_hsv' if corrected else 'hsv')
+
+    def get(self, img_name, kind):
+        key = (img_name, kind)
+
+        with self._lock:
+            if key in self._resident:
+                self._resident.move_to_end(key)
+                return self._resident[key]
+
+            if kind in CANONICAL_KINDS:
+                # spilled canonical arrays are served straight from the
+                # memory-mapped file, the OS pages them in as needed
+                return self._canonical[key]
+
+            source_kind, conversion = DERIVED_KINDS[kind]
+            source_img = self.get(img_name, source_kind)
+
+        # do the conversion outside the lock, it's the expensive part
+        derived_img = cv2.cvtColor(np.asarray(source_img), conversion)
+
+        with self._lock:
+            if img_name in self._metadata:
+                self._make_resident(key, derived_img)
+
+        return derived_img
+
+    def to_file(self, img_name, kind='rgb'):
+        # Ensures a canonical array is backed by a file & returns its path,
+        # e.g. to hand the image to a worker process without pickling it.
+        # The in-memory copy is released since the memmap replaces it.
+        key = (img_name, kind)
+
+        with self._lock:
+            img = self._canonical[key]
+
+            if isinstance(img, np.memmap):
+                return img.filename
+
+            self._forget(key)
+            self._spill(key, img)
+
+        return self._spill_path(img_name, kind)
+
+    def clear_derived(self):
+        with self._lock:
+            for key in list(self._resident.keys()):
+                if key[1] in DERIVED_KINDS:
+                    self._forget(key)
+
+    def _spill_path(self, img_name, kind):
+        # includes the version, so a replacement array never has to reuse the
+        # file of the array it replaces, which may still be mapped
+        return os.path.join(
+            self.spill_dir,
+            '%s.%s.%d.npy' % (
+                hashed_file_name(img_name),
+                kind,
+                self._versions[(img_name, kind)]
+            )
+        )
+
+    def _set_canonical(self, img_name, kind, img):
+        key = (img_name, kind)
+        self._forget(key)
+        self._release_canonical(key)
+
+        self._canonical[key] = img
+        self._versions[key] = next(self._version_counter)
+
+        if not isinstance(img, np.memmap):
+            self._make_resident(key, img)
+
+    def _release_canonical(self, key):
+        # Drops the canonical array & removes its spill file, if it has one.
+        # Our memmap is dropped first since Windows refuses to remove mapped
+        # files, if it's still mapped elsewhere (e.g. a caller holds the
+        # array) the removal is retried later.
+        img = self._canonical.pop(key, None)
+
+        if isinstance(img, np.memmap) and img.filename == self._spill_path(*key):
+            self._stale_paths.add(img.filename)
+        del img
+
+        self._versions.pop(key, None)
+        self._remove_stale()
+
+    def _remove_stale(self):
+        for path in list(self._stale_paths):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                continue
+
+            self._stale_paths.discard(path)
+
+    def _make_resident(self, key, img):
+        self._forget(key)
+
+        self._resident[key] = img
+        self._resident_bytes += img.nbytes
+
+        self._enforce_budget()
+
+    def _forget(self, key):
+        img = self._resident.pop(key, None)
+
+        if img is not None:
+            self._resident_bytes -= img.nbytes
+
+    def _enforce_budget(self):
+        while self._resident_bytes > self.memory_budget and self._resident:
+            key, img = self._resident.popitem(last=False)
+            self._resident_bytes -= img.nbytes
+
+            if key[1] in CANONICAL_KINDS:
+                self._spill(key, img)
+
+    def _spill(self, key, img):
+        spill_path = self._spill_path(*key)
+        mm_img = np.lib.format.open_memmap(
+            spill_path,
+            mode='w+',
+            dtype=img.dtype,
+            shape=img.shape
+        )
+        mm_img[:] = img
+        mm_img.flush()
+        del mm_img
+
+        self._canonical[key] = np.load(spill_path, mmap_mode='r')
@@ -0,0 +1,407 @@
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import queue
+import time
+import traceback
+from common import tracing
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_TIMED_OUT = 'timed out'
+
+# queued jobs start in priority order, then in the order submitted
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = 1
+
+
+class JobReporter(object):
+    """
+    Handed to job functions running in a worker process to send progress
+    back to the GUI. Instances are callable with a 0-1 progress value, so
+    they can be used directly as an ifmap progress_callback. Progress is
+    sent with the worker's perf_counter() time, which is comparable across
+    processes, so the GUI can time a job's stages regardless of when it gets
+    to poll.
+    """
+    def __init__(self, message_queue, job_id):
+        self.message_queue = message_queue
+        self.job_id = job_id
+
+    def __call__(self, progress):
+        self.progress(progress)
+
+    def progress(self, progress):
+        self.message_queue.put((self.job_id, 'progress', (progress, time.perf_counter())))
+
+    def message(self, text):
+        self.message_queue.put((self.job_id, 'message', text))
+
+
+# the queue progress & messages are sent to, set in each pool worker
+_message_queue = None
+
+
+def _init_worker(message_queue):
+    global _message_queue
+    _message_queue = message_queue
+
+
+def _run_job(job_id, func, args, kwargs):
+    # returns ('done', result) or ('error', traceback), an exception raised
+    # by the future itself means the worker died
+    reporter = JobReporter(_message_queue, job_id)
+
+    try:
+        with tracing.trace(func.__name__, category='job'):
+            result = func(*args, reporter=reporter, **kwargs)
+    except Exception:
+        return 'error', traceback.format_exc()
+    else:
+        return 'done', result
+    finally:
+        # workers exit without running atexit handlers
+        tracing.flush()
+
+
+class Job(object):
+    def __init__(
+            self,
+            job_id,
+            func,
+            args,
+            kwargs,
+            description,
+            group,
+            on_done,
+            on_error,
+            on_progress,
+            timeout,
+            priority
+    ):
+        self.job_id = job_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.group = group
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.timeout = timeout
+        self.priority = priority
+
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        self.message = None
+        self.future = None
+        self.start_time = None
+
+    def __str__(self):
+        if self.state == JOB_RUNNING:
+            return "%s (%d%%)" % (self.description, int(self.progress * 100))
+
+        return "%s (%s)" % (self.description, self.state)
+
+
+class JobScheduler(object):
+    """
+    Runs jobs in worker processes so long computations neither block the Tk
+    event loop nor compete with it for the GIL.
+
+    Jobs run in a persistent pool of max_workers processes, so the worker
+    start up (& on spawn platforms, re-importing the job modules) is only
+    paid once per worker. Jobs are only handed to the pool when a worker is
+    free, so priorities & cancelling queued jobs are handled here. A pool
+    worker can't be stopped on its own: a running job that is cancelled or
+    times out is abandoned, its result ignored & its worker counted as busy
+    until it finishes. Once only abandoned jobs are left running, the pool
+    is replaced so their workers are freed right away.
+
+    Results are collected from the jobs' futures, progress & messages from a
+    queue shared by the workers. Both are polled on the Tk event loop using
+    after(), so all callbacks (on_done, on_error, on_progress & on_change)
+    run in the GUI thread and may safely update widgets.
+
+    Job functions must be module level functions (they are pickled by
+    reference) and accept a 'reporter' keyword argument. on_progress is
+    called with the progress & the worker's time of reporting it.
+
+    Low priority jobs (e.g. speculative work) only start when no normal
+    priority job is waiting, and leave one worker free for normal jobs.
+    """
+    def __init__(self, widget, max_workers=1, poll_interval=50, on_change=None):
+        self.widget = widget
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+
+        self._job_ids = itertools.count(1)
+        self._queued = []
+        self._running = []
+        self._abandoned = []
+        self._pool = None
+        self._message_queue = None
+        self._poll_id = None
+
+    @property
+    def jobs(self):
+        return self._running + self._queued
+
+    def submit(
+            self,
+            func,
+            args=(),
+            kwargs=None,
+            description='',
+            group=None,
+            on_done=None,
+            on_error=None,
+            on_progress=None,
+            timeout=None,
+            priority=PRIORITY_NORMAL
+    ):
+        # timeout is the time budget (in seconds) of the running job, after
+        # which it is stopped & on_error is called
+        job = Job(
+            next(self._job_ids),
+            func,
+            args,
+            kwargs or {},
+            description,
+            group,
+            on_done,
+            on_error,
+            on_progress,
+            timeout,
+            priority
+        )
+        self._queued.append(job)
+
+        self._start_queued()
+        self._changed()
+
+        return job
+
+    def cancel(self, job):
+        if job.state == JOB_QUEUED:
+            self._queued.remove(job)
+        elif job.state == JOB_RUNNING:
+            self._abandon(job)
+        else:
+            return
+
+        job.state = JOB_CANCELLED
+
+        self._start_queued()
+        self._changed()
+
+    def set_priority(self, job, priority):
+        # e.g. to promote speculative work the user is now waiting for, a
+        # running job keeps running either way
+        job.priority = priority
+
+        self._start_queued()
+        self._changed()
+
+    def cancel_group(self, group):
+        # used to supersede previous requests, e.g. when the user starts a
+        # new segmentation of the same image
+        for job in self.jobs:
+            if job.group == group:
+                self.cancel(job)
+
+    def shutdown(self):
+        for job in self.jobs:
+            self.cancel(job)
+
+        self._stop_pool()
+
+        if self._poll_id is not None:
+            self.widget.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def _next_queued(self):
+        n_busy = len(self._running) + len(self._abandoned)
+
+        if not self._queued or n_busy >= self.max_workers:
+            return None
+
+        job = min(self._queued, key=lambda j: j.priority)
+
+        if job.priority > PRIORITY_NORMAL and self.max_workers > 1:
+            n_low_running = len(
+                [j for j in self._running if j.priority > PRIORITY_NORMAL]
+            )
+            if n_low_running >= self.max_workers - 1:
+                return None
+
+        return job
+
+    def _start_queued(self):
+        while True:
+            job = self._next_queued()
+
+            if job is None:
+                break
+
+            self._queued.remove(job)
+
+            if self._pool is None:
+                self._start_pool()
+
+            job.future = self._pool.submit(
+                _run_job,
+                job.job_id,
+                job.func,
+                job.args,
+                job.kwargs
+            )
+
+            job.state = JOB_RUNNING
+            job.start_time = time.time()
+            self._running.append(job)
+
+        if (self._running or self._abandoned) and self._poll_id is None:
+            self._poll_id = self.widget.after(self.poll_interval, self._poll)
+
+    def _start_pool(self):
+        self._message_queue = multiprocessing.Queue()
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self._message_queue,)
+        )
+
+    def _stop_pool(self):
+        # terminates the workers, whatever they're running
+        if self._pool is None:
+            return
+
+        # noinspection PyProtectedMember
+        for process in list(self._pool._processes.values()):
+            process.terminate()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+        self._message_queue.close()
+        self._message_queue.cancel_join_thread()
+
+        self._pool = None
+        self._message_queue = None
+        self._abandoned = []
+
+    def _worker_exit_code(self):
+        if self._pool is None:
+            return None
+
+        # noinspection PyProtectedMember
+        for process in list(self._pool._processes.values()):
+            if process.exitcode is not None:
+                return process.exitcode
+
+        return None
+
+    def _abandon(self, job):
+        self._running.remove(job)
+        self._abandoned.append(job)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.jobs)
+
+    def _finish(self, job, state):
+        job.state = state
+        self._running.remove(job)
+
+    def _poll_messages(self):
+        # progress & messages of abandoned jobs are ignored
+        running = {job.job_id: job for job in self._running}
+
+        while True:
+            try:
+                job_id, kind, payload = self._message_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            job = running.get(job_id)
+
+            if job is None or job.state != JOB_RUNNING:
+                continue
+
+            if kind == 'progress':
+                job.progress, timestamp = payload
+                if job.on_progress is not None:
+                    job.on_progress(job.progress, timestamp)
+            elif kind == 'message':
+                job.message = payload
+
+    def _poll(self):
+        self._poll_id = None
+
+        self._poll_messages()
+
+        self._abandoned = [job for job in self._abandoned if not job.future.done()]
+
+        for job in list(self._running):
+            # a callback may have cancelled this job in the meantime
+            if job.state != JOB_RUNNING:
+                continue
+
+            if job.future.done():
+                try:
+                    kind, payload = job.future.result()
+                except Exception as e:
+                    # the worker died, which breaks the whole pool
+                    kind, payload = 'error', "worker exited unexpectedly: %r" % e
+
+                if kind == 'done':
+                    self._finish(job, JOB_DONE)
+                    if job.on_done is not None:
+                        job.on_done(payload)
+                else:
+                    self._finish(job, JOB_FAILED)
+                    self._handle_error(job, payload)
+            elif job.timeout is not None and time.time() - job.start_time > job.timeout:
+                self._abandon(job)
+                job.state = JOB_TIMED_OUT
+                self._handle_error(
+                    job,
+                    "timed out after %.1f seconds" % job.timeout
+                )
+
+        # the pool doesn't always notice a worker dying (e.g. killed for using
+        # too much memory) while another is busy, which would leave its job
+        # running forever
+        exit_code = self._worker_exit_code()
+        if exit_code is not None:
+            for job in list(self._running):
+                self._finish(job, JOB_FAILED)
+                self._handle_error(job, "worker exited with code %s" % exit_code)
+
+            self._stop_pool()
+
+        # workers only running abandoned jobs (or a broken pool) are freed by
+        # starting over with a new pool
+        if self._pool is not None and not self._running:
+            # noinspection PyProtectedMember
+            if self._abandoned or self._pool._broken:
+                self._stop_pool()
+
+        self._start_queued()
+        self._changed()
+
+        if (self._running or self._abandoned) and self._poll_id is None:
+            self._poll_id = self.widget.after(self.poll_interval, self._poll)
+
+    @staticmethod
+    def _handle_error(job, error):
+        if job.on_error is not None:
+            job.on_error(error)
+        else:
+            logger.error("Job '%s' failed:\n%s", job.description, error)
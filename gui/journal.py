@@ -0,0 +1,288 @@
+import glob
+import json
+import os
+import shutil
+from gui import region_io
+from gui.region_table import RegionTable, as_vertices
+
+JOURNAL_FILE_NAME = 'journal.jsonl'
+SNAPSHOT_FILE_NAME = 'snapshot.npz'
+TABLE_FILE_PATTERN = 'table.%d.npz'
+TABLE_FILE_GLOB = 'table.*.npz'
+LOCK_FILE_NAME = 'lock'
+
+# the journal is only compacted into a snapshot once the entries written
+# since the last one take up more than the snapshot itself (& at least this
+# many bytes), so compaction costs stay proportional to the edits made
+COMPACT_MIN_BYTES = 16 * 1024 ** 2
+
+
+def _try_lock(f):
+    # non-blocking exclusive lock of an open file, held until it's closed
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+    else:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+
+    return True
+
+
+class EditJournal(object):
+    """
+    Crash protection for the regions being labelled. Every edit is appended
+    to a journal file as one short JSON line, whole region tables (e.g. a new
+    segmentation) are saved to their own file & journaled by name. Once the
+    journal outgrows the last snapshot it's compacted into a new snapshot of
+    all the region tables (after which the journal starts over). Recovering
+    loads the snapshot & replays the journal entries made since.
+
+    Entries are numbered & the snapshot records the last entry it includes,
+    so entries are never applied twice if compaction is interrupted.
+
+    Each GUI instance journals to its own directory under session_root,
+    named by its process ID & locked while it runs. Sessions found unlocked
+    belong to an instance that didn't end normally & can be recovered.
+    """
+    def __init__(self, session_root):
+        self.session_root = session_root
+        self.session_dir = os.path.join(session_root, str(os.getpid()))
+        self.journal_path = os.path.join(self.session_dir, JOURNAL_FILE_NAME)
+        self.snapshot_path = os.path.join(self.session_dir, SNAPSHOT_FILE_NAME)
+
+        # number of the last entry, bytes journaled since the last snapshot
+        # (including table files) & the size of that snapshot
+        self.seq = 0
+        self.journal_bytes = 0
+        self.snapshot_bytes = 0
+        self._file = None
+
+        os.makedirs(self.session_dir, exist_ok=True)
+
+        self._lock_file = open(os.path.join(self.session_dir, LOCK_FILE_NAME), 'a')
+        _try_lock(self._lock_file)
+
+    @staticmethod
+    def _has_entries(session_dir):
+        return (
+            os.path.exists(os.path.join(session_dir, SNAPSHOT_FILE_NAME)) or
+            os.path.exists(os.path.join(session_dir, JOURNAL_FILE_NAME))
+        )
+
+    def _find_orphans(self):
+        # Returns the (locked) lock files of other sessions with regions that
+        # aren't locked by a running instance. Holding the locks keeps another
+        # instance from recovering the same sessions.
+        orphans = []
+
+        for session_dir in glob.glob(os.path.join(self.session_root, '*')):
+            if not os.path.isdir(session_dir):
+                continue
+            if os.path.samefile(session_dir, self.session_dir):
+                continue
+            if not self._has_entries(session_dir):
+                continue
+
+            lock_file = open(os.path.join(session_dir, LOCK_FILE_NAME), 'a')
+
+            if _try_lock(lock_file):
+                orphans.append(lock_file)
+            else:
+                lock_file.close()
+
+        return orphans
+
+    def has_session(self):
+        # the process ID may have been used by an earlier instance
+        if self._has_entries(self.session_dir):
+            return True
+
+        orphans = self._find_orphans()
+
+        for lock_file in orphans:
+            lock_file.close()
+
+        return len(orphans) > 0
+
+    def recover(self):
+        # returns the region tables of the previous sessions, empty if none,
+        # the newest session wins if several have regions for an image
+        img_region_lut = {}
+
+        orphans = self._find_orphans()
+        session_dirs = [os.path.dirname(f.name) for f in orphans]
+        if self._has_entries(self.session_dir):
+            session_dirs.append(self.session_dir)
+
+        session_dirs.sort(key=os.path.getmtime)
+
+        for session_dir in session_dirs:
+            session_lut, seq = self._load_session(session_dir)
+            img_region_lut.update(session_lut)
+
+            if session_dir == self.session_dir:
+                self.seq = seq
+
+        # start the recovered session from a fresh snapshot of our own, so new
+        # entries aren't appended after an incomplete line
+        if len(session_dirs) > 0:
+            self.compact(img_region_lut)
+
+        for lock_file in orphans:
+            lock_file.close()
+            shutil.rmtree(os.path.dirname(lock_file.name), ignore_errors=True)
+
+        return img_region_lut
+
+    @classmethod
+    def _load_session(cls, session_dir):
+        img_region_lut = {}
+        snapshot_path = os.path.join(session_dir, SNAPSHOT_FILE_NAME)
+        journal_path = os.path.join(session_dir, JOURNAL_FILE_NAME)
+        snapshot_seq = 0
+
+        if os.path.exists(snapshot_path):
+            img_region_lut = region_io.load_regions_npz(snapshot_path)
+            snapshot_seq = region_io.load_npz_metadata(snapshot_path).get('seq', 0)
+
+        seq = snapshot_seq
+
+        if os.path.exists(journal_path):
+            f = open(journal_path, 'r')
+            lines = f.readlines()
+            f.close()
+
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete after a crash
+                    break
+
+                if entry['seq'] <= snapshot_seq:
+                    continue
+
+                cls._replay(img_region_lut, entry, session_dir)
+                seq = entry['seq']
+
+        return img_region_lut, seq
+
+    @staticmethod
+    def _replay(img_region_lut, entry, session_dir):
+        op = entry['op']
+        img_name = entry['img']
+
+        if op == 'table':
+            img_region_lut[img_name] = region_io.load_regions_npz(
+                os.path.join(session_dir, entry['file'])
+            )[img_name]
+            return
+
+        if img_name not in img_region_lut:
+            img_region_lut[img_name] = RegionTable()
+
+        region_table = img_region_lut[img_name]
+
+        if op == 'label':
+            region_table.labels[entry['idx']] = entry['label']
+        elif op == 'add':
+            region_table.append(entry['vertices'], entry['label'])
+        elif op == 'contour':
+            region_table.set_contour(entry['idx'], entry['vertices'])
+
+    def _append(self, entry):
+        if self._file is None:
+            self._file = open(self.journal_path, 'a')
+
+        self.seq += 1
+        entry['seq'] = self.seq
+
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        self._file.write(line)
+        # flushed so the entry survives the GUI crashing
+        self._file.flush()
+
+        self.journal_bytes += len(line)
+
+    def record_label(self, img_name, region_idx, label):
+        self._append(
+            {'op': 'label', 'img': img_name, 'idx': int(region_idx), 'label': int(label)}
+        )
+
+    def record_add(self, img_name, contour, label):
+        self._append(
+            {
+                'op': 'add',
+                'img': img_name,
+                'vertices': as_vertices(contour).tolist(),
+                'label': int(label)
+            }
+        )
+
+    def record_contour(self, img_name, region_idx, contour):
+        self._append(
+            {
+                'op': 'contour',
+                'img': img_name,
+                'idx': int(region_idx),
+                'vertices': as_vertices(contour).tolist()
+            }
+        )
+
+    def record_table(self, img_name, region_table):
+        # a whole table replacing any earlier regions of the image, it's
+        # (atomically) saved to its own file before being journaled
+        file_name = TABLE_FILE_PATTERN % (self.seq + 1)
+        table_path = os.path.join(self.session_dir, file_name)
+
+        region_io.save_regions_npz({img_name: region_table}, table_path)
+        self._append({'op': 'table', 'img': img_name, 'file': file_name})
+
+        self.journal_bytes += os.path.getsize(table_path)
+
+    def needs_compaction(self):
+        return self.journal_bytes > max(COMPACT_MIN_BYTES, self.snapshot_bytes)
+
+    def compact(self, img_region_lut):
+        # the snapshot is written (atomically) before the journal is emptied
+        region_io.save_regions_npz(
+            img_region_lut,
+            self.snapshot_path,
+            metadata={'seq': self.seq}
+        )
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, 'w')
+
+        # tables journaled so far are all in the snapshot
+        self._remove_tables()
+
+        self.journal_bytes = 0
+        self.snapshot_bytes = os.path.getsize(self.snapshot_path)
+
+    def _remove_tables(self):
+        for path in glob.glob(os.path.join(self.session_dir, TABLE_FILE_GLOB)):
+            os.remove(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        # removes the session once the GUI is closed normally, the journal
+        # can't be used afterwards
+        self.close()
+        self._lock_file.close()
+
+        shutil.rmtree(self.session_dir, ignore_errors=True)
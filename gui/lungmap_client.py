@@ -0,0 +1,33 @@
+import lungmap_utils
+
+
+# Network calls to LungMAP, these run in the GUI's job scheduler worker
+# processes so a slow or unavailable server never blocks the window
+
+def fetch_probes(reporter=None):
+    return lungmap_utils.client.get_probes()
+
+
+def fetch_images_by_metadata(dev_stage, mag, probes, reporter=None):
+    lm_images = lungmap_utils.client.get_images_by_metadata(
+        dev_stage, mag, probes
+    )
+
+    images = []
+
+    for img in lm_images:
+        url = img['image_url']['value']
+
+        images.append(
+            {
+                'url': url,
+                'image_name': url.split('/')[-1],
+                'probe_colors': [
+                    img['color1']['value'],
+                    img['color2']['value'],
+                    img['color3']['value']
+                ]
+            }
+        )
+
+    return images
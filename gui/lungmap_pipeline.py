@@ -1,16 +1,28 @@
 import tkinter as tk
 import ttkthemes as themed_tk
 from tkinter import filedialog, ttk
-import threading
+import os
+import functools
+import logging
+import multiprocessing
 import PIL.Image
 import PIL.ImageTk
 import json
 from collections import OrderedDict
 import numpy as np
-from sklearn.cluster import spectral_clustering
-from sklearn.feature_extraction import image as sk_image
 import lungmap_utils
-from ifmap import utils as ifmap_utils, pipeline
+from gui.image_store import ImageStore
+from gui.jobs import JobScheduler, JOB_QUEUED, JOB_RUNNING, PRIORITY_LOW, PRIORITY_NORMAL
+from gui.journal import EditJournal
+from gui.metadata_index import MetadataIndex
+from gui.region_table import RegionTable, LABEL_DELETED
+from gui import preprocess, segmentation, split, lungmap_client, region_io, prelabel
+from gui import region_features
+from gui.telemetry import ProgressTelemetry, stage_names
+from common import tracing
+from common.seg_cache import pack_contours, normalize_seg_config
+
+logger = logging.getLogger(__name__)
 
 pm_map_file = open('resources/probe_structure_map.json', 'r')
 PROBE_STRUCTURE_MAP = json.load(pm_map_file)
@@ -32,15 +44,88 @@ REGION_COLORS = {
     'other_label': '#ff00ff',
     'deleted': '#ff0000'
 }
+# outline colors of the parts of a previewed region split
+SPLIT_PREVIEW_COLORS = ['#00ffff', '#ff8000', '#80ff00', '#0080ff', '#ff0080', '#ffffff']
 
 WINDOW_WIDTH = 980
 WINDOW_HEIGHT = 924
 
+# memory budget for the images held in RAM, cold images are spilled to disk
+IMAGE_MEMORY_BUDGET = 2 * 1024 ** 3
+
+# number of worker processes kept for segmentation & pre-processing jobs,
+# each holds its own copy of the images it works on
+JOB_WORKERS = max(1, min(4, multiprocessing.cpu_count() - 1))
+
+# choose the color correction reference from downsampled thumbnails rather
+# than the full resolution images, bounding memory use for large image sets
+LOW_MEMORY_PREPROCESSING = True
+
 PAD_SMALL = 2
 PAD_MEDIUM = 4
 PAD_LARGE = 8
 HANDLE_RADIUS = 4  # not really a radius, just half a side length
 
+# segmentation results are cached here, keyed by image & seg config, the
+# least recently used are removed past seg_cache.DEFAULT_MAX_BYTES
+SEG_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'),
+    '.lungmap_pipeline',
+    'seg_cache'
+)
+
+# local index of LungMAP image metadata, queries are answered from here and
+# refreshed in the background once older than METADATA_TTL seconds
+METADATA_INDEX_FILE = os.path.join(
+    os.path.expanduser('~'),
+    '.lungmap_pipeline',
+    'metadata.sqlite'
+)
+METADATA_TTL = 7 * 24 * 60 * 60
+
+# Region edits are journaled here (in a directory per GUI instance) so they
+# survive a crash, every AUTOSAVE_INTERVAL ms the journal is compacted into a
+# snapshot if it has outgrown the last one
+SESSION_DIR = os.path.join(
+    os.path.expanduser('~'),
+    '.lungmap_pipeline',
+    'sessions'
+)
+AUTOSAVE_INTERVAL = 60 * 1000
+
+# wall time of each seg stage of every segmentation is appended here
+SEG_TIMINGS_LOG = os.path.join(
+    os.path.expanduser('~'),
+    '.lungmap_pipeline',
+    'seg_timings.jsonl'
+)
+
+# time budget (in seconds) for splitting a region, & the choices of the
+# number of parts a region is split into
+SPLIT_TIMEOUT = 10
+SPLIT_PARTS_VALUES = [str(n) for n in range(2, split.SPLIT_MAX_PARTS + 1)]
+
+# saved regions are either a compact binary file or JSON
+REGION_FILE_TYPES = [
+    ('Region files', '*' + region_io.NPZ_EXTENSION),
+    ('JSON', '*.json')
+]
+
+# minimum class probability for a region to be pre-labelled by the model
+PRELABEL_THRESHOLD_VALUES = ['0.50', '0.60', '0.70', '0.80', '0.90', '0.95']
+PRELABEL_DEFAULT_THRESHOLD = '0.80'
+
+# features of up to this many regions (e.g. new parts of a split region)
+# are computed right away rather than in a worker
+FEATURES_INLINE_MAX = 16
+
+# of near duplicate candidates overlapping by more than this (mask IoU),
+# only the largest is kept, the others are dropped unchanged
+NMS_IOU_THRESHOLD = 0.5
+
+# approximate cell radius (in pixels) used to size the segmentation stages
+CELL_RADIUS = 16
+
 DEV_STAGES = [
     "E16.5",
     "E18.5",
@@ -65,16 +150,34 @@ SCALE_VALUES = [
     "1.000"
 ]
 
-PROBES = lungmap_utils.client.get_probes()
+# Local snapshot of the LungMAP probe list, so the window doesn't wait on the
+# network at startup. The list is refreshed in the background once the
+# window is up.
+PROBES_SNAPSHOT_FILE = 'resources/probes.json'
+
+
+def load_probes_snapshot():
+    try:
+        f = open(PROBES_SNAPSHOT_FILE, 'r')
+        probes = json.load(f)
+        f.close()
+    except (FileNotFoundError, ValueError):
+        # no snapshot yet, the probes with known structures will do until
+        # the list is fetched from LungMAP
+        probes = sorted(PROBE_STRUCTURE_MAP.keys())
+
+    return probes
 
 
-class ProgressCallable(object):
-    def __init__(self, progress_var):
-        self.progress_var = progress_var
+def save_probes_snapshot(probes):
+    tmp_file = PROBES_SNAPSHOT_FILE + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(sorted(probes), f, indent=2)
+    f.close()
+    os.replace(tmp_file, PROBES_SNAPSHOT_FILE)
 
-    def __call__(self, progress):
-        scaled_progress = int(progress * 100)
-        self.progress_var.set(scaled_progress)
+
+PROBES = load_probes_snapshot()
 
 
 class Application(tk.Frame):
@@ -93,13 +196,18 @@ class Application(tk.Frame):
             background=BACKGROUND_COLOR
         )
 
-        self.images = {}
+        self.images = ImageStore(memory_budget=IMAGE_MEMORY_BUDGET)
         self.image_dims = None
         self.lm_query_top = None
         self.img_region_lut = {}
+        self.journal = EditJournal(SESSION_DIR)
         self.current_img = None
         self.tk_image = None
         self.current_region_idx = None
+        # regions under the last click & which of them was selected, repeated
+        # clicks on the same spot cycle through overlapping regions
+        self.click_hits = None
+        self.click_hit_pos = 0
         self.points = OrderedDict()
 
         self.rect = None
@@ -110,7 +218,7 @@ class Application(tk.Frame):
         #    - 'find_all': for running the full seg pipeline
         #    - 'find': for segmenting a single region in a drawn rectangle
         #    - 'delete': for deleting one region at a time
-        #    - 'split': for splitting a region into 2 new regions
+        #    - 'split': for splitting a region into 2 or more new regions
         self.mode = tk.StringVar(self.master)
         self.current_dev_stage = tk.StringVar(self.master)
         self.current_dev_stage.set(DEV_STAGES[0])
@@ -133,6 +241,28 @@ class Application(tk.Frame):
         self.canvas_scale = tk.StringVar(self.master)
         self.canvas_scale.set('0.500')
         self.status_progress = tk.IntVar(self.master)
+        self.split_parts = tk.StringVar(self.master)
+        self.split_parts.set(SPLIT_PARTS_VALUES[0])
+        self.split_method = tk.StringVar(self.master)
+        self.split_method.set(split.SPLIT_SPECTRAL)
+        # region being split, its previewed parts & the spectral embeddings
+        # the previews are computed from
+        self.split_target = None
+        self.split_preview = None
+        self.split_seed = 0
+        self.split_embeddings = split.EmbeddingCache()
+        # model (pickled by examples/run_pipeline.py) used to pre-label regions
+        self.model_path = None
+        self.model_name = tk.StringVar(self.master)
+        self.model_name.set("No model loaded")
+        self.prelabel_threshold = tk.StringVar(self.master)
+        self.prelabel_threshold.set(PRELABEL_DEFAULT_THRESHOLD)
+        # (min, max) display filters by region feature name
+        self.feature_ranges = {}
+        self.filter_feature = tk.StringVar(self.master)
+        self.filter_feature.set(region_features.FEATURE_NAMES[0])
+        self.filter_min = tk.StringVar(self.master)
+        self.filter_max = tk.StringVar(self.master)
         self.query_status_var = tk.StringVar(self.master)
 
         self.dev_stage_option = None
@@ -142,8 +272,33 @@ class Application(tk.Frame):
         self.probe3_option = None
         self.query_results_list_box = None
         self.queried_images = {}
+        os.makedirs(os.path.dirname(METADATA_INDEX_FILE), exist_ok=True)
+        self.metadata_index = MetadataIndex(METADATA_INDEX_FILE, ttl=METADATA_TTL)
         self.download_progress_bar = None
         self.ref_img_name = None
+        self.preprocess_cache = preprocess.PreprocessCache(
+            os.path.join(self.images.spill_dir, 'preprocess')
+        )
+        # reference image used for each image's color correction
+        self.corrected_refs = {}
+        self.preprocess_img_names = []
+        self.preprocess_pending = set()
+        self.preprocess_progress = 0
+        self.batch_segmentation_pending = set()
+        # speculative segmentation of the selected & next images: finished
+        # results & running jobs, both as (key, ...) by image name, and the
+        # images whose results were requested before they finished
+        self.speculative_segmentations = {}
+        self.speculative_jobs = {}
+        self.awaiting_speculation = set()
+
+        self.jobs_list_box = None
+        self.jobs = JobScheduler(
+            self,
+            max_workers=JOB_WORKERS,
+            on_change=self.update_jobs_list
+        )
+        self.master.protocol('WM_DELETE_WINDOW', self.on_close)
 
         main_frame = tk.Frame(self.master, bg=BACKGROUND_COLOR)
         main_frame.pack(
@@ -194,10 +349,17 @@ class Application(tk.Frame):
         save_regions_button = ttk.Button(
             file_chooser_button_frame,
             text='Save Regions',
-            command=self.save_regions_json
+            command=self.save_regions
         )
         save_regions_button.pack(side=tk.RIGHT, anchor=tk.N)
 
+        load_regions_button = ttk.Button(
+            file_chooser_button_frame,
+            text='Load Regions',
+            command=self.load_regions
+        )
+        load_regions_button.pack(side=tk.RIGHT, anchor=tk.N)
+
         file_chooser_button_frame.pack(
             anchor='n',
             fill='x',
@@ -305,6 +467,63 @@ class Application(tk.Frame):
         self.find_regions_button.pack(side=tk.LEFT, anchor=tk.N)
         self.find_regions_button.pack_forget()
 
+        self.find_all_regions_button = ttk.Button(
+            image_toolbar_frame,
+            text='Find Regions (All Images)',
+            command=self.find_regions_all_images
+        )
+        self.find_all_regions_button.pack(side=tk.LEFT, anchor=tk.N)
+        self.find_all_regions_button.pack_forget()
+
+        self.split_frame = tk.Frame(image_toolbar_frame, bg=BACKGROUND_COLOR)
+        self.split_frame.pack(
+            fill=tk.X,
+            expand=False,
+            side=tk.RIGHT,
+            padx=0,
+            pady=0
+        )
+        ttk.Button(
+            self.split_frame,
+            text='Apply Split',
+            command=self.apply_split
+        ).pack(side=tk.RIGHT, anchor=tk.N)
+        ttk.Button(
+            self.split_frame,
+            text='Reseed',
+            command=self.reseed_split_preview
+        ).pack(side=tk.RIGHT, anchor=tk.N, padx=PAD_MEDIUM)
+        split_method_option = ttk.Combobox(
+            self.split_frame,
+            textvariable=self.split_method,
+            state='readonly',
+            width=10
+        )
+        split_method_option['values'] = split.SPLIT_METHODS
+        split_method_option.bind('<<ComboboxSelected>>', self.update_split_preview)
+        split_method_option.pack(side=tk.RIGHT, expand=False, padx=0)
+        split_parts_option = ttk.Combobox(
+            self.split_frame,
+            textvariable=self.split_parts,
+            state='readonly',
+            width=3
+        )
+        split_parts_option['values'] = SPLIT_PARTS_VALUES
+        split_parts_option.bind('<<ComboboxSelected>>', self.update_split_preview)
+        split_parts_option.pack(side=tk.RIGHT, expand=False, padx=PAD_MEDIUM)
+
+        ttk.Label(
+            self.split_frame,
+            text="Split into:",
+            background=BACKGROUND_COLOR
+        ).pack(
+            side=tk.RIGHT,
+            fill='none',
+            expand=False,
+            padx=PAD_MEDIUM
+        )
+        self.split_frame.pack_forget()
+
         self.label_frame = tk.Frame(image_toolbar_frame, bg=BACKGROUND_COLOR)
         self.label_frame.pack(
             fill=tk.X,
@@ -514,6 +733,182 @@ class Application(tk.Frame):
             pady=PAD_MEDIUM
         )
 
+        filter_feature_frame = tk.Frame(display_opt_frame, bg=BACKGROUND_COLOR)
+        filter_feature_frame.pack(
+            fill=tk.X,
+            expand=False,
+            anchor=tk.W,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+        ttk.Label(
+            filter_feature_frame,
+            text="Filter regions by:",
+            background=BACKGROUND_COLOR
+        ).pack(
+            side=tk.LEFT,
+            fill='none',
+            expand=False,
+            padx=PAD_MEDIUM
+        )
+        filter_feature_option = ttk.Combobox(
+            filter_feature_frame,
+            values=region_features.FEATURE_NAMES,
+            textvariable=self.filter_feature,
+            state='readonly',
+            width=10
+        )
+        filter_feature_option.bind('<<ComboboxSelected>>', self.select_filter_feature)
+        filter_feature_option.pack(
+            side=tk.RIGHT,
+            fill='none',
+            expand=False,
+            padx=PAD_MEDIUM
+        )
+
+        filter_range_frame = tk.Frame(display_opt_frame, bg=BACKGROUND_COLOR)
+        filter_range_frame.pack(
+            fill=tk.X,
+            expand=False,
+            anchor=tk.W,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+        for text, variable in [("Min:", self.filter_min), ("Max:", self.filter_max)]:
+            ttk.Label(
+                filter_range_frame,
+                text=text,
+                background=BACKGROUND_COLOR
+            ).pack(side=tk.LEFT, padx=PAD_MEDIUM)
+            filter_entry = ttk.Entry(
+                filter_range_frame,
+                textvariable=variable,
+                width=8
+            )
+            filter_entry.bind('<Return>', self.update_feature_filter)
+            filter_entry.bind('<FocusOut>', self.update_feature_filter)
+            filter_entry.pack(side=tk.LEFT)
+
+        clear_filters_button = ttk.Button(
+            display_opt_frame,
+            text='Clear Filters',
+            command=self.clear_feature_filters
+        )
+        clear_filters_button.pack(
+            anchor=tk.E,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        jobs_frame = tk.LabelFrame(
+            middle_right_frame,
+            text="Jobs",
+            background=BACKGROUND_COLOR,
+            foreground=TEXT_COLOR
+        )
+        jobs_frame.pack(
+            fill=tk.X,
+            expand=False,
+            anchor=tk.N,
+            pady=(PAD_LARGE, 0)
+        )
+        self.jobs_list_box = tk.Listbox(
+            jobs_frame,
+            exportselection=False,
+            height=6,
+            relief='flat',
+            borderwidth=0,
+            highlightthickness=0,
+            selectbackground=HIGHLIGHT_COLOR,
+            selectforeground='#ffffff'
+        )
+        self.jobs_list_box.pack(
+            fill=tk.X,
+            expand=False,
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+        cancel_job_button = ttk.Button(
+            jobs_frame,
+            text='Cancel Job',
+            command=self.cancel_selected_job
+        )
+        cancel_job_button.pack(
+            anchor=tk.E,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
+        prelabel_frame = tk.LabelFrame(
+            middle_right_frame,
+            text="Pre-labeling",
+            background=BACKGROUND_COLOR,
+            foreground=TEXT_COLOR
+        )
+        prelabel_frame.pack(
+            fill=tk.X,
+            expand=False,
+            anchor=tk.N,
+            pady=(PAD_LARGE, 0)
+        )
+        ttk.Label(
+            prelabel_frame,
+            textvariable=self.model_name,
+            background=BACKGROUND_COLOR
+        ).pack(
+            anchor=tk.W,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+        load_model_button = ttk.Button(
+            prelabel_frame,
+            text='Load Model',
+            command=self.load_model
+        )
+        load_model_button.pack(
+            anchor=tk.E,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+
+        prelabel_threshold_frame = tk.Frame(prelabel_frame, bg=BACKGROUND_COLOR)
+        prelabel_threshold_frame.pack(
+            fill=tk.X,
+            expand=False,
+            padx=PAD_MEDIUM,
+            pady=PAD_SMALL
+        )
+        ttk.Label(
+            prelabel_threshold_frame,
+            text="Min. probability:",
+            background=BACKGROUND_COLOR
+        ).pack(side=tk.LEFT)
+        prelabel_threshold_option = ttk.Combobox(
+            prelabel_threshold_frame,
+            textvariable=self.prelabel_threshold,
+            state='readonly',
+            width=5
+        )
+        prelabel_threshold_option['values'] = PRELABEL_THRESHOLD_VALUES
+        prelabel_threshold_option.pack(side=tk.RIGHT, expand=False)
+
+        self.prelabel_button = ttk.Button(
+            prelabel_frame,
+            text='Pre-label Regions',
+            command=self.prelabel_regions
+        )
+        self.prelabel_button.pack(
+            anchor=tk.E,
+            side=tk.TOP,
+            padx=PAD_MEDIUM,
+            pady=PAD_MEDIUM
+        )
+
         status_progress_frame = tk.Frame(main_frame, bg=BACKGROUND_COLOR)
         status_progress_frame.pack(
             fill='x',
@@ -560,6 +955,57 @@ class Application(tk.Frame):
 
         self.pack()
 
+        # refresh the probe list once the window is up
+        self.after_idle(self.refresh_probes)
+
+        # restore the regions of a session that didn't end normally
+        if self.journal.has_session():
+            self.after_idle(self.recover_session)
+        self.after(AUTOSAVE_INTERVAL, self.autosave_regions)
+
+    def recover_session(self):
+        self.img_region_lut.update(self.journal.recover())
+
+        self.status_message.set(
+            "Recovered regions for %d images from the previous session" % (
+                len(self.img_region_lut)
+            )
+        )
+
+    def autosave_regions(self):
+        if self.journal.needs_compaction():
+            self.journal.compact(self.img_region_lut)
+
+        self.after(AUTOSAVE_INTERVAL, self.autosave_regions)
+
+    def refresh_probes(self):
+        self.jobs.submit(
+            lungmap_client.fetch_probes,
+            description="Refresh probe list",
+            group='probes',
+            on_done=self.on_probes_fetched,
+            on_error=self.on_probes_fetch_error
+        )
+
+    def on_probes_fetched(self, probes):
+        PROBES[:] = probes
+        save_probes_snapshot(probes)
+
+        # update the query dialog's probe choices if it's open
+        for probe_option in [
+            self.probe1_option,
+            self.probe2_option,
+            self.probe3_option
+        ]:
+            if probe_option is not None and probe_option.winfo_exists():
+                probe_option['values'] = sorted(PROBES)
+
+    def on_probes_fetch_error(self, error):
+        logger.warning("Could not refresh the probe list:\n%s", error)
+        self.status_message.set(
+            "Could not refresh the probe list, using the local copy"
+        )
+
     def display_image_query_dialog(self):
         lm_query_top = tk.Toplevel(bg=BACKGROUND_COLOR)
         lm_query_top.minsize(height=360, width=720)
@@ -852,113 +1298,266 @@ class Application(tk.Frame):
             return
         else:
             self.query_status_var.set('')
-            self.update()
 
-        lm_images = lungmap_utils.client.get_images_by_metadata(
-            dev_stage, mag, probes
-        )
+        # answer from the local index right away, refreshing it from LungMAP
+        # in the background if the results are missing or stale
+        self.show_queried_images(dev_stage, mag, probes)
+
+        if self.metadata_index.is_stale(dev_stage, mag, probes):
+            if len(self.queried_images) == 0:
+                self.query_status_var.set("Querying LungMAP...")
+
+            self.jobs.submit(
+                lungmap_client.fetch_images_by_metadata,
+                args=(dev_stage, mag, probes),
+                description="Query images: %s %s" % (dev_stage, mag),
+                group='query_images',
+                on_done=functools.partial(
+                    self.on_images_fetched,
+                    dev_stage,
+                    mag,
+                    probes
+                ),
+                on_error=self.on_images_fetch_error
+            )
 
+    def show_queried_images(self, dev_stage, mag, probes):
         # clear the list box & queried_images
         self.query_results_list_box.delete(0, tk.END)
         self.queried_images = {}
-        for img in lm_images:
-            url_parts = img['image_url']['value'].split('/')
-            image_name = url_parts[-1]
-
-            probe_colors = [
-                img['color1']['value'],
-                img['color2']['value'],
-                img['color3']['value']
-            ]
 
-            self.queried_images[image_name] = {
-                'url': img['image_url']['value'],
+        for img in self.metadata_index.query(dev_stage, mag, probes):
+            self.queried_images[img['image_name']] = {
+                'url': img['url'],
                 'dev_stage': dev_stage,
                 'mag': mag,
                 'probes': probes,
-                'probe_colors': probe_colors,
+                'probe_colors': img['probe_colors'],
                 'probe_structure_map': PROBE_STRUCTURE_MAP
             }
 
-            self.query_results_list_box.insert(tk.END, image_name)
+            self.query_results_list_box.insert(tk.END, img['image_name'])
+
+    def on_images_fetched(self, dev_stage, mag, probes, images):
+        self.metadata_index.put_query(dev_stage, mag, probes, images)
+
+        # only update the results if the dialog still shows this query
+        query_top_open = self.query_results_list_box is not None and \
+            self.query_results_list_box.winfo_exists()
+        current_query = [
+            self.current_dev_stage.get(),
+            self.current_mag.get(),
+            [
+                self.current_probe1.get(),
+                self.current_probe2.get(),
+                self.current_probe3.get()
+            ]
+        ]
+
+        if query_top_open and current_query == [dev_stage, mag, probes]:
+            self.query_status_var.set('')
+            self.show_queried_images(dev_stage, mag, probes)
+
+    def on_images_fetch_error(self, error):
+        logger.warning("Could not query LungMAP images:\n%s", error)
+        self.query_status_var.set(
+            "Could not reach LungMAP, showing local results"
+        )
 
     def download_images(self):
         self.download_progress_bar.config(maximum=len(self.queried_images))
         for img_name, img_dict in sorted(self.queried_images.items()):
-            image_name, tmp_img = lungmap_utils.client.get_image_from_lungmap(
-                img_dict['url']
+            with tracing.trace('download_image'):
+                image_name, tmp_img = lungmap_utils.client.get_image_from_lungmap(
+                    img_dict['url']
+                )
+
+            with tracing.trace('decode_image', image=image_name):
+                cv_img = cv2.imdecode(
+                    np.frombuffer(
+                        tmp_img,
+                        dtype=np.uint8
+                    ),
+                    cv2.IMREAD_COLOR
+                )
+
+                rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+                del cv_img
+
+            # a re-downloaded image replaces any earlier pre-processing,
+            # including that of images color corrected against it. Their
+            # corrected images are mapped from the cache files, so they're
+            # dropped before the files are removed.
+            for corr_img_name, ref_img_name in list(self.corrected_refs.items()):
+                if image_name in (corr_img_name, ref_img_name):
+                    self.images.remove_corrected(corr_img_name)
+                    del self.corrected_refs[corr_img_name]
+                    self.invalidate_split_embeddings(corr_img_name)
+
+            if self.ref_img_name == image_name:
+                self.ref_img_name = None
+
+            self.preprocess_cache.invalidate(image_name)
+            self.speculative_segmentations.pop(image_name, None)
+            self.invalidate_split_embeddings(image_name)
+
+            # HSV is derived from the RGB image by the store when needed
+            self.images.add(
+                image_name,
+                rgb_image,
+                dev_stage=img_dict['dev_stage'],
+                mag=img_dict['mag'],
+                probes=img_dict['probes'],
+                probe_colors=img_dict['probe_colors'],
+                probe_structure_map=img_dict['probe_structure_map']
             )
-
-            cv_img = cv2.imdecode(
-                np.frombuffer(
-                    tmp_img,
-                    dtype=np.uint8
-                ),
-                cv2.IMREAD_COLOR
-            )
-
-            rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-            hsv_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2HSV)
-
-            self.images[image_name] = {
-                'rgb_img': rgb_image,
-                'hsv_img': hsv_image,
-                'corr_rgb_img': None,
-                'dev_stage': img_dict['dev_stage'],
-                'mag': img_dict['mag'],
-                'probes': img_dict['probes'],
-                'probe_colors': img_dict['probe_colors'],
-                'probe_structure_map': img_dict['probe_structure_map']
-            }
             self.file_list_box.insert(tk.END, image_name)
 
             # update progress bar
             self.download_progress_bar.step()
             self.download_progress_bar.update()
 
-    def _preprocess_images(self):
+    def preprocess_images(self):
         # need at least 2 images to do pre-processing since one must be chosen
         # as the reference
         if len(self.images) < 2:
-            self.preprocess_images_button.config(state=tk.NORMAL)
             self.status_message.set("Pre-processing requires at least 2 images")
             return
 
-        sorted_img_names = sorted(self.images.keys())
+        self.status_message.set("Pre-processing images...")
+        self.preprocess_images_button.config(state=tk.DISABLED)
 
-        # for progress status updates
-        process_count = len(sorted_img_names) * 2
-        progress = 0
+        # Pre-processing is a chain of jobs: luminance correction of each
+        # image, choosing the reference, then color correction of each image.
+        # Images already in the cache count as done.
+        self.jobs.cancel_group('preprocess')
+        self.preprocess_img_names = sorted(self.images.keys())
+        self.preprocess_pending = set()
+        self.preprocess_progress = 0
         self.status_progress.set(0)
 
-        luminance_corrected_imgs = []
-        for img_name in sorted_img_names:
-            lum_corr_img = ifmap_utils.non_uniformity_correction(
-                self.images[img_name]['hsv_img']
+        cache = self.preprocess_cache
+        cache.remove_stale()
+
+        for img_name in self.preprocess_img_names:
+            if cache.has_luminance(img_name):
+                self.step_preprocess_progress()
+                continue
+
+            self.preprocess_pending.add(img_name)
+
+            # images are handed to the workers as memory-mapped files
+            self.jobs.submit(
+                preprocess.luminance_correct,
+                args=(
+                    self.images.to_file(img_name),
+                    cache.luminance_path(img_name),
+                    cache.thumbnail_path(img_name)
+                ),
+                description="Luminance correction: %s" % img_name,
+                group='preprocess',
+                on_done=functools.partial(self.on_luminance_corrected, img_name),
+                on_error=self.on_preprocess_error
             )
-            luminance_corrected_imgs.append(lum_corr_img)
 
-            progress += 1
-            scaled_progress = int((progress / float(process_count)) * 100)
-            self.status_progress.set(scaled_progress)
+        if len(self.preprocess_pending) == 0:
+            self.choose_color_reference()
 
-        ref_img_idx = ifmap_utils.find_color_correction_reference(
-            luminance_corrected_imgs
+    def step_preprocess_progress(self):
+        process_count = len(self.preprocess_img_names) * 2 + 1
+        self.preprocess_progress += 1
+        scaled_progress = int(
+            (self.preprocess_progress / float(process_count)) * 100
         )
-        self.ref_img_name = sorted_img_names[ref_img_idx]
-
-        progress += 1
-        scaled_progress = int((progress / float(process_count)) * 100)
         self.status_progress.set(scaled_progress)
 
-        corr_rgb_imgs = ifmap_utils.color_correction(
-            luminance_corrected_imgs,
-            ref_img_idx
+    # noinspection PyUnusedLocal
+    def on_luminance_corrected(self, img_name, result):
+        self.preprocess_pending.discard(img_name)
+        self.status_message.set("Luminance corrected %s" % img_name)
+        self.step_preprocess_progress()
+
+        if len(self.preprocess_pending) == 0:
+            self.choose_color_reference()
+
+    def choose_color_reference(self):
+        cache = self.preprocess_cache
+
+        if LOW_MEMORY_PREPROCESSING:
+            # choose the reference from thumbnails, only one full size image
+            # per worker is ever loaded
+            ref_candidate_paths = [
+                cache.thumbnail_path(img_name)
+                for img_name in self.preprocess_img_names
+            ]
+        else:
+            ref_candidate_paths = [
+                cache.luminance_path(img_name)
+                for img_name in self.preprocess_img_names
+            ]
+
+        self.jobs.submit(
+            preprocess.choose_reference,
+            args=(ref_candidate_paths,),
+            description="Choose color correction reference",
+            group='preprocess',
+            on_done=self.on_color_reference_chosen,
+            on_error=self.on_preprocess_error
         )
 
-        for i, img_name in enumerate(sorted_img_names):
-            self.images[img_name]['corr_rgb_img'] = corr_rgb_imgs[i]
+    def on_color_reference_chosen(self, ref_img_idx):
+        self.ref_img_name = self.preprocess_img_names[ref_img_idx]
+        self.step_preprocess_progress()
+
+        cache = self.preprocess_cache
+
+        for img_name in self.preprocess_img_names:
+            if cache.has_corrected(img_name, self.ref_img_name):
+                self.on_color_corrected(img_name)
+                continue
+
+            self.preprocess_pending.add(img_name)
+
+            self.jobs.submit(
+                preprocess.color_correct,
+                args=(
+                    cache.luminance_path(self.ref_img_name),
+                    cache.luminance_path(img_name),
+                    cache.corrected_path(img_name, self.ref_img_name)
+                ),
+                description="Color correction: %s" % img_name,
+                group='preprocess',
+                on_done=functools.partial(self.on_color_corrected, img_name),
+                on_error=self.on_preprocess_error
+            )
+
+        if len(self.preprocess_pending) == 0:
+            self.finish_preprocessing()
+
+    # noinspection PyUnusedLocal
+    def on_color_corrected(self, img_name, result=None):
+        # the corrected images are used straight from the cache files, so
+        # they're only paged into memory when displayed or segmented
+        if self.corrected_refs.get(img_name) != self.ref_img_name:
+            self.images.set_corrected(
+                img_name,
+                self.preprocess_cache.load_corrected(img_name, self.ref_img_name)
+            )
+            self.corrected_refs[img_name] = self.ref_img_name
+
+            # regions are now split in the corrected image
+            self.invalidate_split_embeddings(img_name)
+
+        self.step_preprocess_progress()
 
+        if img_name in self.preprocess_pending:
+            self.preprocess_pending.discard(img_name)
+            self.status_message.set("Color corrected %s" % img_name)
+
+            if len(self.preprocess_pending) == 0:
+                self.finish_preprocessing()
+
+    def finish_preprocessing(self):
         self.status_progress.set(100)
 
         self.preprocess_images_button.config(state=tk.NORMAL)
@@ -966,10 +1565,85 @@ class Application(tk.Frame):
 
         self.select_image()
 
-    def preprocess_images(self):
-        self.status_message.set("Pre-processing images...")
-        self.preprocess_images_button.config(state=tk.DISABLED)
-        threading.Thread(target=self._preprocess_images, daemon=True).start()
+    def on_preprocess_error(self, error):
+        # abandon the rest of the chain
+        self.jobs.cancel_group('preprocess')
+        self.preprocess_images_button.config(state=tk.NORMAL)
+        self.on_job_error(error)
+
+    def update_jobs_list(self, jobs):
+        if self.jobs_list_box is None:
+            return
+
+        current_sel = self.jobs_list_box.curselection()
+
+        self.jobs_list_box.delete(0, tk.END)
+        for job in jobs:
+            self.jobs_list_box.insert(tk.END, str(job))
+
+        if len(current_sel) > 0 and current_sel[0] < len(jobs):
+            self.jobs_list_box.selection_set(current_sel[0])
+
+    def cancel_selected_job(self):
+        current_sel = self.jobs_list_box.curselection()
+
+        if len(current_sel) == 0:
+            return
+
+        jobs = self.jobs.jobs
+        if current_sel[0] >= len(jobs):
+            return
+
+        job = jobs[current_sel[0]]
+        self.jobs.cancel(job)
+
+        if job.group == 'preprocess':
+            # the rest of the chain can't run without this job
+            self.jobs.cancel_group('preprocess')
+            self.preprocess_images_button.config(state=tk.NORMAL)
+        elif isinstance(job.group, tuple) and job.group[0] == 'speculate':
+            self.on_speculation_cancelled(job.group[1])
+        elif isinstance(job.group, tuple) and job.group[0] == 'segment':
+            # a batch segmentation won't be waiting for this image anymore
+            self.batch_segmentation_pending.discard(job.group[1])
+
+        self.status_progress.set(0)
+        self.status_message.set("Cancelled %s" % job.description)
+
+    def on_close(self):
+        self.jobs.shutdown()
+        self.metadata_index.close()
+        self.journal.clear()
+        self.master.destroy()
+
+    def get_rgb_path(self, img_name):
+        # path of the memory-mapped RGB image segmentation workers should use
+        if self.images.has_corrected(img_name):
+            return self.images.to_file(img_name, 'corr_rgb')
+
+        return self.images.to_file(img_name, 'rgb')
+
+    def get_hsv_img(self, img_name):
+        # segmentation uses the pre-processed image when there is one, the
+        # HSV conversion is cached by the image store
+        return self.images.get_hsv(
+            img_name,
+            corrected=self.images.has_corrected(img_name)
+        )
+
+    def get_image_structures(self, img_name):
+        # the structures an image's regions can be labelled as, sorted so
+        # label codes are the index + 1
+        structures = self.images[img_name]['probe_structure_map']
+        display_structures = set()
+
+        for probe, structure_map in structures.items():
+            for s in structure_map['surrounded_by']:
+                display_structures.add(s)
+            for s in structure_map['has_part']:
+                display_structures.add(s)
+
+        return sorted(display_structures)
 
     # noinspection PyUnusedLocal
     def select_image(self, event=None):
@@ -979,7 +1653,7 @@ class Application(tk.Frame):
             return
         self.current_img = self.file_list_box.get(current_sel[0])
 
-        has_corr = self.images[self.current_img]['corr_rgb_img'] is not None
+        has_corr = self.images.has_corrected(self.current_img)
 
         if not has_corr:
             self.display_preprocessed.set(False)
@@ -988,21 +1662,13 @@ class Application(tk.Frame):
             self.display_preprocessed_cb.state(['!disabled'])
 
         display_corr = self.display_preprocessed.get()
-        structures = self.images[self.current_img]['probe_structure_map']
-        display_structures = set()
 
-        for probe, structure_map in structures.items():
-            for s in structure_map['surrounded_by']:
-                display_structures.add(s)
-            for s in structure_map['has_part']:
-                display_structures.add(s)
-
-        self.label_option['values'] = sorted(display_structures)
+        self.label_option['values'] = self.get_image_structures(self.current_img)
 
-        if has_corr and display_corr:
-            img_to_display = self.images[self.current_img]['corr_rgb_img']
-        else:
-            img_to_display = self.images[self.current_img]['rgb_img']
+        img_to_display = self.images.get_rgb(
+            self.current_img,
+            corrected=has_corr and display_corr
+        )
 
         image = PIL.Image.fromarray(
             img_to_display,
@@ -1028,6 +1694,11 @@ class Application(tk.Frame):
         )
         self.draw_regions()
 
+        # regions loaded from a file or recovered have no features yet
+        self.compute_region_features(self.current_img)
+
+        self.speculate_segmentation(current_sel[0])
+
     # noinspection PyUnusedLocal
     def select_mode(self, event=None):
         # 'Find Regions',   mode=0
@@ -1037,45 +1708,68 @@ class Application(tk.Frame):
         # 'Label Regions'   mode=4
         mode = self.mode_option.current()
 
+        if mode != 2 and self.split_target is not None:
+            self.clear_split_preview()
+
         if mode == 0:
             self.label_frame.pack_forget()
+            self.split_frame.pack_forget()
             self.find_regions_button.pack(side=tk.LEFT)
+            self.find_all_regions_button.pack(side=tk.LEFT)
         elif mode == 1:
             self.points = OrderedDict()
+        elif mode == 2:
+            self.label_frame.pack_forget()
+            self.find_regions_button.pack_forget()
+            self.find_all_regions_button.pack_forget()
+            self.split_frame.pack(side=tk.RIGHT)
         elif mode == 4:
             self.find_regions_button.pack_forget()
+            self.find_all_regions_button.pack_forget()
+            self.split_frame.pack_forget()
             self.label_frame.pack(side=tk.RIGHT)
         else:
             self.label_frame.pack_forget()
+            self.split_frame.pack_forget()
             self.find_regions_button.pack_forget()
+            self.find_all_regions_button.pack_forget()
+
+    def get_current_label_code(self):
+        current_label = self.current_label.get()
+        if current_label == '':
+            return -1
+
+        return self.label_option['values'].index(current_label) + 1
+
+    def get_visible_regions(self, region_table):
+        return region_table.visible(
+            self.get_current_label_code(),
+            hide_current=self.hide_current_label.get(),
+            hide_other=self.hide_other.get(),
+            hide_unlabelled=self.hide_unlabelled.get(),
+            show_deleted=self.show_deleted.get(),
+            feature_ranges=self.feature_ranges
+        )
 
     def draw_regions(self):
         try:
-            img_region_map = self.img_region_lut[self.current_img]
-            candidates = img_region_map['candidates']
-            labels = img_region_map['labels']
+            region_table = self.img_region_lut[self.current_img]
         except KeyError:
             return
 
         canvas_scale = float(self.canvas_scale.get())
 
         current_label = self.current_label.get()
-        if current_label == '':
-            current_label_code = -1
-        else:
-            current_label_code = self.label_option['values'].index(current_label)
-            current_label_code += 1
+        current_label_code = self.get_current_label_code()
 
-        hide_current = self.hide_current_label.get()
-        hide_other = self.hide_other.get()
-        hide_unlabelled = self.hide_unlabelled.get()
-        show_deleted = self.show_deleted.get()
+        current_count, other_count, unlabelled_count = region_table.label_counts(
+            current_label_code
+        )
+        visible = self.get_visible_regions(region_table)
 
-        current_count = 0
-        other_count = 0
-        unlabelled_count = 0
+        labels = region_table.labels
 
-        for i, c in enumerate(candidates):
+        for i in np.flatnonzero(visible):
             # label codes:
             #     candidate == 0 (means an unlabelled region)
             #     deleted == -1
@@ -1084,7 +1778,6 @@ class Application(tk.Frame):
                 region_type = 'candidate'
                 stipple = None
                 fill = ''
-                unlabelled_count += 1
             elif labels[i] == -1:
                 region_type = 'deleted'
                 stipple = None
@@ -1093,24 +1786,13 @@ class Application(tk.Frame):
                 region_type = 'current_label'
                 stipple = 'gray12'
                 fill = REGION_COLORS[region_type]
-                current_count += 1
             else:
                 region_type = 'other_label'
                 stipple = 'gray25'
                 fill = REGION_COLORS[region_type]
-                other_count += 1
-
-            if hide_current and region_type == 'current_label':
-                continue
-            if hide_other and region_type == 'other_label':
-                continue
-            if hide_unlabelled and region_type == 'candidate':
-                continue
-            if not show_deleted and region_type == 'deleted':
-                continue
 
             self.canvas.create_polygon(
-                list(c.flatten()),
+                list(region_table.contour(i).flatten()),
                 tags=("poly", str(i)),
                 fill=fill,
                 outline=REGION_COLORS[region_type],
@@ -1118,11 +1800,22 @@ class Application(tk.Frame):
                 stipple=stipple
             )
 
+        if self.split_preview is not None and self.split_preview['img_name'] == self.current_img:
+            for i, c in enumerate(self.split_preview['contours']):
+                self.canvas.create_polygon(
+                    list(c.flatten()),
+                    tags="split_preview",
+                    fill='',
+                    outline=SPLIT_PREVIEW_COLORS[i % len(SPLIT_PREVIEW_COLORS)],
+                    dash=(5,),
+                    width=np.ceil(5 * canvas_scale)
+                )
+
         self.canvas.scale(tk.ALL, 0, 0, canvas_scale, canvas_scale)
 
         self.status_message.set(
             "Displaying %d regions, %d %s, %d other labels, %d unlabelled" % (
-                len(candidates),
+                len(region_table),
                 current_count,
                 current_label,
                 other_count,
@@ -1130,26 +1823,273 @@ class Application(tk.Frame):
             )
         )
 
-    def run_segmentation(self, hsv_img, seg_config, cell_size, offset=None, dog_factor=7):
-        progress_callback = ProgressCallable(self.status_progress)
-        candidates = pipeline.generate_structure_candidates(
-            hsv_img,
+    def segmentation_key(self, img_name, seg_config):
+        # identifies a full image segmentation, the result changes with the
+        # source image (e.g. once pre-processed) & the seg config. Uses the
+        # store's version of the image rather than get_rgb_path, which would
+        # write the image to a file on every selection.
+        kind = 'corr_rgb' if self.images.has_corrected(img_name) else 'rgb'
+
+        return json.dumps(
+            [
+                img_name,
+                kind,
+                self.images.version(img_name, kind),
+                normalize_seg_config(seg_config)
+            ],
+            sort_keys=True
+        )
+
+    def speculate_segmentation(self, list_idx):
+        # Starts low priority segmentations of the image at list_idx & the
+        # one after it, so their regions are likely ready by the time the
+        # user asks for them. Speculation for other images is abandoned.
+        cell_size = np.pi * (CELL_RADIUS ** 2)
+        img_names = self.file_list_box.get(list_idx, list_idx + 1)
+
+        # only the results of the selected & next images are kept
+        for img_name in list(self.speculative_segmentations):
+            if img_name not in img_names:
+                del self.speculative_segmentations[img_name]
+
+        for img_name in list(self.speculative_jobs):
+            if self.get_speculative_job(img_name) is None:
+                continue
+            if img_name not in img_names and img_name not in self.awaiting_speculation:
+                self.jobs.cancel(self.speculative_jobs.pop(img_name)[1])
+
+        for img_name in img_names:
+            if img_name in self.img_region_lut:
+                continue
+
+            seg_config = self.build_seg_config(cell_size, img_name=img_name)
+            key = self.segmentation_key(img_name, seg_config)
+
+            speculative = self.speculative_segmentations.get(img_name)
+            if speculative is not None and speculative[0] == key:
+                continue
+
+            speculative_job = self.get_speculative_job(img_name)
+            if speculative_job is not None:
+                if speculative_job[0] == key:
+                    continue
+                self.jobs.cancel(speculative_job[1])
+
+            job = self.jobs.submit(
+                segmentation.segment_image,
+                args=(self.get_rgb_path(img_name), seg_config, cell_size),
+                kwargs={
+                    'cache_dir': SEG_CACHE_DIR,
+                    'iou_threshold': NMS_IOU_THRESHOLD
+                },
+                description="Find regions (speculative): %s" % img_name,
+                group=('speculate', img_name),
+                on_done=functools.partial(
+                    self.on_speculation_done,
+                    img_name,
+                    key
+                ),
+                on_error=functools.partial(self.on_speculation_error, img_name),
+                # records the stage timings, progress is only shown once
+                # the user asks for the result
+                on_progress=ProgressTelemetry(stages=stage_names(seg_config)),
+                priority=PRIORITY_LOW
+            )
+            self.speculative_jobs[img_name] = (key, job)
+
+    def get_speculative_job(self, img_name):
+        # The image's (key, job) speculative segmentation if its job is still
+        # queued or running. Jobs that ended without calling back (e.g.
+        # cancelled from the jobs list) are dropped.
+        speculative_job = self.speculative_jobs.get(img_name)
+
+        if speculative_job is None:
+            return None
+
+        if speculative_job[1].state not in (JOB_QUEUED, JOB_RUNNING):
+            del self.speculative_jobs[img_name]
+            self.awaiting_speculation.discard(img_name)
+            return None
+
+        return speculative_job
+
+    def on_speculation_cancelled(self, img_name):
+        # the user may have been waiting on the cancelled job's result
+        if img_name in self.awaiting_speculation:
+            self.batch_segmentation_pending.discard(img_name)
+            self.find_regions_button.config(state=tk.NORMAL)
+
+        self.get_speculative_job(img_name)
+
+    def on_speculation_done(self, img_name, key, candidates):
+        _, job = self.speculative_jobs.pop(img_name)
+
+        if img_name in self.awaiting_speculation:
+            self.awaiting_speculation.discard(img_name)
+            self.on_segmentation_timed(img_name, None, job.on_progress, candidates)
+        else:
+            self.log_segmentation_timings(
+                job.on_progress,
+                img_name,
+                None,
+                candidates,
+                speculative=True
+            )
+            self.speculative_segmentations[img_name] = (key, candidates)
+
+    def on_speculation_error(self, img_name, error):
+        self.speculative_jobs.pop(img_name, None)
+
+        # only report errors of results the user asked for
+        if img_name in self.awaiting_speculation:
+            self.awaiting_speculation.discard(img_name)
+            self.on_segmentation_error(img_name, error)
+        else:
+            logger.warning("Speculative segmentation of %s failed:\n%s", img_name, error)
+
+    def use_speculation(self, img_name, seg_config, report_progress):
+        # Uses the speculative segmentation of the image if there is one for
+        # this seg config, returns whether there was
+        key = self.segmentation_key(img_name, seg_config)
+        speculative = self.speculative_segmentations.pop(img_name, None)
+
+        if speculative is not None and speculative[0] == key:
+            self.on_segmentation_done(img_name, None, speculative[1])
+            return True
+
+        speculative_job = self.get_speculative_job(img_name)
+
+        if speculative_job is None or speculative_job[0] != key:
+            return False
+
+        # still running or queued, the result is used once it's done
+        job = speculative_job[1]
+        self.awaiting_speculation.add(img_name)
+        self.jobs.set_priority(job, PRIORITY_NORMAL)
+
+        if report_progress:
+            job.on_progress.attach(
+                self.status_progress,
+                self.status_message,
+                "Finding regions: %s" % img_name
+            )
+
+        return True
+
+    def run_segmentation(
+            self,
+            img_name,
             seg_config,
-            filter_min_size=3 * cell_size,
-            dog_factor=dog_factor,
-            process_residual=False,
-            plot=False,
-            progress_callback=progress_callback
-        )
-
-        if self.rect is not None and self.current_img is not None:
-            # there's a rectangle, so we only want one region returned
-            if offset is not None:
-                offset_x = offset[0]
-                offset_y = offset[1]
-            else:
-                offset_x = 0
-                offset_y = 0
+            cell_size,
+            roi=None,
+            dog_factor=7,
+            report_progress=True
+    ):
+        if roi is None and self.use_speculation(img_name, seg_config, report_progress):
+            return
+
+        # a new request for the same image (& kind) supersedes any running one
+        group = ('segment', img_name, roi is not None)
+        self.jobs.cancel_group(group)
+        self.status_progress.set(0)
+
+        if report_progress:
+            telemetry = ProgressTelemetry(
+                self.status_progress,
+                self.status_message,
+                "Finding regions: %s" % img_name,
+                stages=stage_names(seg_config)
+            )
+        else:
+            telemetry = ProgressTelemetry(stages=stage_names(seg_config))
+
+        self.jobs.submit(
+            segmentation.segment_image,
+            args=(self.get_rgb_path(img_name), seg_config, cell_size),
+            kwargs={
+                'roi': roi,
+                'dog_factor': dog_factor,
+                'cache_dir': SEG_CACHE_DIR,
+                'iou_threshold': NMS_IOU_THRESHOLD
+            },
+            description="Find regions: %s" % img_name,
+            group=group,
+            on_done=functools.partial(
+                self.on_segmentation_timed,
+                img_name,
+                roi,
+                telemetry
+            ),
+            on_error=functools.partial(self.on_segmentation_error, img_name),
+            on_progress=telemetry
+        )
+
+    def log_segmentation_timings(self, telemetry, img_name, roi, candidates, speculative=False):
+        # appends the segmentation's stage timings to SEG_TIMINGS_LOG, see
+        # "python -m gui.telemetry" for a summary of the log
+        try:
+            timings = telemetry.dump(
+                SEG_TIMINGS_LOG,
+                image=img_name,
+                roi=roi,
+                candidates=len(candidates),
+                speculative=speculative
+            )
+        except OSError as e:
+            # the log is diagnostic, it must never lose a segmentation
+            logger.warning("Could not write segmentation timings: %s", e)
+            return
+
+        return timings
+
+    def on_segmentation_timed(self, img_name, roi, telemetry, candidates):
+        timings = self.log_segmentation_timings(telemetry, img_name, roi, candidates)
+
+        if timings is not None and telemetry.message_var is not None:
+            self.status_message.set(
+                "Found %d candidates in %.1f s" % (len(candidates), timings['total'])
+            )
+
+        self.on_segmentation_done(img_name, roi, candidates)
+
+    def find_regions_all_images(self):
+        # Segments every loaded image that doesn't have regions yet, starting
+        # with the current image so labeling can begin while the rest of
+        # the images are segmented in parallel
+        cell_size = np.pi * (CELL_RADIUS ** 2)
+
+        img_names = [
+            img_name for img_name in self.file_list_box.get(0, tk.END)
+            if img_name not in self.img_region_lut
+        ]
+        if self.current_img in img_names:
+            img_names.remove(self.current_img)
+            img_names.insert(0, self.current_img)
+
+        if len(img_names) == 0:
+            self.status_message.set("All images already have regions")
+            return
+
+        self.batch_segmentation_pending = set(img_names)
+
+        for img_name in img_names:
+            seg_config = self.build_seg_config(cell_size, img_name=img_name)
+            self.run_segmentation(
+                img_name,
+                seg_config,
+                cell_size,
+                report_progress=False
+            )
+
+        self.status_message.set(
+            "Finding regions for %d images..." % len(img_names)
+        )
+
+    def on_segmentation_done(self, img_name, roi, candidates):
+        if roi is not None:
+            # segmentation was limited to a rectangle, so we only want one
+            # region returned
+            offset_x, offset_y = roi[:2]
 
             biggest_candidate = None
             largest_area = 0
@@ -1158,32 +2098,154 @@ class Application(tk.Frame):
                 area = cv2.contourArea(c)
                 if area > largest_area:
                     biggest_candidate = c + [offset_x, offset_y]
+                    largest_area = area
 
             if biggest_candidate is not None:
-                self.save_contour(biggest_candidate)
+                self.save_contour(biggest_candidate, img_name=img_name)
         else:
-            if self.current_img not in self.img_region_lut:
-                self.img_region_lut[self.current_img] = {}
+            # candidate label = 0, structure labels = 1 -> len(structures)
+            self.img_region_lut[img_name] = RegionTable.from_contours(candidates)
+            self.journal.record_table(img_name, self.img_region_lut[img_name])
+            self.compute_region_features(img_name)
+            self.split_embeddings.invalidate(img_name)
+            if self.split_target is not None and self.split_target[0] == img_name:
+                self.split_target = None
+                self.split_preview = None
 
-            self.img_region_lut[self.current_img]['candidates'] = candidates
+        self.status_progress.set(0)
+        self.find_regions_button.config(state=tk.NORMAL)
 
-            # candidate label = 0, structure labels = 1 -> len(structures)
-            self.img_region_lut[self.current_img]['labels'] = list(
-                np.zeros(len(candidates), dtype=np.uint32)
+        if img_name in self.batch_segmentation_pending:
+            self.batch_segmentation_pending.discard(img_name)
+            self.status_message.set(
+                "Found regions for %s, %d images remaining" % (
+                    img_name,
+                    len(self.batch_segmentation_pending)
+                )
             )
 
-        self.clear_drawn_regions()
-        self.draw_regions()
-        self.status_progress.set(0)
+        if img_name == self.current_img:
+            self.clear_drawn_regions()
+            self.draw_regions()
+
+    def on_segmentation_error(self, img_name, error):
         self.find_regions_button.config(state=tk.NORMAL)
+        self.on_job_error(error)
+
+        if img_name in self.batch_segmentation_pending:
+            self.batch_segmentation_pending.discard(img_name)
+            self.status_message.set(
+                "Could not find regions for %s, %d images remaining" % (
+                    img_name,
+                    len(self.batch_segmentation_pending)
+                )
+            )
+
+    def load_model(self):
+        model_path = filedialog.askopenfilename(
+            filetypes=[('Pickled models', '*.pkl')]
+        )
+        if not model_path:
+            return
+
+        self.model_path = model_path
+        self.model_name.set(os.path.basename(model_path))
+
+    def prelabel_regions(self):
+        # Predicts the structure of the current image's unlabelled regions in
+        # a worker, regions predicted with enough confidence get that label
+        if self.current_img is None or self.current_img not in self.img_region_lut:
+            return
+        if self.model_path is None:
+            self.status_message.set("Load a model first")
+            return
+
+        img_name = self.current_img
+        region_table = self.img_region_lut[img_name]
+        region_idxs = np.flatnonzero(region_table.labels == 0)
+
+        if len(region_idxs) == 0:
+            self.status_message.set("No unlabelled regions to pre-label")
+            return
 
-    def build_seg_config(self, cell_size, kernel_adjustments=(0,)):
-        # build seg config for current image
-        probes = self.images[self.current_img]['probes']
+        self.status_message.set(
+            "Predicting labels for %d regions..." % len(region_idxs)
+        )
+        self.status_progress.set(0)
+
+        self.jobs.submit(
+            prelabel.predict_regions,
+            args=(
+                self.get_rgb_path(img_name),
+                [region_table.contour(i) for i in region_idxs],
+                self.model_path
+            ),
+            description="Pre-label regions: %s" % img_name,
+            group=('prelabel', img_name),
+            on_done=functools.partial(
+                self.on_prelabel_done,
+                img_name,
+                region_table,
+                region_idxs,
+                float(self.prelabel_threshold.get())
+            ),
+            on_error=self.on_job_error,
+            on_progress=ProgressTelemetry(self.status_progress)
+        )
+
+    def on_prelabel_done(self, img_name, region_table, region_idxs, threshold, result):
+        # ignore predictions for a region table that has since been replaced
+        if self.img_region_lut.get(img_name) is not region_table:
+            self.status_progress.set(0)
+            return
+
+        labels = region_table.labels
+        chosen = prelabel.choose_labels(
+            result['probs'],
+            self.get_image_structures(img_name),
+            threshold
+        )
+
+        n_labelled = 0
+
+        for i, label_code in chosen:
+            # regions labelled by hand while the model ran are kept
+            if labels[region_idxs[i]] == 0:
+                self.set_region_label(img_name, region_idxs[i], label_code)
+                n_labelled += 1
+
+        self.status_progress.set(0)
+
+        if img_name == self.current_img:
+            self.clear_drawn_regions()
+            self.draw_regions()
+
+        timings = result['timings']
+        self.status_message.set(
+            "Pre-labelled %d of %d regions in %.1f s (features %.1f s, predict %.1f s)" % (
+                n_labelled,
+                len(region_idxs),
+                sum(timings.values()),
+                timings['features'],
+                timings['predict']
+            )
+        )
+
+    def on_job_error(self, error):
+        logger.error(error)
+        self.status_progress.set(0)
+        self.status_message.set("Error: %s" % error.strip().splitlines()[-1])
+
+    def build_seg_config(self, cell_size, kernel_adjustments=(0,), img_name=None):
+        # build seg config for the given image, defaults to the current image
+        if img_name is None:
+            img_name = self.current_img
+
+        probes = self.images[img_name]['probes']
         probe_colors = [
-            c.lower() for c in self.images[self.current_img]['probe_colors']
+            c.lower() for c in self.images[img_name]['probe_colors']
         ]
-        probe_structure_map = self.images[self.current_img]['probe_structure_map']
+        probe_structure_map = self.images[img_name]['probe_structure_map']
 
         has_part_colors = set()
 
@@ -1276,41 +2338,46 @@ class Application(tk.Frame):
             return
 
         corners = self.canvas.coords(self.rect)
-        corners = tuple([int(c / float(self.canvas_scale.get())) for c in corners])
-
-        if self.images[self.current_img]['corr_rgb_img'] is not None:
-            hsv_img = cv2.cvtColor(
-                self.images[self.current_img]['corr_rgb_img'],
-                cv2.COLOR_RGB2HSV
-            )
-        else:
-            hsv_img = self.images[self.current_img]['hsv_img']
+        corners = [max(0, int(c / float(self.canvas_scale.get()))) for c in corners]
 
-        region = hsv_img[corners[1]:corners[3], corners[0]:corners[2], :]
-        offset = (corners[0], corners[1])
+        # the rectangle may have been drawn in any direction
+        corners = (
+            min(corners[0], corners[2]),
+            min(corners[1], corners[3]),
+            max(corners[0], corners[2]),
+            max(corners[1], corners[3])
+        )
 
         seg_config = self.build_seg_config(cell_size, kernel_adjustments=(-2, 2))
 
         self.status_message.set("Finding regions...")
         dog_factor = 4
-        threading.Thread(
-            target=self.run_segmentation,
-            args=(region, seg_config, cell_size, offset, dog_factor),
-            daemon=True
-        ).start()
-
-    def save_contour(self, contour, label=0):
-        if self.current_img not in self.img_region_lut:
-            self.img_region_lut[self.current_img] = {
-                'labels': [],
-                'candidates': []
-            }
-
-        self.img_region_lut[self.current_img]['labels'].append(label)
-        self.img_region_lut[self.current_img]['candidates'].append(
-            contour
+        self.run_segmentation(
+            self.current_img,
+            seg_config,
+            cell_size,
+            roi=corners,
+            dog_factor=dog_factor
         )
 
+    def save_contour(self, contour, label=0, img_name=None):
+        if img_name is None:
+            img_name = self.current_img
+
+        if img_name not in self.img_region_lut:
+            self.img_region_lut[img_name] = RegionTable()
+
+        self.journal.record_add(img_name, contour, label)
+
+        region_idx = self.img_region_lut[img_name].append(contour, label)
+        self.compute_region_features(img_name, [region_idx])
+
+        return region_idx
+
+    def set_region_label(self, img_name, region_idx, label):
+        self.img_region_lut[img_name].labels[region_idx] = label
+        self.journal.record_label(img_name, region_idx, label)
+
     def find_regions(self):
         # build ifmap pipeline, w/ seg stages based on 'has_part'
         # and 'surrounded_by' probe/structure mappings
@@ -1319,8 +2386,7 @@ class Application(tk.Frame):
         if self.current_img is None:
             return
 
-        cell_radius = 16
-        cell_size = np.pi * (cell_radius ** 2)
+        cell_size = np.pi * (CELL_RADIUS ** 2)
 
         # Next, see if we're evaluating a sub-region
         if self.rect is not None:
@@ -1328,88 +2394,240 @@ class Application(tk.Frame):
             self.find_sub_region(cell_size)
             return
 
-        if self.images[self.current_img]['corr_rgb_img'] is not None:
-            hsv_img = cv2.cvtColor(
-                self.images[self.current_img]['corr_rgb_img'],
-                cv2.COLOR_RGB2HSV
-            )
-        else:
-            hsv_img = self.images[self.current_img]['hsv_img']
-
         seg_config = self.build_seg_config(cell_size)
 
         self.status_message.set("Finding regions...")
-        threading.Thread(
-            target=self.run_segmentation,
-            args=(hsv_img, seg_config, cell_size, None),
-            daemon=True
-        ).start()
+        self.run_segmentation(self.current_img, seg_config, cell_size)
 
     def split_region(self, region_idx):
-        img_region_map = self.img_region_lut[self.current_img]
-        contour = img_region_map['candidates'][region_idx]
-
-        min_x, min_y, w, h = cv2.boundingRect(contour)
-        max_x, max_y = min_x + w, min_y + h
-        mc_x = contour - [min_x, min_y]
-
-        split_mask_x = np.zeros((h, w), dtype=np.uint8)
-        cv2.drawContours(split_mask_x, [mc_x], -1, 1, -1)
-
-        if self.images[self.current_img]['corr_rgb_img'] is not None:
-            hsv_img = cv2.cvtColor(
-                self.images[self.current_img]['corr_rgb_img'],
-                cv2.COLOR_RGB2HSV
+        # Previews splitting the region with the current split options. The
+        # region is only replaced by its parts once the split is applied.
+        img_name = self.current_img
+        self.split_target = (img_name, region_idx)
+
+        n_clusters = int(self.split_parts.get())
+
+        if self.split_method.get() == split.SPLIT_SPECTRAL:
+            region_embedding = self.split_embeddings.get(img_name, region_idx)
+
+            if region_embedding is not None:
+                # clustering the cached embedding is fast enough for the UI
+                # thread, so alternatives are previewed instantly
+                self.show_split_preview(
+                    img_name,
+                    region_idx,
+                    split.split_embedding(region_embedding, n_clusters, seed=self.split_seed)
+                )
+                return
+
+            func = split.compute_embedding
+            kwargs = {}
+            on_done = functools.partial(
+                self.on_embedding_done,
+                img_name,
+                region_idx
             )
         else:
-            hsv_img = self.images[self.current_img]['hsv_img']
+            func = split.split_region
+            kwargs = {
+                'n_clusters': n_clusters,
+                'method': self.split_method.get(),
+                'seed': self.split_seed
+            }
+            on_done = functools.partial(
+                self.show_split_preview,
+                img_name,
+                region_idx
+            )
 
-        # use just the value channel
-        signal_img = hsv_img[min_y:max_y, min_x:max_x, 2]
+        contour = self.img_region_lut[img_name].contour(region_idx)
 
-        # Convert the image into a graph with the value of the gradient on the
-        # edges.
-        region_graph = sk_image.img_to_graph(
-            signal_img,
-            mask=split_mask_x.astype(np.bool)
+        self.status_message.set("Splitting region...")
+
+        # a new preview supersedes any split still running
+        self.jobs.cancel_group('split')
+        self.jobs.submit(
+            func,
+            args=(self.get_rgb_path(img_name), contour),
+            kwargs=kwargs,
+            description="Split region %d: %s" % (region_idx, img_name),
+            group='split',
+            on_done=on_done,
+            on_error=self.on_job_error,
+            timeout=SPLIT_TIMEOUT
         )
 
-        # Take a decreasing function of the gradient: we take it weakly
-        # dependent from the gradient the segmentation is close to a voronoi
-        region_graph.data = np.exp(-region_graph.data / region_graph.data.std())
+    def on_embedding_done(self, img_name, region_idx, region_embedding):
+        self.split_embeddings.put(img_name, region_idx, region_embedding)
+
+        if self.split_target == (img_name, region_idx):
+            self.split_region(region_idx)
 
-        n_clusters = 2
+    def show_split_preview(self, img_name, region_idx, split_contours):
+        # ignore results for a region that is no longer being split
+        if self.split_target != (img_name, region_idx):
+            return
 
-        labels = spectral_clustering(
-            region_graph,
-            n_clusters=n_clusters,
-            eigen_solver='amg',
-            n_init=10
+        self.split_preview = {
+            'img_name': img_name,
+            'region_idx': region_idx,
+            'contours': split_contours
+        }
+
+        if img_name == self.current_img:
+            self.clear_drawn_regions()
+            self.draw_regions()
+
+        self.status_message.set(
+            "Previewing split into %d parts, click 'Apply Split' to keep it" % (
+                len(split_contours)
+            )
         )
 
-        label_im = np.full(split_mask_x.shape, -1.)
-        label_im[split_mask_x.astype(np.bool)] = labels
+    # noinspection PyUnusedLocal
+    def update_split_preview(self, event=None):
+        if self.split_target is not None and self.split_target[0] == self.current_img:
+            self.split_region(self.split_target[1])
 
-        split_contours = []
+    def reseed_split_preview(self):
+        self.split_seed += 1
+        self.update_split_preview()
 
-        for label in range(n_clusters):
-            new_mask = label_im == label
+    def invalidate_split_embeddings(self, img_name):
+        # the image's pixels changed (e.g. it was pre-processed), so the
+        # embeddings & any split preview of its regions are out of date
+        self.split_embeddings.invalidate(img_name)
 
-            contours, _ = cv2.findContours(
-                new_mask.astype(np.uint8),
-                cv2.RETR_EXTERNAL,
-                cv2.CHAIN_APPROX_SIMPLE
-            )
+        if self.split_target is not None and self.split_target[0] == img_name:
+            self.clear_split_preview()
+
+    def clear_split_preview(self):
+        self.jobs.cancel_group('split')
+        self.split_target = None
+        self.split_preview = None
+
+        self.clear_drawn_regions()
+        self.draw_regions()
+
+    def apply_split(self):
+        if self.split_preview is None:
+            return
+
+        img_name = self.split_preview['img_name']
+        region_idx = self.split_preview['region_idx']
+        split_contours = self.split_preview['contours']
+
+        # the split region is marked as deleted
+        self.set_region_label(img_name, region_idx, LABEL_DELETED)
+        self.split_embeddings.invalidate(img_name, region_idx)
 
-            split_contours.append(contours[0] + [min_x, min_y])
+        for c in split_contours:
+            self.save_contour(c, img_name=img_name)
 
-        return split_contours
+        self.clear_split_preview()
+
+        self.status_message.set(
+            "Split region into %d parts" % len(split_contours)
+        )
 
     # noinspection PyUnusedLocal
     def select_label(self, event):
         self.clear_drawn_regions()
         self.draw_regions()
 
+    # noinspection PyUnusedLocal
+    def select_filter_feature(self, event=None):
+        min_value, max_value = self.feature_ranges.get(
+            self.filter_feature.get(),
+            (None, None)
+        )
+        self.filter_min.set('' if min_value is None else str(min_value))
+        self.filter_max.set('' if max_value is None else str(max_value))
+
+    # noinspection PyUnusedLocal
+    def update_feature_filter(self, event=None):
+        # filters only change which regions are displayed, the features
+        # were computed when the regions were found
+        def parse(text):
+            try:
+                return float(text)
+            except ValueError:
+                return None
+
+        feature_range = (parse(self.filter_min.get()), parse(self.filter_max.get()))
+
+        if feature_range == (None, None):
+            self.feature_ranges.pop(self.filter_feature.get(), None)
+        else:
+            self.feature_ranges[self.filter_feature.get()] = feature_range
+
+        self.clear_drawn_regions()
+        self.draw_regions()
+
+    def clear_feature_filters(self):
+        self.feature_ranges = {}
+        self.filter_min.set('')
+        self.filter_max.set('')
+
+        self.clear_drawn_regions()
+        self.draw_regions()
+
+    def compute_region_features(self, img_name, region_idxs=None):
+        # Computes the features of the given regions, or of all regions that
+        # don't have them yet. Large batches are computed in a worker.
+        region_table = self.img_region_lut.get(img_name)
+
+        if region_table is None or img_name not in self.images:
+            return
+        if region_idxs is None:
+            region_idxs = region_table.missing_features()
+        elif region_table.features is None:
+            # all features will be computed once the image is shown
+            return
+
+        if len(region_idxs) == 0:
+            return
+
+        vertices, offsets = pack_contours([region_table.contour(i) for i in region_idxs])
+        args = (
+            self.get_rgb_path(img_name),
+            vertices,
+            offsets,
+            region_table.bboxes[region_idxs]
+        )
+
+        if len(region_idxs) <= FEATURES_INLINE_MAX:
+            region_table.set_features(
+                region_features.compute_features(*args),
+                region_idxs
+            )
+            return
+
+        self.jobs.submit(
+            region_features.compute_features,
+            args=args,
+            description="Region features: %s" % img_name,
+            group=('features', img_name),
+            on_done=functools.partial(
+                self.on_features_done,
+                img_name,
+                region_table,
+                region_idxs
+            ),
+            on_error=self.on_job_error
+        )
+
+    def on_features_done(self, img_name, region_table, region_idxs, features):
+        # ignore features of a region table that has since been replaced
+        if self.img_region_lut.get(img_name) is not region_table:
+            return
+
+        region_table.set_features(features, region_idxs)
+
+        if img_name == self.current_img and self.feature_ranges:
+            self.clear_drawn_regions()
+            self.draw_regions()
+
     def on_draw_button_press(self, event):
         # starting coordinates
         self.start_x = self.canvas.canvasx(event.x)
@@ -1519,7 +2737,10 @@ class Application(tk.Frame):
         if self.current_region_idx is None:
             self.save_contour(new_points)
         else:
-            self.img_region_lut[self.current_img]['candidates'][self.current_region_idx] = new_points
+            self.img_region_lut[self.current_img].set_contour(self.current_region_idx, new_points)
+            self.journal.record_contour(self.current_img, self.current_region_idx, new_points)
+            self.compute_region_features(self.current_img, [self.current_region_idx])
+            self.split_embeddings.invalidate(self.current_img, self.current_region_idx)
 
         self.canvas.delete("dpoly")
         self.canvas.delete("handle")
@@ -1533,21 +2754,47 @@ class Application(tk.Frame):
         self.rect = None
         self.canvas.delete("rect")
         self.canvas.delete("poly")
+        self.canvas.delete("split_preview")
+
+    def save_regions(self):
+        save_path = filedialog.asksaveasfilename(
+            defaultextension=region_io.NPZ_EXTENSION,
+            filetypes=REGION_FILE_TYPES
+        )
+        if not save_path:
+            return
+
+        region_io.save_regions(self.img_region_lut, save_path)
 
-    def save_regions_json(self):
-        save_file = filedialog.asksaveasfile(defaultextension=".json")
-        if save_file is None:
+        self.status_message.set("Saved regions to %s" % os.path.basename(save_path))
+
+    def load_regions(self):
+        load_path = filedialog.askopenfilename(filetypes=REGION_FILE_TYPES)
+        if not load_path:
             return
 
-        def my_converter(o):
-            if isinstance(o, np.ndarray):
-                return o.tolist()
+        loaded_regions = region_io.load_regions(load_path)
+
+        # loaded regions replace those of the same images
+        for img_name in loaded_regions:
+            self.split_embeddings.invalidate(img_name)
+        if self.split_target is not None and self.split_target[0] in loaded_regions:
+            self.split_target = None
+            self.split_preview = None
 
-        json.dump(
-            self.img_region_lut,
-            save_file,
-            indent=2,
-            default=my_converter
+        self.img_region_lut.update(loaded_regions)
+        for img_name, region_table in loaded_regions.items():
+            self.journal.record_table(img_name, region_table)
+        self.click_hits = None
+
+        self.clear_drawn_regions()
+        self.draw_regions()
+
+        self.status_message.set(
+            "Loaded regions for %d images from %s" % (
+                len(loaded_regions),
+                os.path.basename(load_path)
+            )
         )
 
     def on_left_click(self, event):
@@ -1574,7 +2821,38 @@ class Application(tk.Frame):
             # will handle differences in these modes
             self.select_region(event)
 
-    # noinspection PyUnusedLocal
+    def find_clicked_region(self, event):
+        # Resolves a click to a region using the region table's spatial index
+        # rather than Tk's topmost canvas item, so overlapping regions can
+        # all be selected: clicking again on the same regions selects the
+        # next one of them
+        try:
+            region_table = self.img_region_lut[self.current_img]
+        except KeyError:
+            return None
+
+        canvas_scale = float(self.canvas_scale.get())
+        x = self.canvas.canvasx(event.x) / canvas_scale
+        y = self.canvas.canvasy(event.y) / canvas_scale
+
+        visible = self.get_visible_regions(region_table)
+        hits = (
+            self.current_img,
+            tuple(i for i in region_table.regions_at(x, y) if visible[i])
+        )
+
+        if len(hits[1]) == 0:
+            self.click_hits = None
+            return None
+
+        if hits == self.click_hits:
+            self.click_hit_pos = (self.click_hit_pos + 1) % len(hits[1])
+        else:
+            self.click_hits = hits
+            self.click_hit_pos = 0
+
+        return hits[1][self.click_hit_pos]
+
     def select_region(self, event):
         # First, make sure there is a current image
         if self.current_img is None:
@@ -1596,41 +2874,41 @@ class Application(tk.Frame):
         if mode == 3:
             current_label_code = -1
         elif mode == 2:
-            # if splitting a region, the old one will be marked as deleted
-            current_label_code = -1
+            # splitting is handled below
+            current_label_code = None
         elif current_label != '':
             current_label_code = self.label_option['values'].index(current_label)
             current_label_code += 1
         else:
             return
 
-        # Next, check that the object is a polygon by the 'poly' tag we added
-        current_cv_obj = self.canvas.find_withtag(tk.CURRENT)
-        tags = self.canvas.gettags(current_cv_obj[0])
+        # Next, find the displayed regions under the cursor
+        region_idx = self.find_clicked_region(event)
 
-        if 'poly' not in tags:
+        if region_idx is None:
             return
 
-        # if it has a 'poly' tag, then the 2nd tag is our ID (index)
         # Set the corresponding region label to the current label idx + 1
-        region_idx = int(tags[1])
-        img_region_map = self.img_region_lut[self.current_img]
-        labels = img_region_map['labels']
+        labels = self.img_region_lut[self.current_img].labels
 
         if mode == 2:
-            # split region into 2 parts
-            split_contours = self.split_region(region_idx)
-            for c in split_contours:
-                self.save_contour(c)
+            # preview splitting the region into parts, the old one will be
+            # marked as deleted once the split is applied
+            if labels[region_idx] != -1:
+                self.split_region(region_idx)
+            return
+
+        if current_label_code == -1:
+            self.split_embeddings.invalidate(self.current_img, region_idx)
 
         # toggle this region label between current label and unlabelled
         if labels[region_idx] == current_label_code:
-            labels[region_idx] = 0
+            self.set_region_label(self.current_img, region_idx, 0)
         elif labels[region_idx] == -1:
             # toggle a deleted region back to unlabelled
-            labels[region_idx] = 0
+            self.set_region_label(self.current_img, region_idx, 0)
         else:
-            labels[region_idx] = current_label_code
+            self.set_region_label(self.current_img, region_idx, current_label_code)
 
         # finally, redraw regions
         self.clear_drawn_regions()
@@ -1638,6 +2916,9 @@ class Application(tk.Frame):
 
 
 if __name__ == "__main__":
+    # required for worker processes in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     root = themed_tk.ThemedTk()
     root.set_theme('arc')
     app = Application(root)
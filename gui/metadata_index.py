@@ -0,0 +1,190 @@
+import argparse
+import json
+import sqlite3
+import time
+
+# how long query results are trusted before they're refreshed from LungMAP
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+def make_probe_key(probes):
+    # queries match the same images regardless of probe order
+    return '|'.join(sorted(probes))
+
+
+class MetadataIndex(object):
+    """
+    Local index of LungMAP image metadata (image URL, development stage,
+    magnification, probes & probe colors), populated from past queries or
+    bulk-loaded from a JSON dump, so image queries don't need the network.
+
+    Each query (dev stage, mag, probe set) records when it was last fetched
+    from LungMAP, which is used to decide if its results are stale.
+    """
+    def __init__(self, db_path, ttl=DEFAULT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                image_name TEXT NOT NULL,
+                dev_stage TEXT NOT NULL,
+                mag TEXT NOT NULL,
+                probe_key TEXT NOT NULL,
+                probes TEXT NOT NULL,
+                probe_colors TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_metadata
+                ON images (dev_stage, mag, probe_key);
+            CREATE TABLE IF NOT EXISTS queries (
+                dev_stage TEXT NOT NULL,
+                mag TEXT NOT NULL,
+                probe_key TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (dev_stage, mag, probe_key)
+            );
+            """
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def fetched_at(self, dev_stage, mag, probes):
+        # time the query was last fetched from LungMAP, None if never
+        row = self.conn.execute(
+            "SELECT fetched_at FROM queries "
+            "WHERE dev_stage = ? AND mag = ? AND probe_key = ?",
+            (dev_stage, mag, make_probe_key(probes))
+        ).fetchone()
+
+        return None if row is None else row[0]
+
+    def is_stale(self, dev_stage, mag, probes):
+        fetched_at = self.fetched_at(dev_stage, mag, probes)
+
+        return fetched_at is None or time.time() - fetched_at > self.ttl
+
+    def query(self, dev_stage, mag, probes):
+        """
+        Returns the known images for the given metadata as a list of dicts
+        with keys 'url', 'image_name' & 'probe_colors', where the probe
+        colors are in the same order as the given probes.
+        """
+        rows = self.conn.execute(
+            "SELECT url, image_name, probes, probe_colors FROM images "
+            "WHERE dev_stage = ? AND mag = ? AND probe_key = ? "
+            "ORDER BY image_name",
+            (dev_stage, mag, make_probe_key(probes))
+        )
+
+        images = []
+
+        for url, image_name, row_probes, row_colors in rows:
+            probe_colors = dict(zip(json.loads(row_probes), json.loads(row_colors)))
+
+            images.append(
+                {
+                    'url': url,
+                    'image_name': image_name,
+                    'probe_colors': [probe_colors[p] for p in probes]
+                }
+            )
+
+        return images
+
+    def _insert_images(self, dev_stage, mag, probes, images):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    img['url'],
+                    img['image_name'],
+                    dev_stage,
+                    mag,
+                    make_probe_key(probes),
+                    json.dumps(list(probes)),
+                    json.dumps(list(img['probe_colors']))
+                ) for img in images
+            ]
+        )
+
+    def put_query(self, dev_stage, mag, probes, images, fetched_at=None):
+        # replaces the results of a query with freshly fetched ones, images
+        # no longer returned by LungMAP are removed
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM images "
+                "WHERE dev_stage = ? AND mag = ? AND probe_key = ?",
+                (dev_stage, mag, make_probe_key(probes))
+            )
+            self._insert_images(dev_stage, mag, probes, images)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)",
+                (dev_stage, mag, make_probe_key(probes), fetched_at)
+            )
+
+    def load_dump(self, dump_file):
+        """
+        Bulk-loads image metadata from a JSON file containing a list of
+        dicts with keys 'url', 'dev_stage', 'mag', 'probes' & 'probe_colors'.
+        Loaded queries are considered stale, so they are still refreshed
+        from LungMAP when the network is available.
+        """
+        f = open(dump_file, 'r')
+        records = json.load(f)
+        f.close()
+
+        with self.conn:
+            for rec in records:
+                img = {
+                    'url': rec['url'],
+                    'image_name': rec['url'].split('/')[-1],
+                    'probe_colors': rec['probe_colors']
+                }
+                self._insert_images(rec['dev_stage'], rec['mag'], rec['probes'], [img])
+
+        return len(records)
+
+    def save_dump(self, dump_file):
+        rows = self.conn.execute(
+            "SELECT url, dev_stage, mag, probes, probe_colors FROM images "
+            "ORDER BY url"
+        )
+        records = [
+            {
+                'url': url,
+                'dev_stage': dev_stage,
+                'mag': mag,
+                'probes': json.loads(probes),
+                'probe_colors': json.loads(probe_colors)
+            } for url, dev_stage, mag, probes, probe_colors in rows
+        ]
+
+        f = open(dump_file, 'w')
+        json.dump(records, f, indent=2)
+        f.close()
+
+        return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load or save a LungMAP metadata dump')
+    parser.add_argument('db_path')
+    parser.add_argument('--load', help='JSON dump to load into the index')
+    parser.add_argument('--save', help='JSON file to save the index to')
+    args = parser.parse_args()
+
+    index = MetadataIndex(args.db_path)
+
+    if args.load is not None:
+        print("Loaded %d images" % index.load_dump(args.load))
+    if args.save is not None:
+        print("Saved %d images" % index.save_dump(args.save))
+
+    index.close()
@@ -0,0 +1,74 @@
+import pickle
+import time
+from common import tracing
+from gui.segmentation import load_hsv_img
+
+
+def load_model(model_path):
+    # A model pickled by examples/run_pipeline.py: a dict with the trained
+    # 'model' & its 'categories'
+    f = open(model_path, 'rb')
+    pck = pickle.load(f)
+    f.close()
+
+    return pck['model'], pck['categories']
+
+
+def predict_regions(rgb_path, contours, model_path, reporter=None):
+    """
+    Predicts the structure of each contour with a model trained by ifmap's
+    pipeline.fit. All contours are featurized & predicted in one batch.
+
+    Runs in a worker process of the GUI's job scheduler. Returns the class
+    probabilities (a dict per contour, in the same order) & the time taken
+    by each step.
+    """
+    # ifmap is slow to import & only needed in the worker
+    from ifmap import pipeline
+
+    timings = {}
+
+    t_start = time.perf_counter()
+    model, categories = load_model(model_path)
+    hsv_img = load_hsv_img(rgb_path)
+    timings['load'] = time.perf_counter() - t_start
+
+    if reporter is not None:
+        reporter(0.1)
+
+    t_start = time.perf_counter()
+    with tracing.trace('process_test_data', regions=len(contours)):
+        test_data_processed = pipeline.process_test_data(hsv_img, contours)
+    timings['features'] = time.perf_counter() - t_start
+
+    if reporter is not None:
+        reporter(0.7)
+
+    t_start = time.perf_counter()
+    with tracing.trace('predict', regions=len(contours)):
+        pred_results = pipeline.predict(test_data_processed, model, categories)
+    timings['predict'] = time.perf_counter() - t_start
+
+    return {
+        'probs': [r['prob'] for r in pred_results],
+        'timings': timings
+    }
+
+
+def choose_labels(probs, structures, threshold):
+    # Returns (index, label code) of the predictions confident enough to
+    # pre-assign, label codes are the index in the sorted structures + 1.
+    # Predicted classes that aren't one of the structures are ignored.
+    label_codes = {s: i + 1 for i, s in enumerate(sorted(structures))}
+    chosen = []
+
+    for i, prob in enumerate(probs):
+        if len(prob) == 0:
+            continue
+
+        category, value = max(prob.items(), key=lambda item: item[1])
+
+        if value >= threshold and category in label_codes:
+            chosen.append((i, label_codes[category]))
+
+    return chosen
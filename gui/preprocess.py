@@ -0,0 +1,172 @@
+import os
+import numpy as np
+from common import tracing
+from gui.image_store import hashed_file_name
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+# longest side (in pixels) of the thumbnails used to choose the color
+# correction reference
+THUMBNAIL_SIZE = 256
+
+
+def save_array(path, img):
+    # write to a temp file first so an interrupted worker never leaves a
+    # truncated file behind in the cache
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, img)
+    os.replace(tmp_path, path)
+
+
+def load_array(path):
+    return np.load(path, mmap_mode='r')
+
+
+def make_thumbnail(img, max_dim=THUMBNAIL_SIZE):
+    height, width = img.shape[:2]
+    scale = max_dim / float(max(height, width))
+
+    if scale >= 1.0:
+        return np.array(img)
+
+    return cv2.resize(
+        np.asarray(img),
+        (max(1, int(width * scale)), max(1, int(height * scale))),
+        interpolation=cv2.INTER_AREA
+    )
+
+
+def luminance_correct(rgb_path, dst_path, thumb_path, reporter=None):
+    # runs in a worker process, images are exchanged as memory-mapped files
+    # ifmap is slow to import & only needed in the worker
+    from ifmap import utils as ifmap_utils
+
+    rgb_img = load_array(rgb_path)
+    hsv_img = cv2.cvtColor(np.asarray(rgb_img), cv2.COLOR_RGB2HSV)
+
+    with tracing.trace('non_uniformity_correction'):
+        lum_corr_img = ifmap_utils.non_uniformity_correction(hsv_img)
+    save_array(dst_path, lum_corr_img)
+
+    # the thumbnail lets the reference be chosen without having every full
+    # resolution image in memory at the same time
+    save_array(thumb_path, make_thumbnail(lum_corr_img))
+
+    return dst_path
+
+
+def choose_reference(img_paths, reporter=None):
+    # runs in a worker process, img_paths are either the thumbnails or the
+    # full resolution luminance corrected images
+    from ifmap import utils as ifmap_utils
+
+    imgs = [np.load(path) for path in img_paths]
+
+    return ifmap_utils.find_color_correction_reference(imgs)
+
+
+def color_correct(ref_path, src_path, dst_path, reporter=None):
+    # runs in a worker process, the color transfer only depends on the
+    # reference & target images, so each image is corrected on its own
+    from ifmap import utils as ifmap_utils
+
+    ref_img = np.asarray(load_array(ref_path))
+    src_img = np.asarray(load_array(src_path))
+
+    with tracing.trace('color_correction'):
+        corr_rgb_img = ifmap_utils.color_correction([ref_img, src_img], 0)[1]
+    save_array(dst_path, corr_rgb_img)
+
+    return dst_path
+
+
+class PreprocessCache(object):
+    """
+    On-disk cache of pre-processing results. Luminance corrected images are
+    stored per image, color corrected images per (image, reference) pair, so
+    adding an image to a set only requires processing the new image unless
+    the color correction reference changes.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # invalidated files that couldn't be removed yet, e.g. still mapped
+        # on Windows, they count as missing until they are
+        self._stale_paths = set()
+
+    def luminance_path(self, img_name):
+        return os.path.join(
+            self.cache_dir,
+            '%s.lum.npy' % hashed_file_name(img_name)
+        )
+
+    def thumbnail_path(self, img_name):
+        return os.path.join(
+            self.cache_dir,
+            '%s.thumb.npy' % hashed_file_name(img_name)
+        )
+
+    def corrected_path(self, img_name, ref_img_name):
+        return os.path.join(
+            self.cache_dir,
+            '%s.%s.corr.npy' % (
+                hashed_file_name(img_name),
+                hashed_file_name(ref_img_name)
+            )
+        )
+
+    def has_luminance(self, img_name):
+        return (
+            self._exists(self.luminance_path(img_name)) and
+            self._exists(self.thumbnail_path(img_name))
+        )
+
+    def has_corrected(self, img_name, ref_img_name):
+        return self._exists(self.corrected_path(img_name, ref_img_name))
+
+    def load_luminance(self, img_name):
+        return load_array(self.luminance_path(img_name))
+
+    def load_thumbnail(self, img_name):
+        return np.load(self.thumbnail_path(img_name))
+
+    def load_corrected(self, img_name, ref_img_name):
+        return load_array(self.corrected_path(img_name, ref_img_name))
+
+    def invalidate(self, img_name):
+        # remove the image's own results as well as images color corrected
+        # using it as the reference, file names are '<key>.<kind>.npy' or
+        # '<key>.<ref key>.corr.npy' (plus '.tmp' while being written)
+        img_key = hashed_file_name(img_name)
+
+        for file_name in os.listdir(self.cache_dir):
+            name_parts = file_name.split('.')
+
+            if name_parts[0] == img_key or (
+                    len(name_parts) > 2 and
+                    name_parts[2] == 'corr' and
+                    name_parts[1] == img_key):
+                self._stale_paths.add(os.path.join(self.cache_dir, file_name))
+
+        self.remove_stale()
+
+    def remove_stale(self):
+        for path in list(self._stale_paths):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # still memory-mapped somewhere, try again next time
+                continue
+
+            self._stale_paths.discard(path)
+
+    def _exists(self, path):
+        return path not in self._stale_paths and os.path.exists(path)
@@ -0,0 +1,126 @@
+import numpy as np
+from common import tracing
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+SHAPE_FEATURES = ('area', 'perimeter', 'solidity', 'eccentricity')
+COLOR_FEATURES = ('hue', 'saturation', 'value')
+FEATURE_NAMES = SHAPE_FEATURES + COLOR_FEATURES
+
+
+@tracing.traced()
+def shape_features(vertices, offsets, bboxes):
+    """
+    Area, perimeter, solidity & eccentricity of all packed contours. Apart
+    from the convex hulls needed for solidity, these are computed for all
+    contours at once from sums over the polygon edges.
+    """
+    n_regions = len(offsets) - 1
+    features = {name: np.full(n_regions, np.nan) for name in SHAPE_FEATURES}
+
+    starts, ends = offsets[:-1], offsets[1:]
+    non_empty = ends > starts
+
+    if not non_empty.any():
+        return features
+
+    starts, ends = starts[non_empty], ends[non_empty]
+    lengths = ends - starts
+
+    # shift each contour to its bounding box origin, keeping the sums below
+    # well within float precision
+    origins = np.repeat(bboxes[non_empty, :2], lengths, axis=0)
+    xy = vertices.astype(np.float64) - origins
+    x, y = xy[:, 0], xy[:, 1]
+
+    # the vertex following each vertex, wrapping around within its contour
+    next_idx = np.arange(1, len(vertices) + 1)
+    next_idx[ends - 1] = starts
+    x_next, y_next = x[next_idx], y[next_idx]
+
+    def contour_sums(values):
+        return np.add.reduceat(values, starts)
+
+    cross = x * y_next - x_next * y
+    signed_area = contour_sums(cross) / 2.0
+    area = np.abs(signed_area)
+
+    perimeter = contour_sums(np.hypot(x_next - x, y_next - y))
+
+    # second moments of the polygon (Green's theorem), normalized by area
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx = contour_sums((x + x_next) * cross) / (6.0 * signed_area)
+        cy = contour_sums((y + y_next) * cross) / (6.0 * signed_area)
+        mu20 = contour_sums((x * x + x * x_next + x_next * x_next) * cross) / (12.0 * signed_area) - cx ** 2
+        mu02 = contour_sums((y * y + y * y_next + y_next * y_next) * cross) / (12.0 * signed_area) - cy ** 2
+        mu11 = contour_sums(
+            (x * y_next + 2 * x * y + 2 * x_next * y_next + x_next * y) * cross
+        ) / (24.0 * signed_area) - cx * cy
+
+        half_diff = np.sqrt(((mu20 - mu02) / 2.0) ** 2 + mu11 ** 2)
+        major = (mu20 + mu02) / 2.0 + half_diff
+        minor = (mu20 + mu02) / 2.0 - half_diff
+        eccentricity = np.sqrt(np.clip(1.0 - minor / major, 0.0, 1.0))
+
+    hull_areas = np.array(
+        [
+            cv2.contourArea(cv2.convexHull(vertices[s:e].reshape(-1, 1, 2)))
+            for s, e in zip(starts, ends)
+        ]
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        solidity = area / hull_areas
+
+    features['area'][non_empty] = area
+    features['perimeter'][non_empty] = perimeter
+    features['solidity'][non_empty] = solidity
+    features['eccentricity'][non_empty] = eccentricity
+
+    return features
+
+
+@tracing.traced()
+def color_features(rgb_img, vertices, offsets, bboxes):
+    # mean HSV of each region, only each region's bounding box is read so
+    # rgb_img can be a memory-mapped image
+    n_regions = len(offsets) - 1
+    features = {name: np.full(n_regions, np.nan) for name in COLOR_FEATURES}
+
+    for i in range(n_regions):
+        x1, y1, x2, y2 = bboxes[i]
+
+        if offsets[i + 1] == offsets[i] or x2 <= x1 or y2 <= y1:
+            continue
+
+        hsv_crop = cv2.cvtColor(
+            np.ascontiguousarray(rgb_img[y1:y2, x1:x2]),
+            cv2.COLOR_RGB2HSV
+        )
+        mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        contour = vertices[offsets[i]:offsets[i + 1]].reshape(-1, 1, 2) - [x1, y1]
+        cv2.drawContours(mask, [contour.astype(np.int32)], -1, 1, -1)
+
+        means = cv2.mean(hsv_crop, mask=mask)
+
+        for name, mean in zip(COLOR_FEATURES, means):
+            features[name][i] = mean
+
+    return features
+
+
+def compute_features(rgb_path, vertices, offsets, bboxes, reporter=None):
+    # can run in a worker process of the GUI's job scheduler
+    features = shape_features(vertices, offsets, bboxes)
+
+    if reporter is not None:
+        reporter(0.2)
+
+    rgb_img = np.load(rgb_path, mmap_mode='r')
+    features.update(color_features(rgb_img, vertices, offsets, bboxes))
+
+    return features
@@ -0,0 +1,137 @@
+import itertools
+import json
+import os
+import numpy as np
+from gui.region_table import RegionTable
+
+# Saved regions are either JSON, in the original layout of
+#     {image name: {'candidates': [contour, ...], 'labels': [code, ...]}}
+# written compactly one image at a time, or the binary .npz format which
+# stores each image's flat region table arrays directly & is much faster to
+# save & load for large annotation sessions.
+NPZ_EXTENSION = '.npz'
+
+
+def save_regions_json(img_region_lut, path):
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        f.write('{')
+
+        for i, (img_name, region_table) in enumerate(sorted(img_region_lut.items())):
+            if i > 0:
+                f.write(',')
+
+            f.write('\n%s:{"candidates":[' % json.dumps(img_name))
+
+            for j, contour in enumerate(region_table.contours()):
+                if j > 0:
+                    f.write(',')
+                f.write(json.dumps(contour.tolist(), separators=(',', ':')))
+
+            f.write('],"labels":%s}' % json.dumps(region_table.labels.tolist()))
+
+        f.write('\n}\n')
+
+    # the previous save is only replaced once the new one is complete
+    os.replace(tmp_path, path)
+
+
+def save_regions_npz(img_region_lut, path, metadata=None):
+    # metadata is an optional JSON serializable dict stored with the regions
+    arrays = {}
+    img_names = sorted(img_region_lut)
+
+    for i, img_name in enumerate(img_names):
+        region_table = img_region_lut[img_name]
+        arrays['labels_%d' % i] = region_table.labels
+        arrays['vertices_%d' % i] = region_table.vertices
+        arrays['offsets_%d' % i] = region_table.offsets
+
+    if metadata is not None:
+        arrays['metadata'] = np.array(json.dumps(metadata))
+
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, image_names=np.array(img_names, dtype=np.str_), **arrays)
+
+    # the previous save is only replaced once the new one is complete
+    os.replace(tmp_path, path)
+
+
+def save_regions(img_region_lut, path):
+    if path.lower().endswith(NPZ_EXTENSION):
+        save_regions_npz(img_region_lut, path)
+    else:
+        save_regions_json(img_region_lut, path)
+
+
+def _pack_json_candidates(candidates):
+    # converts a saved image's contours to flat vertices & offsets with a
+    # single array conversion rather than one per contour
+    offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(c) for c in candidates])
+
+    try:
+        vertices = np.array(
+            list(itertools.chain.from_iterable(candidates)),
+            dtype=np.int32
+        ).reshape(-1, 2)
+    except ValueError:
+        # drawn polygons saved by older versions are (n, 2) rather than the
+        # OpenCV (n, 1, 2) shape, so the points can't be stacked together
+        vertices = np.concatenate(
+            [np.array(c, dtype=np.int32).reshape(-1, 2) for c in candidates]
+        )
+
+    return vertices, offsets
+
+
+def load_regions_json(path):
+    f = open(path, 'r')
+    regions = json.load(f)
+    f.close()
+
+    img_region_lut = {}
+
+    for img_name, img_regions in regions.items():
+        vertices, offsets = _pack_json_candidates(img_regions['candidates'])
+
+        img_region_lut[img_name] = RegionTable.from_arrays(
+            # files saved by older versions have null labels
+            [0 if label is None else label for label in img_regions['labels']],
+            vertices,
+            offsets
+        )
+
+    return img_region_lut
+
+
+def load_regions_npz(path):
+    img_region_lut = {}
+
+    with np.load(path) as npz:
+        for i, img_name in enumerate(npz['image_names']):
+            img_region_lut[str(img_name)] = RegionTable.from_arrays(
+                npz['labels_%d' % i],
+                npz['vertices_%d' % i],
+                npz['offsets_%d' % i]
+            )
+
+    return img_region_lut
+
+
+def load_npz_metadata(path):
+    with np.load(path) as npz:
+        if 'metadata' not in npz:
+            return {}
+
+        return json.loads(str(npz['metadata']))
+
+
+def load_regions(path):
+    if path.lower().endswith(NPZ_EXTENSION):
+        return load_regions_npz(path)
+
+    return load_regions_json(path)
@@ -0,0 +1,264 @@
+import numpy as np
+from common.seg_cache import pack_contours
+from common.spatial import GridIndex
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+# label codes:
+#     candidate == 0 (means an unlabelled region)
+#     deleted == -1
+#     >0 means sorted labels index + 1
+LABEL_CANDIDATE = 0
+LABEL_DELETED = -1
+
+
+def as_vertices(contour):
+    # (n, 2) int32 vertices of a contour, drawn polygons have float points
+    return np.rint(np.asarray(contour).reshape(-1, 2)).astype(np.int32)
+
+
+def measure_all(vertices, offsets):
+    # bounding boxes & (shoelace formula) areas of all packed contours
+    n_regions = len(offsets) - 1
+    bboxes = np.zeros((n_regions, 4), dtype=np.int64)
+    areas = np.zeros(n_regions, dtype=np.float64)
+
+    starts, ends = offsets[:-1], offsets[1:]
+    non_empty = ends > starts
+
+    if not non_empty.any():
+        return bboxes, areas
+
+    starts = starts[non_empty]
+    x = vertices[:, 0].astype(np.int64)
+    y = vertices[:, 1].astype(np.int64)
+
+    bboxes[non_empty, 0] = np.minimum.reduceat(x, starts)
+    bboxes[non_empty, 1] = np.minimum.reduceat(y, starts)
+    bboxes[non_empty, 2] = np.maximum.reduceat(x, starts) + 1
+    bboxes[non_empty, 3] = np.maximum.reduceat(y, starts) + 1
+
+    # the vertex following each vertex, wrapping around within its contour
+    next_idx = np.arange(1, len(vertices) + 1)
+    next_idx[ends[non_empty] - 1] = starts
+    cross = x * y[next_idx] - x[next_idx] * y
+    areas[non_empty] = np.abs(np.add.reduceat(cross, starts)) / 2.0
+
+    return bboxes, areas
+
+
+class RegionTable(object):
+    """
+    The regions of one image, stored as arrays rather than a list per
+    region: a label code, bounding box (x1, y1, x2, y2 with x2 & y2
+    exclusive) & area per region, and all contour vertices in one flat array
+    with the offset of each region's first vertex.
+
+    Contours are returned as views into the vertex array in the OpenCV
+    shape (n, 1, 2).
+
+    Point lookups use a grid index over the bounding boxes, built on first
+    use & kept up to date as regions are added or changed.
+
+    Once computed, per region features (see region_features) are kept in
+    'features', a dict of arrays by feature name. Rows of regions added or
+    changed since are NaN until they are computed.
+    """
+    def __init__(self):
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.bboxes = np.zeros((0, 4), dtype=np.int64)
+        self.areas = np.zeros(0, dtype=np.float64)
+        self.vertices = np.zeros((0, 2), dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.features = None
+        self._index = None
+
+    @classmethod
+    def from_contours(cls, contours, labels=None):
+        vertices, offsets = pack_contours([as_vertices(c) for c in contours])
+
+        if labels is None:
+            labels = np.zeros(len(offsets) - 1, dtype=np.int32)
+
+        return cls.from_arrays(labels, vertices, offsets)
+
+    @classmethod
+    def from_arrays(cls, labels, vertices, offsets):
+        # builds a table from its flat storage (e.g. a saved session), the
+        # boxes & areas of all regions are computed at once
+        table = cls()
+
+        table.vertices = np.asarray(vertices, dtype=np.int32).reshape(-1, 2)
+        table.offsets = np.asarray(offsets, dtype=np.int64)
+        table.labels = np.asarray(labels, dtype=np.int32).reshape(len(table.offsets) - 1)
+        table.bboxes, table.areas = measure_all(table.vertices, table.offsets)
+
+        return table
+
+    @staticmethod
+    def _measure(contour):
+        c = contour.reshape(-1, 1, 2)
+        x, y, w, h = cv2.boundingRect(c)
+
+        return [x, y, x + w, y + h], cv2.contourArea(c)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def contour(self, idx):
+        return self.vertices[self.offsets[idx]:self.offsets[idx + 1]].reshape(-1, 1, 2)
+
+    def contours(self):
+        return [self.contour(i) for i in range(len(self))]
+
+    def append(self, contour, label=LABEL_CANDIDATE):
+        contour = as_vertices(contour)
+        bbox, area = self._measure(contour)
+
+        self.vertices = np.concatenate([self.vertices, contour])
+        self.offsets = np.append(self.offsets, len(self.vertices))
+        self.labels = np.append(self.labels, np.int32(label))
+        self.bboxes = np.concatenate([self.bboxes, [bbox]])
+        self.areas = np.append(self.areas, area)
+
+        if self._index is not None:
+            self._index.insert(len(self) - 1, bbox)
+
+        if self.features is not None:
+            for name in self.features:
+                self.features[name] = np.append(self.features[name], np.nan)
+
+        return len(self) - 1
+
+    def set_contour(self, idx, contour):
+        # replaces a region's contour, shifting the vertices of the regions
+        # stored after it
+        contour = as_vertices(contour)
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+
+        self.vertices = np.concatenate(
+            [self.vertices[:start], contour, self.vertices[end:]]
+        )
+        self.offsets[idx + 1:] += len(contour) - (end - start)
+        self.bboxes[idx], self.areas[idx] = self._measure(contour)
+
+        if self._index is not None:
+            self._index.remove(idx)
+            self._index.insert(idx, self.bboxes[idx])
+
+        if self.features is not None:
+            for name in self.features:
+                self.features[name][idx] = np.nan
+
+    def set_features(self, features, region_idxs=None):
+        # sets the features of all regions, or of just the given regions
+        if region_idxs is None:
+            self.features = {name: np.asarray(v, dtype=np.float64) for name, v in features.items()}
+            return
+
+        if self.features is None:
+            self.features = {name: np.full(len(self), np.nan) for name in features}
+
+        for name, values in features.items():
+            self.features[name][region_idxs] = values
+
+    def missing_features(self):
+        # indices of regions whose features haven't been computed
+        if self.features is None or len(self.features) == 0:
+            return np.arange(len(self))
+
+        return np.flatnonzero(np.isnan(next(iter(self.features.values()))))
+
+    def spatial_index(self):
+        if self._index is None:
+            # size the grid cells to the typical region, so a point lookup
+            # only checks a handful of regions however many there are
+            if len(self) > 0:
+                sides = np.maximum(
+                    self.bboxes[:, 2] - self.bboxes[:, 0],
+                    self.bboxes[:, 3] - self.bboxes[:, 1]
+                )
+                cell_size = max(16, int(np.median(sides)))
+            else:
+                cell_size = 64
+
+            self._index = GridIndex(cell_size=cell_size)
+
+            for i, bbox in enumerate(self.bboxes):
+                self._index.insert(i, bbox)
+
+        return self._index
+
+    def label_counts(self, current_label_code):
+        # number of current label, other label & unlabelled regions
+        labels = self.labels
+
+        if current_label_code > 0:
+            current = np.count_nonzero(labels == current_label_code)
+        else:
+            current = 0
+
+        other = np.count_nonzero(labels > 0) - current
+        unlabelled = np.count_nonzero(labels == LABEL_CANDIDATE)
+
+        return current, other, unlabelled
+
+    def visible(
+            self,
+            current_label_code,
+            hide_current=False,
+            hide_other=False,
+            hide_unlabelled=False,
+            show_deleted=False,
+            feature_ranges=None
+    ):
+        # boolean mask of the regions shown with the given display options,
+        # feature_ranges maps feature names to (min, max) ranges where either
+        # may be None. Regions whose features are unknown aren't filtered.
+        labels = self.labels
+        is_current = np.logical_and(labels == current_label_code, labels > 0)
+        is_other = np.logical_and(labels > 0, ~is_current)
+
+        visible = np.ones(len(labels), dtype=np.bool_)
+
+        if hide_current:
+            visible &= ~is_current
+        if hide_other:
+            visible &= ~is_other
+        if hide_unlabelled:
+            visible &= labels != LABEL_CANDIDATE
+        if not show_deleted:
+            visible &= labels != LABEL_DELETED
+
+        if feature_ranges and self.features is not None:
+            for name, (min_value, max_value) in feature_ranges.items():
+                values = self.features[name]
+                known = ~np.isnan(values)
+
+                if min_value is not None:
+                    visible &= ~known | (values >= min_value)
+                if max_value is not None:
+                    visible &= ~known | (values <= max_value)
+
+        return visible
+
+    def regions_at(self, x, y):
+        # indices of the regions containing the point (x, y), smallest first
+        # as those are the hardest to click
+        hits = [
+            i for i in self.spatial_index().query_point(int(x), int(y))
+            if cv2.pointPolygonTest(self.contour(i), (float(x), float(y)), False) >= 0
+        ]
+
+        return sorted(hits, key=lambda i: (self.areas[i], i))
+
+    def to_dict(self):
+        # same layout as the original list based regions
+        return {
+            'candidates': [c.tolist() for c in self.contours()],
+            'labels': self.labels.tolist()
+        }
@@ -0,0 +1,63 @@
+import numpy as np
+from common import nms, seg_cache, tracing
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+
+@tracing.traced()
+def load_hsv_img(rgb_path, roi=None):
+    # Loads the HSV image from a memory-mapped RGB image file, if given an
+    # ROI (x1, y1, x2, y2) only that part of the image is read & converted
+    rgb_img = np.load(rgb_path, mmap_mode='r')
+
+    if roi is not None:
+        x1, y1, x2, y2 = roi
+        rgb_img = rgb_img[y1:y2, x1:x2]
+
+    return cv2.cvtColor(np.ascontiguousarray(rgb_img), cv2.COLOR_RGB2HSV)
+
+
+def segment_image(
+        rgb_path,
+        seg_config,
+        cell_size,
+        roi=None,
+        dog_factor=7,
+        cache_dir=seg_cache.DEFAULT_CACHE_DIR,
+        iou_threshold=nms.DEFAULT_IOU_THRESHOLD,
+        reporter=None
+):
+    # runs in a worker process of the GUI's job scheduler
+    if reporter is not None:
+        # lets the GUI tell time spent queued from time spent segmenting
+        reporter(0.0)
+
+    hsv_img = load_hsv_img(rgb_path, roi)
+
+    with tracing.trace('generate_structure_candidates', stages=len(seg_config)):
+        candidates = seg_cache.generate_structure_candidates(
+            hsv_img,
+            seg_config,
+            cache_dir=cache_dir,
+            filter_min_size=3 * cell_size,
+            dog_factor=dog_factor,
+            process_residual=False,
+            plot=False,
+            progress_callback=reporter
+        )
+
+    # overlapping seg stages (e.g. multiple kernel sizes) produce many near
+    # duplicate candidates, only the largest of each is kept
+    if iou_threshold is not None:
+        with tracing.trace('suppress_duplicates', candidates=len(candidates)):
+            candidates = nms.suppress_duplicates(candidates, iou_threshold)
+
+    if reporter is not None:
+        # marks the end of post-processing for the GUI's stage timings
+        reporter(1.0)
+
+    return candidates
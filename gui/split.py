@@ -0,0 +1,373 @@
+from collections import OrderedDict
+import numpy as np
+from common import tracing
+
+# weird import style to un-confuse PyCharm
+try:
+    from cv2 import cv2
+except ImportError:
+    import cv2
+
+SPLIT_SPECTRAL = 'spectral'
+SPLIT_WATERSHED = 'watershed'
+SPLIT_METHODS = (SPLIT_SPECTRAL, SPLIT_WATERSHED)
+
+# Spectral clustering is done on a downsampled copy of the region with at
+# most this many pixels, the eigen-decomposition is what makes full
+# resolution graphs of large structures so slow
+SPECTRAL_MAX_PIXELS = 4096
+
+# Convergence tolerance of the eigenvectors, exact (0) convergence takes
+# twice as long for differences far too small to change the clustering
+SPECTRAL_EIGEN_TOL = 1e-6
+
+# largest number of parts a region can be split into
+SPLIT_MAX_PARTS = 6
+
+# number of region embeddings kept for split previews
+EMBEDDING_CACHE_SIZE = 32
+
+# max number of region pixels clustered to place the watershed markers
+WATERSHED_MAX_SEED_POINTS = 10000
+
+
+def load_region(rgb_path, contour):
+    # Reads just the region's bounding box from the memory-mapped RGB image,
+    # returns the RGB crop, the region mask & the box offset
+    min_x, min_y, w, h = cv2.boundingRect(contour)
+
+    rgb_img = np.load(rgb_path, mmap_mode='r')
+    rgb_crop = np.ascontiguousarray(rgb_img[min_y:min_y + h, min_x:min_x + w])
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.drawContours(mask, [contour - [min_x, min_y]], -1, 1, -1)
+
+    return rgb_crop, mask, (min_x, min_y)
+
+
+def fill_unlabelled(label_img, mask):
+    # assigns mask pixels left without a label (e.g. lost when upsampling) the
+    # label of the nearest labelled pixel
+    missing = np.logical_and(mask > 0, label_img < 0)
+    labelled = label_img >= 0
+
+    if not missing.any() or not labelled.any():
+        return label_img
+
+    # Labels each pixel with the index of its nearest labelled pixel, with
+    # labelled pixels indexed in row-major order starting at 1. Split
+    # previews run this on the GUI thread, so it's done with cv2 rather
+    # than importing scipy.
+    _, nearest = cv2.distanceTransformWithLabels(
+        np.logical_not(labelled).astype(np.uint8),
+        cv2.DIST_L2,
+        cv2.DIST_MASK_5,
+        labelType=cv2.DIST_LABEL_PIXEL
+    )
+
+    nearest_labels = np.zeros(np.count_nonzero(labelled) + 1, dtype=label_img.dtype)
+    nearest_labels[nearest[labelled]] = label_img[labelled]
+    label_img[missing] = nearest_labels[nearest[missing]]
+
+    return label_img
+
+
+class RegionEmbedding(object):
+    """
+    Spectral embedding of a region's (downsampled) pixels. Computing the
+    affinity graph & its eigenvectors is the slow part of a spectral split,
+    clustering the embedding into any number of parts (up to the number of
+    components) is fast, so the embedding is kept to preview alternatives.
+    """
+    def __init__(self, maps, small_mask, mask, offset):
+        self.maps = maps
+        self.small_mask = small_mask
+        self.mask = mask
+        self.offset = offset
+
+    @property
+    def max_parts(self):
+        return self.maps.shape[1]
+
+
+def gradient_graph(signal_img, mask):
+    # Sparse affinity graph of the mask's pixels, 4-connected neighbours are
+    # joined by an edge weighted by a decreasing function of the gradient
+    # between them, so a cut of the graph follows intensity edges
+    from scipy import sparse
+
+    node_ids = np.full(mask.shape, -1, dtype=np.int64)
+    node_ids[mask] = np.arange(np.count_nonzero(mask))
+    values = signal_img.astype(np.float64)
+
+    rows = []
+    cols = []
+    gradients = []
+
+    for ids_a, ids_b, values_a, values_b in [
+        (node_ids[:, :-1], node_ids[:, 1:], values[:, :-1], values[:, 1:]),
+        (node_ids[:-1, :], node_ids[1:, :], values[:-1, :], values[1:, :])
+    ]:
+        joined = np.logical_and(ids_a >= 0, ids_b >= 0)
+        rows.append(ids_a[joined])
+        cols.append(ids_b[joined])
+        gradients.append(np.abs(values_a[joined] - values_b[joined]))
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    gradients = np.concatenate(gradients)
+
+    # Take a decreasing function of the gradient: we take it weakly
+    # dependent from the gradient the segmentation is close to a voronoi.
+    # Gradients are scaled by the spread of all the values of sklearn's
+    # img_to_graph graph, i.e. including the pixel values on its diagonal.
+    scale = np.concatenate([gradients, gradients, values[mask]]).std() + 1e-6
+    weights = np.exp(-gradients / scale)
+
+    n_nodes = len(values[mask])
+
+    return sparse.csr_matrix(
+        (
+            np.concatenate([weights, weights]),
+            (np.concatenate([rows, cols]), np.concatenate([cols, rows]))
+        ),
+        shape=(n_nodes, n_nodes)
+    )
+
+
+@tracing.traced()
+def spectral_embedding(rgb_crop, mask, offset, max_parts=SPLIT_MAX_PARTS, max_pixels=SPECTRAL_MAX_PIXELS):
+    # only scipy's sparse module is used, scikit-learn takes longer to
+    # import than the embedding takes to compute
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+
+    h, w = mask.shape
+    scale = min(1.0, np.sqrt(max_pixels / float(max(1, mask.sum()))))
+    small_w, small_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+    # use just the value channel
+    signal_img = cv2.cvtColor(rgb_crop, cv2.COLOR_RGB2HSV)[:, :, 2]
+    signal_img = cv2.resize(signal_img, (small_w, small_h), interpolation=cv2.INTER_AREA)
+    small_mask = cv2.resize(mask, (small_w, small_h), interpolation=cv2.INTER_NEAREST) > 0
+
+    affinity = gradient_graph(signal_img, small_mask)
+    n_nodes = affinity.shape[0]
+    n_components = min(max_parts, n_nodes - 1)
+
+    if n_components < 1:
+        # too small to split, there are no parts to embed
+        return RegionEmbedding(np.zeros((n_nodes, 0), dtype=np.float32), small_mask, mask, offset)
+
+    # The embedding of sklearn's spectral_embedding with the arpack solver
+    # (& so spectral_clustering), but with enough components for the largest
+    # number of parts, the first k of them are the ones for k parts. The
+    # eigenvectors of the smallest eigenvalues of the normalized Laplacian
+    # are found in shift-invert mode as the largest of its negation around 1.
+    degree_sqrt = np.sqrt(np.asarray(affinity.sum(axis=1)).ravel())
+    degree_sqrt[degree_sqrt == 0] = 1
+    degree_inv_sqrt = sparse.diags(1.0 / degree_sqrt)
+
+    laplacian = degree_inv_sqrt @ affinity @ degree_inv_sqrt - sparse.identity(n_nodes)
+
+    v0 = np.random.RandomState(0).uniform(-1, 1, n_nodes)
+    _, vectors = sparse_linalg.eigsh(
+        laplacian.tocsc(),
+        k=n_components,
+        sigma=1.0,
+        which='LM',
+        tol=SPECTRAL_EIGEN_TOL,
+        v0=v0
+    )
+
+    maps = vectors.T[::-1] / degree_sqrt
+
+    # deterministic signs, the largest magnitude entry of each is positive
+    max_abs_idxs = np.argmax(np.abs(maps), axis=1)
+    maps *= np.sign(maps[np.arange(len(maps)), max_abs_idxs])[:, np.newaxis]
+
+    return RegionEmbedding(maps.T.astype(np.float32), small_mask, mask, offset)
+
+
+def cluster_embedding(region_embedding, n_clusters, seed=None):
+    n_clusters = min(n_clusters, region_embedding.max_parts)
+    mask = region_embedding.mask
+
+    if n_clusters < 2:
+        # the region is too small to split & is returned whole
+        return np.where(mask > 0, 0, -1).astype(np.int32), 1
+
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+
+    # k-means++ with the best of 10 runs, like sklearn's k_means
+    _, labels, _ = cv2.kmeans(
+        np.ascontiguousarray(region_embedding.maps[:, :n_clusters]),
+        n_clusters,
+        None,
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 300, 1e-6),
+        10,
+        cv2.KMEANS_PP_CENTERS
+    )
+    labels = labels.ravel()
+
+    small_mask = region_embedding.small_mask
+    h, w = mask.shape
+
+    label_img = np.full(small_mask.shape, -1, dtype=np.int32)
+    label_img[small_mask] = labels
+
+    label_img = cv2.resize(label_img, (w, h), interpolation=cv2.INTER_NEAREST)
+    label_img[mask == 0] = -1
+
+    return fill_unlabelled(label_img, mask), n_clusters
+
+
+@tracing.traced()
+def watershed_labels(rgb_crop, mask, n_clusters, seed=None):
+    # Seeds one marker per part at the centers of a k-means clustering of
+    # the region's pixel positions, then floods the image from them so the
+    # split follows intensity edges
+    ys, xs = np.nonzero(mask)
+    points = np.column_stack([xs, ys]).astype(np.float32)
+
+    # a subsample of the pixels locates the centers just as well
+    step = max(1, len(points) // WATERSHED_MAX_SEED_POINTS)
+    points = points[::step]
+
+    # k-means needs at least one point per part
+    n_clusters = min(n_clusters, len(points))
+    if n_clusters < 2:
+        return np.where(mask > 0, 0, -1).astype(np.int32)
+
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+
+    _, _, centers = cv2.kmeans(
+        points,
+        n_clusters,
+        None,
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0),
+        3,
+        cv2.KMEANS_PP_CENTERS
+    )
+
+    # region pixels inside the mask, eroded so markers stay clear of the edge
+    inner_mask = cv2.erode(mask, np.ones((3, 3), np.uint8))
+    if not inner_mask.any():
+        inner_mask = mask
+
+    # marker 1 is the background, parts are 2 .. n_clusters + 1
+    markers = np.zeros(mask.shape, dtype=np.int32)
+    markers[mask == 0] = 1
+
+    inner_ys, inner_xs = np.nonzero(inner_mask)
+    for i, (cx, cy) in enumerate(centers):
+        # the center of a non-convex cluster may lie outside the region
+        nearest = np.argmin((inner_xs - cx) ** 2 + (inner_ys - cy) ** 2)
+        markers[inner_ys[nearest], inner_xs[nearest]] = i + 2
+
+    markers = cv2.watershed(cv2.cvtColor(rgb_crop, cv2.COLOR_RGB2BGR), markers)
+
+    label_img = markers - 2
+    # watershed boundaries (-1) & background become unlabelled
+    label_img[label_img < 0] = -1
+    label_img[mask == 0] = -1
+
+    return fill_unlabelled(label_img, mask)
+
+
+def label_contours(label_img, n_clusters, offset):
+    # the largest contour of each part, in image coordinates
+    split_contours = []
+
+    for label in range(n_clusters):
+        contours, _ = cv2.findContours(
+            (label_img == label).astype(np.uint8),
+            cv2.RETR_EXTERNAL,
+            cv2.CHAIN_APPROX_SIMPLE
+        )
+
+        if len(contours) == 0:
+            continue
+
+        contour = max(contours, key=cv2.contourArea)
+        split_contours.append(contour + list(offset))
+
+    return split_contours
+
+
+def compute_embedding(rgb_path, contour, reporter=None):
+    # runs in a worker process of the GUI's job scheduler
+    rgb_crop, mask, offset = load_region(rgb_path, contour)
+
+    if reporter is not None:
+        reporter(0.2)
+
+    return spectral_embedding(rgb_crop, mask, offset)
+
+
+def split_embedding(region_embedding, n_clusters, seed=None):
+    label_img, n_clusters = cluster_embedding(region_embedding, n_clusters, seed=seed)
+
+    return label_contours(label_img, n_clusters, region_embedding.offset)
+
+
+def split_region(
+        rgb_path,
+        contour,
+        n_clusters=2,
+        method=SPLIT_SPECTRAL,
+        seed=None,
+        reporter=None
+):
+    # runs in a worker process of the GUI's job scheduler
+    if method == SPLIT_SPECTRAL:
+        region_embedding = compute_embedding(rgb_path, contour, reporter=reporter)
+
+        return split_embedding(region_embedding, n_clusters, seed=seed)
+    elif method != SPLIT_WATERSHED:
+        raise ValueError("Unknown split method: %s" % method)
+
+    rgb_crop, mask, offset = load_region(rgb_path, contour)
+
+    if reporter is not None:
+        reporter(0.2)
+
+    label_img = watershed_labels(rgb_crop, mask, n_clusters, seed=seed)
+
+    return label_contours(label_img, n_clusters, offset)
+
+
+class EmbeddingCache(object):
+    """
+    Region embeddings keyed by (image name, region index), least recently
+    used entries are dropped once there are more than max_entries. Entries
+    must be invalidated when their region is edited or deleted.
+    """
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, img_name, region_idx):
+        key = (img_name, region_idx)
+
+        if key not in self._entries:
+            return None
+
+        self._entries.move_to_end(key)
+
+        return self._entries[key]
+
+    def put(self, img_name, region_idx, region_embedding):
+        self._entries[(img_name, region_idx)] = region_embedding
+        self._entries.move_to_end((img_name, region_idx))
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, img_name, region_idx=None):
+        # with no region index, all of the image's entries are dropped
+        for key in list(self._entries):
+            if key[0] == img_name and region_idx in (None, key[1]):
+                del self._entries[key]
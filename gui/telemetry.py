@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import time
+
+# minimum time (in seconds) between updates of the progress widgets
+UPDATE_INTERVAL = 0.1
+
+
+def stage_names(seg_config):
+    # e.g. 'saturation 95x95', used to label each seg stage's timings
+    return [
+        '%s %dx%d' % ((stage['type'],) + tuple(stage['args']['blur_kernel']))
+        for stage in seg_config
+    ]
+
+
+class ProgressTelemetry(object):
+    """
+    Receives a job's 0-1 progress values on the GUI thread. The progress bar
+    (an IntVar of 0-100) & status message, showing the current stage & an
+    ETA, are updated at most every min_interval seconds.
+
+    If given the job's stage names, the wall time of each stage is recorded.
+    Stages are timed by the perf_counter() timestamps the worker reported
+    progress at (see JobReporter), so the timings include neither the
+    scheduler's poll interval nor time the GUI thread was busy.
+    Stages are assumed to take equal parts of the progress range, which is
+    how ifmap's generate_structure_candidates reports progress (once per
+    completed seg stage). Stages completing within the same update (e.g.
+    when the result came from the segmentation cache) are timed together.
+    A first progress of 0 marks the job starting, the time until then is
+    recorded as 'queued'.
+    """
+    def __init__(
+            self,
+            progress_var=None,
+            message_var=None,
+            description='',
+            stages=None,
+            min_interval=UPDATE_INTERVAL
+    ):
+        self.progress_var = progress_var
+        self.message_var = message_var
+        self.description = description
+        self.stages = stages or []
+        self.min_interval = min_interval
+
+        self.start_time = time.perf_counter()
+        self.progress = 0.0
+        self.timings = []
+        self._stages_done = 0
+        self._stage_start = self.start_time
+        self._run_start = self.start_time
+        self._last_timestamp = None
+        self._last_update = None
+        self._result = None
+
+    def attach(self, progress_var, message_var=None, description=''):
+        # shows the progress of a job that was already running, e.g. one
+        # started in the background that the user is now waiting for
+        self.progress_var = progress_var
+        self.message_var = message_var
+        self.description = description
+        self._update_widgets(time.perf_counter())
+
+    def __call__(self, progress, timestamp=None):
+        # timestamp is the worker's perf_counter() time of the progress,
+        # defaulting to now for progress reported on the GUI thread
+        now = time.perf_counter()
+        if timestamp is None:
+            timestamp = now
+
+        if progress <= 0 and len(self.timings) == 0 and self.progress == 0:
+            self._record('queued', timestamp)
+            self._run_start = timestamp
+
+        self.progress = progress
+        self._last_timestamp = timestamp
+
+        if self.stages:
+            stages_done = min(len(self.stages), int(progress * len(self.stages) + 1e-6))
+
+            if stages_done > self._stages_done:
+                self._record(' + '.join(self.stages[self._stages_done:stages_done]), timestamp)
+                self._stages_done = stages_done
+
+        if self._last_update is None or progress >= 1.0 or \
+                now - self._last_update >= self.min_interval:
+            self._update_widgets(now)
+
+    def _record(self, name, timestamp):
+        self.timings.append((name, timestamp - self._stage_start))
+        self._stage_start = timestamp
+
+    def eta(self, now=None):
+        # seconds remaining, extrapolated from the progress so far
+        if now is None:
+            now = time.perf_counter()
+        if self.progress <= 0:
+            return None
+
+        return (now - self._run_start) * (1.0 - self.progress) / self.progress
+
+    def current_stage(self):
+        if self._stages_done < len(self.stages):
+            return self.stages[self._stages_done]
+
+        return None
+
+    def _update_widgets(self, now):
+        self._last_update = now
+
+        if self.progress_var is not None:
+            self.progress_var.set(int(self.progress * 100))
+
+        if self.message_var is None:
+            return
+
+        text = self.description
+        stage = self.current_stage()
+
+        if stage is not None:
+            text += " [%s, stage %d/%d]" % (
+                stage,
+                self._stages_done + 1,
+                len(self.stages)
+            )
+
+        eta = self.eta(now)
+        if eta is not None and self.progress < 1.0:
+            text += " ETA %d s" % round(eta)
+
+        self.message_var.set(text)
+
+    def finish(self):
+        # Records the time between the stages & the job's last progress
+        # (e.g. duplicate suppression, for jobs reporting 1.0 once done) &
+        # returns all timings. Jobs that never reported progress are timed
+        # until now.
+        if self._result is not None:
+            return self._result
+
+        end = self._last_timestamp
+        if end is None:
+            end = time.perf_counter()
+
+        if self._stages_done < len(self.stages):
+            self._record(' + '.join(self.stages[self._stages_done:]), end)
+            self._stages_done = len(self.stages)
+
+        self._record('finish', end)
+
+        self._result = {
+            'total': end - self.start_time,
+            'stages': self.timings
+        }
+
+        return self._result
+
+    def dump(self, log_path, **context):
+        # appends the timings & any context (e.g. the image name) to a log
+        # of JSON lines
+        record = dict(context)
+        record.update(self.finish())
+        record['time'] = time.time()
+
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+        return record
+
+
+def summarize_log(log_path):
+    # total & mean wall time of each stage over all logged segmentations,
+    # slowest first
+    totals = {}
+    counts = {}
+
+    f = open(log_path, 'r')
+    for line in f:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+
+        for name, seconds in record['stages']:
+            totals[name] = totals.get(name, 0.0) + seconds
+            counts[name] = counts.get(name, 0) + 1
+    f.close()
+
+    return sorted(
+        [(name, totals[name], totals[name] / counts[name], counts[name]) for name in totals],
+        key=lambda row: row[1],
+        reverse=True
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize a segmentation timings log')
+    parser.add_argument('log_path')
+    args = parser.parse_args()
+
+    print("%-40s %10s %10s %6s" % ('stage', 'total (s)', 'mean (s)', 'runs'))
+    for stage, total, mean, count in summarize_log(args.log_path):
+        print("%-40s %10.2f %10.3f %6d" % (stage, total, mean, count))
@@ -1,21 +1,101 @@
-import ontospy
-import pickle
+import hashlib
+import json
+import os
+import threading
+from collections import deque
 
 LOCAL_ONTOLOGY_FILE = 'resources/lung_ontology.owl'
-PICKLED_ONTOLOGY = 'resources/lung_ontology.pkl'
+ONTOLOGY_INDEX_FILE = 'resources/lung_ontology_index.json'
 
-try:
-    # load pickled ontospy object
-    f = open(PICKLED_ONTOLOGY, 'rb')
-    onto = pickle.load(f)
-    f.close()
-except FileNotFoundError:
-    onto = ontospy.Ontospy(uri_or_path=LOCAL_ONTOLOGY_FILE, rdf_format='xml')
+# bump when the index contents change, forcing a rebuild
+ONTOLOGY_INDEX_VERSION = 1
+
+ONTOLOGY_NS = 'http://www.semanticweb.org/am175/ontologies/2017/1/untitled-ontology-79#'
+CELL_URI = ONTOLOGY_NS + 'cell'
+TISSUE_URI = ONTOLOGY_NS + 'tissue'
+COMPLEX_STRUCTURE_URI = ONTOLOGY_NS + 'complex_structure'
+STRUCTURE_RELATIONS = ('has_part', 'surrounded_by')
+
+_ontology = None
+_ontology_lock = threading.Lock()
+
+
+def get_file_digest(file_path):
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def build_ontology_index(owl_file=LOCAL_ONTOLOGY_FILE):
+    # parsing the OWL file is the slow part, rdflib is only needed here
+    import rdflib
+
+    graph = rdflib.Graph()
+    graph.parse(owl_file, format='xml')
+
+    return OntologyGraph.from_rdflib_graph(graph)
+
+
+def load_ontology_index(owl_file=LOCAL_ONTOLOGY_FILE, index_file=ONTOLOGY_INDEX_FILE):
+    # Loads the compact ontology index (just the relations queried by the
+    # pipeline), rebuilding it from the OWL file if the OWL file changed
+    # since the index was written
+    owl_digest = get_file_digest(owl_file)
+
+    try:
+        f = open(index_file, 'r')
+        index = json.load(f)
+        f.close()
 
-    # pickle the ontology
-    f = open(PICKLED_ONTOLOGY, 'wb')
-    pickle.dump(onto, f)
+        if index['owl_sha256'] == owl_digest and index['version'] == ONTOLOGY_INDEX_VERSION:
+            return OntologyGraph.from_dict(index)
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    onto_graph = build_ontology_index(owl_file)
+
+    index = onto_graph.to_dict()
+    index['owl_sha256'] = owl_digest
+    index['version'] = ONTOLOGY_INDEX_VERSION
+
+    tmp_file = index_file + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(index, f, sort_keys=True, separators=(',', ':'))
     f.close()
+    os.replace(tmp_file, index_file)
+
+    return onto_graph
+
+
+def get_ontology():
+    # The ontology index is loaded on first use rather than at import time
+    global _ontology
+
+    with _ontology_lock:
+        if _ontology is None:
+            _ontology = load_ontology_index()
+
+    return _ontology
+
+
+def load_ontospy_ontology():
+    # full ontospy ontology, only needed for the SPARQL query functions below
+    import ontospy
+
+    return ontospy.Ontospy(uri_or_path=LOCAL_ONTOLOGY_FILE, rdf_format='xml')
+
+
+def preload_ontology():
+    # starts loading the ontology index in a background thread, a later call to
+    # get_ontology() waits for it to finish
+    thread = threading.Thread(target=get_ontology, daemon=True)
+    thread.start()
+
+    return thread
 
 
 def get_onto_protein_uri(ontology, protein_label):
@@ -108,7 +188,9 @@ SELECT ?sub ?label WHERE {
     return results
 
 
-def get_probe_structure_map(ontology, probe_labels):
+def get_probe_structure_map_sparql(ontology, probe_labels):
+    # Original SPARQL implementation, issues one query per probe, cell,
+    # tissue & structure. Kept as the reference for get_probe_structure_map
     probe_uri_dict = {}
     probe_structure_dict = {}
 
@@ -178,3 +260,194 @@ def get_probe_structure_map(ontology, probe_labels):
                         probe_structure_dict[label][rel_type].add(ss[1].value)
 
     return probe_structure_dict
+
+
+class OntologyGraph(object):
+    """
+    The relations used to map probes to structures, extracted once from the
+    ontology into plain dictionaries keyed by class URI:
+
+        protein_synonyms: synonym -> protein URIs (direct sub-classes of Protein)
+        sub_classes:      class URI -> direct sub-class URIs
+        restrictions:     property name -> {target URI -> class URIs}, for
+                          classes that are a sub-class of a restriction
+                          'property some target' (has_part & surrounded_by)
+        preferred_labels: class URI -> LungMAP preferred labels
+
+    The queries mirror the SPARQL queries above, answered by dictionary
+    look-ups & graph traversal instead.
+    """
+    def __init__(self, protein_synonyms, sub_classes, restrictions, preferred_labels):
+        self.protein_synonyms = protein_synonyms
+        self.sub_classes = sub_classes
+        self.restrictions = restrictions
+        self.preferred_labels = preferred_labels
+
+        self._descendants = {}
+
+    @classmethod
+    def from_dict(cls, index):
+        return cls(
+            index['protein_synonyms'],
+            index['sub_classes'],
+            index['restrictions'],
+            index['preferred_labels']
+        )
+
+    def to_dict(self):
+        return {
+            'protein_synonyms': self.protein_synonyms,
+            'sub_classes': self.sub_classes,
+            'restrictions': self.restrictions,
+            'preferred_labels': self.preferred_labels
+        }
+
+    @classmethod
+    def from_ontology(cls, ontology):
+        # accepts an ontospy object or an rdflib graph
+        return cls.from_rdflib_graph(getattr(ontology, 'rdflib_graph', ontology))
+
+    @classmethod
+    def from_rdflib_graph(cls, graph):
+        import rdflib
+        from rdflib.namespace import OWL, RDFS, XSD
+
+        ns = rdflib.Namespace(ONTOLOGY_NS)
+
+        protein_synonyms = {}
+        for protein in graph.subjects(RDFS.subClassOf, ns.Protein):
+            for synonym in graph.objects(protein, ns.has_synonym):
+                # the SPARQL query matches plain string literals only
+                if not isinstance(synonym, rdflib.Literal):
+                    continue
+                if synonym.language is not None:
+                    continue
+                if synonym.datatype not in (None, XSD.string):
+                    continue
+
+                protein_synonyms.setdefault(str(synonym), []).append(str(protein))
+
+        sub_classes = {}
+        for sub, sup in graph.subject_objects(RDFS.subClassOf):
+            sub_classes.setdefault(str(sup), []).append(str(sub))
+
+        restrictions = {rel: {} for rel in STRUCTURE_RELATIONS}
+        for rel in STRUCTURE_RELATIONS:
+            for restriction in graph.subjects(OWL.onProperty, ns[rel]):
+                for target in graph.objects(restriction, OWL.someValuesFrom):
+                    restricted = restrictions[rel].setdefault(str(target), [])
+
+                    for cls_uri in graph.subjects(RDFS.subClassOf, restriction):
+                        restricted.append(str(cls_uri))
+
+        preferred_labels = {}
+        for cls_uri, label in graph.subject_objects(ns.lungmap_preferred_label):
+            preferred_labels.setdefault(str(cls_uri), []).append(label.value)
+
+        # sort for deterministic results regardless of graph order
+        for synonym_uris in protein_synonyms.values():
+            synonym_uris.sort()
+
+        return cls(protein_synonyms, sub_classes, restrictions, preferred_labels)
+
+    def descendants(self, uri):
+        # all classes related to uri by rdfs:subClassOf*, including uri itself
+        if uri not in self._descendants:
+            found = {uri}
+            to_visit = deque([uri])
+
+            while to_visit:
+                for sub in self.sub_classes.get(to_visit.popleft(), []):
+                    if sub not in found:
+                        found.add(sub)
+                        to_visit.append(sub)
+
+            self._descendants[uri] = found
+
+        return self._descendants[uri]
+
+    def get_protein_uri(self, protein_label):
+        protein_uris = self.protein_synonyms.get(protein_label)
+
+        if not protein_uris:
+            return None
+
+        return protein_uris[0]
+
+    def get_related_classes(self, rel, target_uri, root_uri):
+        # classes under root_uri which are a sub-class of 'rel some target'
+        root_descendants = self.descendants(root_uri)
+
+        return [
+            cls_uri for cls_uri in self.restrictions[rel].get(target_uri, [])
+            if cls_uri in root_descendants
+        ]
+
+    def get_labelled_sub_classes(self, uri):
+        return [
+            (sub, label)
+            for sub in self.sub_classes.get(uri, [])
+            for label in self.preferred_labels.get(sub, [])
+        ]
+
+    def get_structures_by_related_uri(self, uri):
+        structures = []
+
+        for rel in STRUCTURE_RELATIONS:
+            for structure in self.get_related_classes(rel, uri, COMPLEX_STRUCTURE_URI):
+                for label in self.preferred_labels.get(structure, []):
+                    structures.append((structure, label, rel))
+
+        return structures
+
+    def get_structures_by_protein(self, protein_uri):
+        structure_dict = {rel: set() for rel in STRUCTURE_RELATIONS}
+
+        cells = self.get_related_classes('has_part', protein_uri, CELL_URI)
+        for cell in list(cells):
+            cells.extend(sub for sub, _ in self.get_labelled_sub_classes(cell))
+
+        related_uris = []
+        for cell in cells:
+            # first check if the cell is directly related to a structure
+            related_uris.append(cell)
+
+            tissues = self.get_related_classes('has_part', cell, TISSUE_URI)
+            for tissue in list(tissues):
+                tissues.extend(sub for sub, _ in self.get_labelled_sub_classes(tissue))
+
+            related_uris.extend(tissues)
+
+        for uri in related_uris:
+            for structure, label, rel in self.get_structures_by_related_uri(uri):
+                structure_dict[rel].add(label)
+
+                for _, sub_label in self.get_labelled_sub_classes(structure):
+                    structure_dict[rel].add(sub_label)
+
+        return structure_dict
+
+
+def get_probe_structure_map(ontology, probe_labels):
+    # ontology may be an OntologyGraph or an ontospy object / rdflib graph,
+    # in which case the relations are extracted first
+    if not isinstance(ontology, OntologyGraph):
+        ontology = OntologyGraph.from_ontology(ontology)
+
+    probe_structure_dict = {}
+
+    for label in probe_labels:
+        protein_uri = ontology.get_protein_uri(label.replace('Anti-', ''))
+
+        if protein_uri is None:
+            continue
+
+        structure_dict = ontology.get_structures_by_protein(protein_uri)
+
+        if label not in probe_structure_dict:
+            probe_structure_dict[label] = structure_dict
+        else:
+            for rel, structures in structure_dict.items():
+                probe_structure_dict[label][rel].update(structures)
+
+    return probe_structure_dict